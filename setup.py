@@ -11,7 +11,7 @@ with open('HISTORY.rst') as history_file:
     HISTORY = history_file.read()
 
 INSTALL_REQUIRES = [
-    'future', 'pandas>=0.19.0', 'numexpr', 'pysam>=0.9.1', 'toolz', 'pyfaidx',
+    'future', 'pandas>=0.23.0', 'numexpr', 'pysam>=0.9.1', 'toolz', 'pyfaidx',
     'scipy', 'intervaltree', 'pathlib2', 'htseq>=0.7.2', 'matplotlib',
     'seaborn', 'typing; python_version < "3.5"'
 ]
@@ -46,7 +46,8 @@ setuptools.setup(
             'imfusion-insertions = imfusion.main.insertions:main',
             'imfusion-ctg = imfusion.main.ctg:main',
             'imfusion-expression = imfusion.main.expression:main',
-            'imfusion-merge = imfusion.main.merge:main'
+            'imfusion-merge = imfusion.main.merge:main',
+            'imfusion-filter = imfusion.main.filter:main'
         ]
     },
     install_requires=INSTALL_REQUIRES,
@@ -11,6 +11,7 @@ from builtins import *
 import argparse
 import logging
 import shutil
+import threading
 from typing import Any, Type, Tuple
 
 import pathlib2 as pathlib
@@ -19,6 +20,8 @@ import pyfaidx
 
 from imfusion.compat import FileExistsError
 from imfusion.external.util import check_dependencies
+from imfusion.insertions.util import (ArrayTranscriptReference,
+                                     TranscriptReference, TransposonFeature)
 from imfusion.util import tabix
 
 from .. import util as build_util
@@ -179,6 +182,13 @@ class Indexer(object):
         tabix.write_gtf_frame(
             gtf_frame_flat, file_path=reference.exon_gtf_path)
 
+        # Build compiled transcript annotation, which can be shared
+        # (memory-mapped) between concurrent imfusion-insertions runs.
+        self._logger.info('Building compiled transcript annotation')
+        annotation = ArrayTranscriptReference.from_gtf(
+            reference.indexed_gtf_path)
+        annotation.save(reference.annotation_path)
+
         # Build augmented reference.
         self._logger.info('Building augmented reference')
 
@@ -312,6 +322,11 @@ class Reference(object):
     for all references. Subclasses may define additional paths that are
     specific to the corresponding aligner.
 
+    Besides paths, references also provide access to loaded reference data
+    (such as the transposon features, the gene annotation and the reference
+    sequence), which are loaded once on first access and are re-used by
+    all samples that are processed using the same reference instance.
+
     Parameters
     ----------
     reference_path : Path
@@ -324,6 +339,10 @@ class Reference(object):
         if not reference_path.exists():
             raise ValueError('Reference path does not exist')
         self._reference = reference_path
+        self._transposon_features = None
+        self._transcript_reference = None
+        self._fasta = None
+        self._lock = threading.Lock()
 
     @property
     def base_path(self):
@@ -355,6 +374,12 @@ class Reference(object):
         """Path to exon gtf."""
         return self._reference / 'exons.gtf'
 
+    @property
+    def annotation_path(self):
+        # type: (...) -> pathlib.Path
+        """Path to compiled (array-based) transcript annotation."""
+        return self._reference / 'annotation'
+
     @property
     def index_path(self):
         # type: (...) -> pathlib.Path
@@ -379,3 +404,42 @@ class Reference(object):
         # type: (...) -> pathlib.Path
         """Path to transposon features."""
         return self._reference / 'features.txt'
+
+    @property
+    def transposon_features(self):
+        # type: (...) -> pandas.DataFrame
+        """Transposon features, read once from the features file."""
+        with self._lock:
+            if self._transposon_features is None:
+                self._transposon_features = TransposonFeature.read_csv(
+                    self.features_path, sep='\t')
+        return self._transposon_features
+
+    @property
+    def fasta(self):
+        # type: (...) -> pyfaidx.Fasta
+        """Reference sequence, opened once from the fasta file."""
+        with self._lock:
+            if self._fasta is None:
+                self._fasta = pyfaidx.Fasta(str(self.fasta_path))
+        return self._fasta
+
+    def transcript_reference(self, workers=1):
+        # type: (int) -> TranscriptReference
+        """Returns the gene annotation of the reference, loaded once.
+
+        Uses the compiled (memory-mapped) annotation if available. Otherwise,
+        the annotation is built from the indexed gtf file using the given
+        number of workers.
+        """
+
+        with self._lock:
+            if self._transcript_reference is None:
+                if self.annotation_path.exists():
+                    self._transcript_reference = \
+                        ArrayTranscriptReference.load(self.annotation_path)
+                else:
+                    self._transcript_reference = \
+                        TranscriptReference.from_gtf(
+                            self.indexed_gtf_path, workers=workers)
+        return self._transcript_reference
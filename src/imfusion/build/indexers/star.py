@@ -6,13 +6,23 @@ from __future__ import absolute_import, division, print_function
 from builtins import *
 # pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
 
-from typing import Any
+from typing import Any, Iterable
 
+import pandas as pd
+import pathlib2 as pathlib
 import toolz
 
 from imfusion.external.star import star_index
+from imfusion.util import tabix
 from .base import Indexer, Reference, register_indexer
 
+SJ_COLUMNS = [
+    'seqname', 'start', 'end', 'strand', 'motif', 'annotated', 'unique_reads',
+    'multi_reads', 'max_overhang'
+]
+
+SJ_STRANDS = {0: '.', 1: '+', 2: '-'}
+
 
 class StarIndexer(Indexer):
     """Indexer that builds references for the STAR aligner.
@@ -24,13 +34,29 @@ class StarIndexer(Indexer):
     (see the ``sjdbOverhang`` parameter in the STAR documentation for more
     details). Ideally, the value for this parameter should be one less than the
     length of the used reads.
+
+    Optionally, splice junctions detected in (a subset of) the samples of a
+    cohort can be inserted into the index using the ``junction_paths``
+    parameter, which takes the ``SJ.out.tab`` files produced by STAR. This
+    allows samples to be aligned single-pass against the junction-augmented
+    index, rather than each sample performing its own two-pass alignment.
     """
 
-    def __init__(self, logger=None, skip_index=False, overhang=100, threads=1):
-        # type: (Any, int) -> None
+    def __init__(self,
+                 logger=None,
+                 skip_index=False,
+                 overhang=100,
+                 threads=1,
+                 junction_paths=None,
+                 min_junction_reads=2,
+                 min_junction_samples=1):
+        # type: (Any, bool, int, int, List[pathlib.Path], int, int) -> None
         super().__init__(logger=logger, skip_index=skip_index)
         self._overhang = overhang
         self._threads = threads
+        self._junction_paths = junction_paths or []
+        self._min_junction_reads = min_junction_reads
+        self._min_junction_samples = min_junction_samples
 
     @property
     def _reference_class(self):
@@ -45,6 +71,25 @@ class StarIndexer(Indexer):
     def _build_indices(self, reference):
         # type: (StarReference) -> None
 
+        if self._junction_paths:
+            self._logger.info('Merging junctions from %d samples',
+                              len(self._junction_paths))
+
+            junctions = merge_junctions(
+                self._junction_paths,
+                annotated=gtf_junctions(reference.gtf_path),
+                min_reads=self._min_junction_reads,
+                min_samples=self._min_junction_samples,
+                exclude_seqnames=[reference.transposon_name])
+            write_junctions(junctions, reference.junctions_path)
+
+            self._logger.info('Inserting %d novel junctions into the index',
+                              len(junctions))
+
+            sjdb_path = reference.junctions_path
+        else:
+            sjdb_path = None
+
         self._logger.info('Building STAR index')
 
         star_index(
@@ -53,6 +98,7 @@ class StarIndexer(Indexer):
             output_dir=reference.index_path,
             overhang=self._overhang,
             threads=self._threads,
+            sjdb_path=sjdb_path,
             log_path=reference.base_path / 'star.log')
 
     @classmethod
@@ -74,22 +120,190 @@ class StarIndexer(Indexer):
         star_group.add_argument('--star_overhang', type=int, default=100)
         star_group.add_argument('--star_threads', type=int, default=1)
 
+        star_group.add_argument(
+            '--star_junctions',
+            nargs='+',
+            type=pathlib.Path,
+            default=None,
+            help=('SJ.out.tab files (produced by STAR for a first-pass '
+                  'subset of samples) containing splice junctions that '
+                  'should be inserted into the index. Samples aligned against '
+                  'this index can be aligned single-pass.'))
+
+        star_group.add_argument(
+            '--star_min_junction_reads',
+            type=int,
+            default=2,
+            help=('Minimum number of uniquely mapping reads supporting a '
+                  'junction within a sample.'))
+
+        star_group.add_argument(
+            '--star_min_junction_samples',
+            type=int,
+            default=1,
+            help='Minimum number of samples supporting a junction.')
+
     @classmethod
     def _parse_args(cls, args):
         super_args = super()._parse_args(args)
         return toolz.merge(super_args, {
             'overhang': args.star_overhang,
-            'threads': args.star_threads
+            'threads': args.star_threads,
+            'junction_paths': args.star_junctions,
+            'min_junction_reads': args.star_min_junction_reads,
+            'min_junction_samples': args.star_min_junction_samples
         })
 
 
 class StarReference(Reference):
     """Star Reference class.
 
-    Defines paths to files within the STAR reference. Currently the same
-    as the base ``Reference`` class.
+    Defines paths to files within the STAR reference. Extends the base
+    ``Reference`` class with the path of the (optional) merged junctions
+    that were inserted into the index.
     """
-    pass
+
+    @property
+    def junctions_path(self):
+        # type: (...) -> pathlib.Path
+        """Path to merged junctions inserted into the index."""
+        return self._reference / 'junctions.txt'
 
 
 register_indexer('star', StarIndexer)
+
+
+def merge_junctions(
+        junction_paths,  # type: Iterable[pathlib.Path]
+        annotated=None,  # type: pd.DataFrame
+        min_reads=2,  # type: int
+        min_samples=1,  # type: int
+        exclude_seqnames=None  # type: List[str]
+):  # type: (...) -> pd.DataFrame
+    """Merges and filters splice junctions from STAR SJ.out.tab files.
+
+    Junctions are retained if they are supported by at least ``min_reads``
+    uniquely mapping reads in at least ``min_samples`` samples. Following
+    the recommendations for STAR two-pass alignment, junctions that are
+    already annotated (and thus already in the index) and non-canonical
+    junctions are dropped, as are junctions on excluded sequences
+    (such as the transposon sequence).
+
+    Annotated junctions are preferably given explicitly (see
+    ``gtf_junctions``), as STAR also marks junctions as annotated in the
+    ``SJ.out.tab`` of a two-pass alignment if they were detected in the
+    first pass. The annotation column of the ``SJ.out.tab`` files is only
+    used if ``annotated`` is not given, which is only reliable for files
+    from single-pass alignments.
+
+    Parameters
+    ----------
+    junction_paths : List[pathlib.Path]
+        Paths to the SJ.out.tab files of the samples.
+    annotated : pd.DataFrame
+        Annotated junctions, containing the columns 'seqname', 'start'
+        and 'end' (as returned by ``gtf_junctions``).
+    min_reads : int
+        Minimum number of uniquely mapping reads supporting a junction
+        within a sample.
+    min_samples : int
+        Minimum number of samples in which a junction should be supported.
+    exclude_seqnames : List[str]
+        Sequences whose junctions should be excluded.
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame of merged junctions, containing the columns 'seqname',
+        'start', 'end' and 'strand'.
+
+    """
+
+    frames = (pd.read_csv(
+        str(path),
+        sep='\t',
+        header=None,
+        names=SJ_COLUMNS,
+        dtype={'seqname': str}) for path in junction_paths)
+
+    index_cols = ['seqname', 'start', 'end', 'strand']
+
+    if annotated is None:
+        supported = (frame.loc[(frame['annotated'] == 0) &
+                               (frame['motif'] > 0) &
+                               (frame['unique_reads'] >= min_reads),
+                               index_cols]
+                     for frame in frames)  # yapf: disable
+    else:
+        supported = (frame.loc[(frame['motif'] > 0) &
+                               (frame['unique_reads'] >= min_reads),
+                               index_cols]
+                     for frame in frames)  # yapf: disable
+
+    merged = pd.concat(supported, ignore_index=True)
+
+    if annotated is not None:
+        annotated_index = pd.MultiIndex.from_frame(
+            annotated[['seqname', 'start', 'end']])
+        is_annotated = pd.MultiIndex.from_frame(
+            merged[['seqname', 'start', 'end']]).isin(annotated_index)
+        merged = merged.loc[~is_annotated]
+
+    if exclude_seqnames:
+        merged = merged.loc[~merged['seqname'].isin(exclude_seqnames)]
+
+    counts = merged.groupby(index_cols).size()
+    counts = counts.loc[counts >= min_samples]
+
+    junctions = counts.reset_index()[index_cols]
+    junctions['strand'] = junctions['strand'].map(SJ_STRANDS)
+
+    return junctions
+
+
+def gtf_junctions(gtf_path):
+    # type: (pathlib.Path) -> pd.DataFrame
+    """Derives the annotated splice junctions from the exons in a GTF file.
+
+    Parameters
+    ----------
+    gtf_path : pathlib.Path
+        Path to the (uncompressed) GTF file.
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame of junctions, containing the columns 'seqname', 'start'
+        and 'end'. Positions refer to the first and last intronic bases
+        (1-based), matching the coordinates used in SJ.out.tab files.
+
+    """
+
+    gtf_frame = tabix.read_gtf_frame(gtf_path)
+
+    exons = gtf_frame.loc[gtf_frame['feature'] == 'exon',
+                          ['seqname', 'start', 'end', 'attribute']]
+    exons = exons.assign(transcript_id=exons['attribute'].str.extract(
+        r'transcript_id "([^"]+)"', expand=False))
+    exons = exons.sort_values(['transcript_id', 'start'])
+
+    # Introns lie between consecutive exons of the same transcript. As
+    # exon starts are zero-based, the start of the next exon is the
+    # (1-based) last intronic base.
+    next_exons = exons.shift(-1)
+    is_intron = ((exons['transcript_id'] == next_exons['transcript_id']) &
+                 (exons['end'] < next_exons['start']))
+
+    junctions = pd.DataFrame({
+        'seqname': exons.loc[is_intron, 'seqname'].values,
+        'start': exons.loc[is_intron, 'end'].values + 1,
+        'end': next_exons.loc[is_intron, 'start'].values.astype(int)
+    }, columns=['seqname', 'start', 'end'])
+
+    return junctions.drop_duplicates().reset_index(drop=True)
+
+
+def write_junctions(junctions, output_path):
+    # type: (pd.DataFrame, pathlib.Path) -> None
+    """Writes junctions in STAR's sjdbFileChrStartEnd format."""
+    junctions.to_csv(str(output_path), sep='\t', index=False, header=False)
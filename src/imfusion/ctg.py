@@ -35,7 +35,8 @@ def test_ctgs(
         chromosomes=None,  # type: Set[str]
         pattern=None,  # type: str
         per_sample=True,  # type: bool
-        window=None  #type: Tuple[int, int]
+        window=None,  #type: Tuple[int, int]
+        gene_windows=None  # type: Dict[str, Tuple[str, int, int]]
 ):
     """Identifies genes that are significantly enriched for insertions (CTGs).
 
@@ -70,6 +71,10 @@ def test_ctgs(
         Window to include around gene (in bp). Specified as (upstream_dist,
         downstream_dist). For example: (2000, 2000) specifies in a 2KB
         window around each gene.
+    gene_windows : Dict[str, Tuple[str, int, int]]
+        Previously built gene windows (see ``build_gene_windows``). If given,
+        ``window`` and ``chromosomes`` are ignored, as these are only used
+        for building the gene windows.
 
     Returns
     -------
@@ -81,26 +86,11 @@ def test_ctgs(
 
     """
 
-    # Default to shared chromosome sequences (typically drops some
-    # of the more esoteric extra scaffold/patch sequences).
-    if chromosomes is None:
-        reference_seq = pyfaidx.Fasta(str(reference.fasta_path))
-        reference_gtf = GtfIterator(reference.indexed_gtf_path)
-
-        chromosomes = list(
-            set(reference_seq.keys()) & set(reference_gtf.contigs))
-
-        if len(chromosomes) == 0:
-            ValueError('No chromosomes are shared between the reference '
-                       'sequence and reference gtf files')
-
-    if len(chromosomes) == 0:
-        raise ValueError('At least one chromosome must be given')
-
     # Determine gene windows using GTF.
-    logging.info('Generating gene windows')
-    gene_windows = _build_gene_windows(
-        reference.indexed_gtf_path, window=window, chromosomes=chromosomes)
+    if gene_windows is None:
+        logging.info('Generating gene windows')
+        gene_windows = build_gene_windows(
+            reference, window=window, chromosomes=chromosomes)
 
     # Subset insertions to gene intervals.
     insertions = _subset_to_windows(insertions, gene_windows)
@@ -116,7 +106,7 @@ def test_ctgs(
 
     # Calculate total number of pattern occurrences within intervals.
     logging.info('Counting pattern occurrences')
-    reference_seq = pyfaidx.Fasta(str(reference.fasta_path))
+    reference_seq = reference.fasta
 
     total = count_total(
         reference_seq, pattern=pattern, intervals=gene_windows.values())
@@ -171,6 +161,50 @@ def test_ctgs(
     return result
 
 
+def build_gene_windows(
+        reference,  # type: Reference
+        window=None,  # type: Tuple[int, int]
+        chromosomes=None  # type: Set[str]
+):  # type: (...) -> Dict[str, Tuple[str, int, int]]
+    """Builds the windows of the reference genes used for testing CTGs.
+
+    Parameters
+    ----------
+    reference : Reference
+        Reference index used by the aligner to identify insertions.
+    window : Tuple[int, int]
+        Window to include around gene (in bp), see ``test_ctgs``.
+    chromosomes : List[str]
+        List of chromosomes to include, defaults to all chromosomes
+        shared between the reference sequence and the reference gtf.
+
+    Returns
+    -------
+    Dict[str, Tuple[str, int, int]]
+        Gene windows, given as (chromosome, start, end) tuples
+        indexed by gene ID.
+
+    """
+
+    # Default to shared chromosome sequences (typically drops some
+    # of the more esoteric extra scaffold/patch sequences).
+    if chromosomes is None:
+        reference_gtf = GtfIterator(reference.indexed_gtf_path)
+
+        chromosomes = list(
+            set(reference.fasta.keys()) & set(reference_gtf.contigs))
+
+        if len(chromosomes) == 0:
+            raise ValueError('No chromosomes are shared between the '
+                             'reference sequence and reference gtf files')
+
+    if len(chromosomes) == 0:
+        raise ValueError('At least one chromosome must be given')
+
+    return _build_gene_windows(
+        reference.indexed_gtf_path, window=window, chromosomes=chromosomes)
+
+
 def _build_gene_windows(
         gtf_path,  # type: pathlib.Path
         window=None,  # type: Optional[Tuple[int, int]]
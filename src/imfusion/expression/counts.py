@@ -25,6 +25,9 @@ import toolz
 
 from imfusion.external.feature_counts import feature_counts
 
+# Map for translating strand options to numeric values used by featureCounts.
+STRANDED_MAP = {'unstranded': 0, 'stranded': 1, 'reverse': 2}
+
 # Disable E1101 checks which stumble on pandas classes.
 # pylint: disable=E1101
 
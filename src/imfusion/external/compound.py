@@ -7,10 +7,85 @@ from .sambamba import sambamba_sort
 from .util import which
 
 
-def sort_bam(input_bam, output_bam, threads=1):
-    """Sorts bam file using sambamba or samtools."""
+def sort_bam(input_bam,
+             output_bam,
+             threads=1,
+             memory=None,
+             tmp_dir=None,
+             index=False):
+    """Sorts bam file using sambamba or samtools.
+
+    Parameters
+    ----------
+    input_bam : Path
+        Path to input (unsorted) bam file.
+    output_bam : Path
+        Path for output (sorted) bam file.
+    threads : int
+        Number of threads to use.
+    memory : str
+        Maximum memory to use per thread when sorting with samtools
+        (for example '768M'). Uses the samtools default if not given.
+    tmp_dir : Path
+        Temporary directory to use.
+    index : bool
+        Whether to index the sorted bam file. If supported by samtools,
+        the index is built whilst writing the sorted bam file.
+
+    """
 
     if which('sambamba') is not None:
-        sambamba_sort(input_bam, output_bam, threads=threads)
+        sambamba_sort(input_bam, output_bam, threads=threads, tmp_dir=tmp_dir)
+        write_index = False
+    else:
+        args = ['-@', str(threads)]
+
+        if memory is not None:
+            args += ['-m', str(memory)]
+
+        if tmp_dir is not None:
+            tmp_dir.mkdir(parents=True, exist_ok=True)
+            args += ['-T', native_str(tmp_dir / output_bam.stem)]
+
+        write_index = index and _supports_write_index()
+
+        if write_index:
+            output_arg = '{0}##idx##{0}.bai'.format(native_str(output_bam))
+            args += ['--write-index']
+        else:
+            output_arg = native_str(output_bam)
+
+        pysam.sort(*(args + ['-o', output_arg, native_str(input_bam)]))
+
+    if index and not write_index:
+        index_bam(output_bam, threads=threads)
+
+
+def index_bam(bam_path, threads=1):
+    """Indexes (sorted) bam file using samtools.
+
+    Parameters
+    ----------
+    bam_path : Path
+        Path to the sorted bam file.
+    threads : int
+        Number of threads to use.
+
+    """
+
+    if threads > 1:
+        pysam.index('-@', str(threads), native_str(bam_path))
     else:
-        pysam.sort(native_str(input_bam), native_str(output_bam))
+        pysam.index(native_str(bam_path))
+
+
+def _supports_write_index():
+    """Checks if samtools sort supports --write-index (samtools >= 1.10)."""
+
+    try:
+        version = tuple(
+            int(part) for part in pysam.__samtools_version__.split('.')[:2])
+    except (AttributeError, ValueError):
+        return False
+
+    return version >= (1, 10)
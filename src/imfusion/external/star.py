@@ -1,6 +1,9 @@
 """Module containing functions for calling STAR."""
 
-from .util import flatten_arguments, run_command
+from imfusion.util.path import as_path_list
+
+from .util import (decompress_command as default_decompress_command,
+                   flatten_arguments, run_command)
 
 
 def star_index(fasta_path,
@@ -8,8 +11,9 @@ def star_index(fasta_path,
                output_dir,
                overhang=100,
                threads=1,
+               sjdb_path=None,
                log_path=None):
-    """Builds a bowtie index for a reference genome.
+    """Builds a STAR index for a reference genome.
 
     Parameters
     ----------
@@ -23,6 +27,10 @@ def star_index(fasta_path,
         Value to use for sjdbOverhang (see STAR manual for more details).
     threads : int
         Number of threads to use.
+    sjdb_path : pathlib.Path
+        Optional path to a file containing additional splice junctions
+        (in STAR's sjdbFileChrStartEnd format), which are inserted into the
+        index together with the junctions from the gtf file.
     log_path : pathlib.Path
         Where to write the log output.
 
@@ -36,6 +44,9 @@ def star_index(fasta_path,
         '--sjdbOverhang', str(overhang), '--runThreadN', str(threads)
     ]
 
+    if sjdb_path is not None:
+        args += ['--sjdbFileChrStartEnd', str(sjdb_path)]
+
     run_command(args=args, log_path=log_path)
 
 
@@ -46,26 +57,46 @@ def star_align(
         fastq2_path=None,
         extra_args=None,
         threads=1,
-        log_path=None, ):
-    """Runs STAR in alignment mode for the given fastqs."""
+        log_path=None,
+        decompress_command=None):
+    """Runs STAR in alignment mode for the given fastqs.
+
+    Multiple fastq files (for example, of different lanes) can be given
+    per mate as a list of paths, which are passed to STAR as comma-separated
+    lists and aligned as a single sample.
+
+    Gzipped fastq files are decompressed using ``decompress_command``
+    (a list of command arguments that write the decompressed file to
+    stdout). If not given, pigz is used for multi-threaded runs if available,
+    as a single gunzip process may not keep up with many STAR threads.
+    """
 
     extra_args = extra_args or {}
 
     if not output_dir.exists():
         output_dir.mkdir(parents=True)
 
+    fastq_paths = as_path_list(fastq_path)
+    fastq2_paths = as_path_list(fastq2_path)
+
+    if fastq2_paths and len(fastq2_paths) != len(fastq_paths):
+        raise ValueError('Number of fastq2 files does not match '
+                         'the number of fastq files')
+
     # Check if files are gzipped.
-    if fastq_path.suffixes[-1] == '.gz':
-        extra_args['--readFilesCommand'] = ('gunzip', '-c')
+    if fastq_paths[0].suffixes[-1] == '.gz':
+        if decompress_command is None:
+            decompress_command = default_decompress_command(threads)
+        extra_args['--readFilesCommand'] = tuple(decompress_command)
 
     if threads > 1:
         extra_args['--runThreadN'] = threads
 
     # Assemble arguments.
-    if fastq2_path is None:
-        fastq_args = [str(fastq_path)]
-    else:
-        fastq_args = [str(fastq_path), str(fastq2_path)]
+    fastq_args = [','.join(str(fp) for fp in fastq_paths)]
+
+    if fastq2_paths:
+        fastq_args.append(','.join(str(fp) for fp in fastq2_paths))
 
     args = [
         'STAR', '--genomeDir', str(index_path), '--outFileNamePrefix',
@@ -75,3 +106,36 @@ def star_align(
     args += [str(arg) for arg in flatten_arguments(extra_args or {})]
 
     run_command(args=args, log_path=log_path)
+
+
+def star_load_genome(index_path, output_dir, remove=False, log_path=None):
+    """Loads or removes a STAR genome index in shared memory.
+
+    Loading the genome in shared memory allows multiple STAR runs using
+    ``--genomeLoad LoadAndKeep`` to share a single copy of the genome,
+    rather than each loading the genome from disk.
+
+    Parameters
+    ----------
+    index_path : pathlib.Path
+        Path to the STAR index.
+    output_dir : pathlib.Path
+        Output directory for the STAR log files.
+    remove : bool
+        Whether to remove the genome from shared memory (True), rather
+        than loading it (False).
+    log_path : pathlib.Path
+        Where to write the log output.
+
+    """
+
+    if not output_dir.exists():
+        output_dir.mkdir(parents=True)
+
+    args = [
+        'STAR', '--genomeDir', str(index_path), '--genomeLoad',
+        'Remove' if remove else 'LoadAndExit', '--outFileNamePrefix',
+        str(output_dir) + '/'
+    ]
+
+    run_command(args=args, log_path=log_path)
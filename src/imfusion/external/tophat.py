@@ -5,6 +5,8 @@ from pathlib2 import Path
 import tempfile
 import shutil
 
+from imfusion.util.path import as_path_list
+
 from .util import flatten_arguments, run_command
 
 
@@ -62,17 +64,19 @@ def tophat2_align(fastq_path,
 
     Parameters
     ----------
-    fastq_path : pathlib.Path
-        Paths to the fastq file that should be used for the Tophat2
-        alignment.
+    fastq_path : pathlib.Path or List[pathlib.Path]
+        Paths to the fastq file(s) that should be used for the Tophat2
+        alignment. Multiple files (for example, of different lanes) are
+        passed to Tophat2 as a comma-separated list.
     index_path : pathlib.Path
         Path to the bowtie index of the (augmented)
         genome that should be used in the alignment. This index is
         typically generated by the *build_reference* function.
     output_dir : pathlib.Path
         Path to the output directory.
-    fastq2_path : pathlib.Path
-        Path to the fastq file of the second pair (for paired-end sequencing).
+    fastq2_path : pathlib.Path or List[pathlib.Path]
+        Path(s) to the fastq file(s) of the second pair (for paired-end
+        sequencing). Should be given in the same order as ``fastq_path``.
     extra_args : dict
         Dict of extra command line arguments for Tophat2.
 
@@ -88,10 +92,17 @@ def tophat2_align(fastq_path,
     extra_args['--output-dir'] = (str(output_dir), )
 
     # Build command-line arguments.
-    if fastq2_path is None:
-        fastqs = [str(fastq_path)]
-    else:
-        fastqs = [str(fastq_path), str(fastq2_path)]
+    fastq_paths = as_path_list(fastq_path)
+    fastq2_paths = as_path_list(fastq2_path)
+
+    if fastq2_paths and len(fastq2_paths) != len(fastq_paths):
+        raise ValueError('Number of fastq2 files does not match '
+                         'the number of fastq files')
+
+    fastqs = [','.join(str(fp) for fp in fastq_paths)]
+
+    if fastq2_paths:
+        fastqs.append(','.join(str(fp) for fp in fastq2_paths))
 
     optional_args = list(flatten_arguments(extra_args))
     positional_args = [str(index_path)] + fastqs
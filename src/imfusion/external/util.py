@@ -6,10 +6,13 @@ from __future__ import absolute_import, division, print_function
 from builtins import *
 # pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
 
+import contextlib
+import gzip
 import os
 import subprocess
-from typing import Any, Iterable, Optional
+from typing import Any, Iterable, List, Optional
 
+from future.utils import native_str
 import pyparsing as pp
 
 from imfusion.compat import FileNotFoundError, DEVNULL
@@ -180,6 +183,59 @@ def which(program):
     return None
 
 
+def decompress_command(threads=1):
+    # type: (int) -> List[str]
+    """Returns the command to use for decompressing gzipped files.
+
+    Uses pigz for multi-threaded decompression if multiple threads are
+    available and pigz is installed, falling back to gunzip otherwise.
+    The returned command writes the decompressed data to stdout.
+    """
+
+    if threads > 1 and which('pigz') is not None:
+        return ['pigz', '-dc', '-p', str(threads)]
+    return ['gunzip', '-c']
+
+
+@contextlib.contextmanager
+def open_decompressed(file_path, decompress_command=None):
+    """Opens a (gzipped) file for reading as binary data.
+
+    Gzipped files (with the extension .gz) are decompressed using the gzip
+    module, unless a ``decompress_command`` is given (see
+    ``decompress_command``), in which case the command is run with the file
+    path as its last argument and the file object reads from its stdout.
+    Raises a ``CalledProcessError`` if the command fails.
+
+    Parameters
+    ----------
+    file_path : pathlib.Path
+        Path to the file.
+    decompress_command : List[str]
+        Command used to decompress gzipped files.
+
+    """
+
+    if file_path.suffix != '.gz':
+        with open(native_str(file_path), 'rb') as file_obj:
+            yield file_obj
+    elif decompress_command is None:
+        with gzip.open(native_str(file_path), 'rb') as file_obj:
+            yield file_obj
+    else:
+        args = list(decompress_command) + [native_str(file_path)]
+        process = subprocess.Popen(args, stdout=subprocess.PIPE)
+
+        try:
+            yield process.stdout
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, args)
+
+
 def check_dependencies(programs):
     # type: (Iterable[str]) -> None
     """Checks if listed executables are all available in $PATH."""
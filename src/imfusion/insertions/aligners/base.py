@@ -6,11 +6,16 @@ from __future__ import absolute_import, division, print_function
 from builtins import *
 # pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
 
+import contextlib
 import logging
 
 import pathlib2 as pathlib
 
+from imfusion.external.stringtie import stringtie_assemble
 from imfusion.external.util import check_dependencies
+from imfusion.util import tabix
+
+from .. import util
 
 _aligner_registry = {}
 
@@ -49,12 +54,28 @@ class Aligner(object):
     def __init__(self, reference, logger=None):
         self._reference = reference
         self._logger = logger or logging.getLogger()
+        self._scheduler = None
+
+    @property
+    def reference(self):
+        """Reference used by the aligner."""
+        return self._reference
 
     @property
     def dependencies(self):
         """External dependencies required by aligner."""
         return []
 
+    @property
+    def threads(self):
+        """Number of threads used by the aligner per sample."""
+        return 1
+
+    @property
+    def shared_memory(self):
+        """Memory (in bytes) shared between samples processed in a batch."""
+        return 0
+
     def check_dependencies(self):
         """Checks if all required external dependencies are in ``$PATH``.
 
@@ -62,8 +83,176 @@ class Aligner(object):
         """
         check_dependencies(self.dependencies)
 
+    @contextlib.contextmanager
+    def batch(self, output_dir):
+        """Context for processing multiple samples as a batch.
+
+        Can be overridden by aligners to set up resources that are shared
+        between the samples of a batch (such as a genome index loaded in
+        shared memory) and to release these resources afterwards.
+
+        Parameters
+        ----------
+        output_dir : Path
+            Output directory of the batch.
+
+        """
+        self._load_reference()
+        yield
+
+    def _load_reference(self):
+        """Loads reference data that is shared between samples.
+
+        Called before processing the samples of a batch, so that the data
+        is loaded (using multiple processes if needed) before any threads
+        are started for processing the samples.
+        """
+        self._reference.transcript_reference(workers=self.threads)
+
+    @contextlib.contextmanager
+    def scheduled(self, scheduler):
+        """Context in which processing stages are run using a scheduler.
+
+        Used for processing multiple samples concurrently, in which case
+        the stages of the samples are run within global thread and memory
+        budgets (see ``imfusion.insertions.batch.StageScheduler``).
+
+        Parameters
+        ----------
+        scheduler : StageScheduler
+            Scheduler to use for running stages.
+
+        """
+
+        self._scheduler = scheduler
+
+        try:
+            yield
+        finally:
+            self._scheduler = None
+
+    @contextlib.contextmanager
+    def _stage(self, name, heavy=False):
+        """Context for running a processing stage of a sample.
+
+        Waits for the resources of the stage to become available if a
+        scheduler is used (see ``scheduled``). All stages reserve the
+        threads of the aligner, whereas heavy stages (stages with a high
+        memory usage, such as the alignment of the sample) also reserve
+        the memory of a sample.
+        """
+
+        if self._scheduler is None:
+            yield
+        else:
+            with self._scheduler.stage(name, heavy=heavy):
+                yield
+
+    def _start_assembly(self, pool, alignment_path, output_dir, manifest):
+        """Starts transcript assembly for the sample (if requested).
+
+        Returns a callable for the ``assembled_gtf_path`` argument of
+        ``extract_insertions``, or None if no assembly was requested. For
+        full assemblies, the assembly is run on the given pool whilst
+        fusions are extracted. Targeted assemblies are only run once the
+        fusions have been annotated for genes, as the assembled loci are
+        determined by the fusions lacking a gene annotation. Completed
+        assemblies are recorded in the stage manifest of the sample.
+        """
+
+        if not self._assemble:
+            return None
+
+        if self._assemble_targeted:
+
+            def _assemble(fusions):
+                regions = util.assembly_regions(
+                    fusions, padding=self._assemble_padding)
+                return self._assemble_transcripts(
+                    alignment_path, output_dir, manifest, regions=regions)
+        else:
+            assembly = pool.apply_async(self._assemble_transcripts,
+                                        (alignment_path, output_dir, manifest))
+
+            def _assemble(_):
+                return assembly.get()
+
+        return _assemble
+
+    def _assemble_transcripts(self,
+                              alignment_path,
+                              output_dir,
+                              manifest,
+                              regions=None):
+        """Assembles transcripts from the alignment using Stringtie.
+
+        Returns the path to the compressed and indexed assembly, which is
+        written to ``assembled.gtf.gz`` in the output directory. An existing
+        assembly is re-used if it is recorded as complete in the given stage
+        manifest (see ``StageManifest``). If ``regions`` are given, only
+        alignments within these regions are assembled (see
+        ``util.assembly_regions``), which are written to
+        ``assembled.targeted.gtf.gz`` instead. Returns None if the
+        list of regions is empty.
+        """
+
+        if regions is None:
+            stage = 'assembly'
+            assembled_path = output_dir / 'assembled.gtf.gz'
+        else:
+            stage = 'assembly_targeted'
+            assembled_path = output_dir / 'assembled.targeted.gtf.gz'
+
+        if regions is not None and not regions:
+            self._logger.info('No unannotated fusions, skipping assembly')
+            return None
+
+        stage_kws = dict(
+            inputs=[alignment_path],
+            params={'gtf_path': self._reference.gtf_path,
+                    'regions': regions},
+            outputs=[
+                assembled_path,
+                assembled_path.with_name(assembled_path.name + '.tbi')
+            ])
+
+        if manifest.is_complete(stage, **stage_kws):
+            self._logger.info('Using existing Stringtie assembly')
+            return assembled_path
+
+        manifest.invalidate(stage)
+
+        if regions is not None:
+            self._logger.info('Assembling transcripts using Stringtie '
+                              '(%d regions)', len(regions))
+
+            # Restrict alignment to the given regions.
+            region_bam_path = output_dir / '_assembly' / 'regions.bam'
+            region_bam_path.parent.mkdir(parents=True, exist_ok=True)
+
+            util.subset_alignment(
+                alignment_path, regions, output_path=region_bam_path)
+            alignment_path = region_bam_path
+        else:
+            self._logger.info('Assembling transcripts using Stringtie')
+
+        # Generate assembled GTF.
+        stringtie_out_path = assembled_path.with_suffix('')
+        stringtie_assemble(
+            alignment_path,
+            gtf_path=self._reference.gtf_path,
+            output_path=stringtie_out_path)
+
+        # Compress and index.
+        tabix.index_gtf(stringtie_out_path, output_path=assembled_path)
+        stringtie_out_path.unlink()
+
+        manifest.record(stage, **stage_kws)
+
+        return assembled_path
+
     @classmethod
-    def configure_args(cls, parser):
+    def configure_args(cls, parser, batch=False):
         """Configures an argument parser for the Indexer.
 
         Used by ``imfusion-build`` to configure the sub-command for
@@ -74,24 +263,43 @@ class Aligner(object):
         ----------
         parser : argparse.ArgumentParser
             Argument parser to configure.
+        batch : bool
+            Whether the parser is used for processing a batch of samples,
+            in which case the input fastq files are given using a
+            sample sheet rather than using the fastq arguments.
 
         """
 
         # Required arguments.
         base_group = parser.add_argument_group('Basic arguments')
 
-        base_group.add_argument(
-            '--fastq',
-            type=pathlib.Path,
-            required=True,
-            help='Path(s) to the samples fastq files.')
-
-        base_group.add_argument(
-            '--fastq2',
-            type=pathlib.Path,
-            default=None,
-            help='Paths to the second pair fastq files (for paired-end '
-            'sequencing data). Should be given in the same order as for fastq.')
+        if batch:
+            base_group.add_argument(
+                '--sample_sheet',
+                type=pathlib.Path,
+                required=True,
+                help='Path to the sample sheet describing the samples. '
+                'Should be a tab-separated file containing the columns '
+                'sample, fastq and (optionally) fastq2. Fastq files of '
+                'multiple lanes can be given as comma-separated lists.')
+        else:
+            base_group.add_argument(
+                '--fastq',
+                type=pathlib.Path,
+                nargs='+',
+                required=True,
+                help='Path(s) to the samples fastq files. Multiple files '
+                '(for example, of different lanes) are aligned together '
+                'as a single sample.')
+
+            base_group.add_argument(
+                '--fastq2',
+                type=pathlib.Path,
+                nargs='+',
+                default=None,
+                help='Paths to the second pair fastq files (for paired-end '
+                'sequencing data). Should be given in the same order '
+                'as for fastq.')
 
         base_group.add_argument(
             '--reference',
@@ -100,11 +308,17 @@ class Aligner(object):
             help='Path to the index of the augmented reference '
             'generated by imfusion-build.')
 
+        if batch:
+            output_help = ('The output directory, in which the output '
+                           'directories of the samples are created.')
+        else:
+            output_help = 'The samples output directory.'
+
         base_group.add_argument(
             '--output_dir',
             required=True,
             type=pathlib.Path,
-            help='The samples output directory.')
+            help=output_help)
 
     @classmethod
     def _parse_args(cls, args):
@@ -136,14 +350,16 @@ class Aligner(object):
 
         Parameters
         ----------
-        fastq_path : Path
+        fastq_path : Path or List[Path]
             Path to fastq file containing sequence reads. For paired-end data,
-            this should refer to the first read of the pair.
+            this should refer to the first read of the pair. For samples
+            sequenced over multiple lanes, a list of the fastq files of
+            all lanes can be given.
         output_dir : Path
             Output directory, to use for output files such as the alignment.
-        fastq2_path : Path
-            For paired-end sequencing data, path to fastq file containing
-            the second read of the pair.
+        fastq2_path : Path or List[Path]
+            For paired-end sequencing data, path(s) to fastq file(s)
+            containing the second read of the pair.
 
         Yields
         ------
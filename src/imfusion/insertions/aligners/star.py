@@ -6,15 +6,17 @@ from __future__ import absolute_import, division, print_function
 from builtins import *
 # pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
 
-import collections
-import operator
+from collections import namedtuple
+import contextlib
 import itertools
+import shutil
 import sys
-from typing import Any
+import tempfile
+from typing import Any, Optional
 import re
+import shlex
 
 from future.utils import native_str
-from intervaltree import IntervalTree
 import numpy as np
 import pandas as pd
 from pathlib2 import Path
@@ -22,18 +24,34 @@ import pysam
 import toolz
 
 from imfusion.build.indexers.star import StarReference
-from imfusion.external.star import star_align
+from imfusion.external.star import star_align, star_load_genome
 from imfusion.external.star_fusion import star_fusion
-from imfusion.external.stringtie import stringtie_assemble
-from imfusion.external.compound import sort_bam
-from imfusion.external.util import which, parse_arguments
+from imfusion.external.compound import index_bam, sort_bam
+from imfusion.external.util import (decompress_command as
+                                    default_decompress_command, which,
+                                    parse_arguments)
 from imfusion.model import Fusion, TransposonFusion
-from imfusion.util import tabix, path
+from imfusion.util import log, path
 
 from .base import Aligner, register_aligner
-from .. import util
+from .. import prefilter, util
+from ..manifest import StageManifest
 
 CIGAR_MATCH_REGEX = re.compile(r'(\d+)M')
+CIGAR_OP_REGEX = re.compile(r'(\d+)([MIDNSHP=X])')
+
+_CIGAR_OPS = 'MIDNSHP=X'
+
+CHIMERIC_CHUNKSIZE = 1000000
+
+# STAR output files that are kept when aligning in a scratch directory. The
+# chimeric junctions are moved last, as their presence indicates a completed
+# alignment when the genome alignment is not written.
+STAR_OUTPUT_FILES = [
+    'Aligned.sortedByCoord.out.bam', 'Aligned.sortedByCoord.out.bam.bai',
+    'SJ.out.tab', 'Log.out', 'Log.progress.out', 'Log.final.out',
+    'Chimeric.out.junction'
+]
 
 
 class StarAligner(Aligner):
@@ -129,6 +147,69 @@ class StarAligner(Aligner):
         directory. Note that the STAR-Fusion reference should use the same
         reference genome as IM-Fusions reference to avoid compatability issues.
         Requires STAR-Fusion to be installed.
+    write_alignment : bool
+        Whether to write the genome alignment (alignment.bam). If False,
+        STAR only writes the chimeric junctions needed for identifying
+        insertions, which avoids writing and sorting the alignment. In this
+        case, no assembly can be performed and the sample cannot be used
+        for quantifying expression using ``imfusion-expression``.
+    prefilter : bool
+        Whether to pre-screen reads for transposon sequences (using k-mers
+        derived from the transposon sequence) and to only align reads that
+        contain transposon sequences. This provides a fast triage mode for
+        identifying candidate insertions. Implies ``write_alignment=False``.
+    prefilter_k : int
+        Size of the k-mers used for pre-screening reads. Defaults to
+        ``min_flank``, so that reads with at least ``min_flank`` bases of
+        transposon sequence are retained.
+    chimeric_output : str
+        Where STAR should write chimeric alignments. Either 'Junctions'
+        (the default), in which case chimeric alignments are written to
+        a separate Chimeric.out.junction file, or 'WithinBAM', in which
+        case chimeric alignments are written to the main alignment and are
+        read from there using the SA tags of the chimeric reads. The latter
+        requires the alignment to be written and cannot be combined with
+        STAR-Fusion, which requires the junction file.
+    shared_genome : bool
+        Whether to keep the STAR genome index in shared memory
+        (using ``--genomeLoad LoadAndKeep``), so that the genome can be
+        shared between STAR runs of different samples. As STAR does not
+        support two-pass alignment or sorting without a sorting memory limit
+        for shared genomes, alignments are performed single-pass and are
+        sorted externally if the genome is shared. If None, the genome is
+        only shared if the reference contains the junctions of the cohort
+        (see the ``--star_junctions`` argument of ``imfusion-build``), as
+        single-pass alignments otherwise differ from two-pass alignments.
+    two_pass : bool
+        Whether to perform a two-pass alignment (using
+        ``--twopassMode Basic``), in which novel junctions detected in the
+        first pass are inserted into the genome before aligning the reads
+        again in a second pass. Can be disabled for references that already
+        contain the junctions of the cohort (see the ``--star_junctions``
+        argument of ``imfusion-build``), to avoid aligning each sample twice.
+    assemble_targeted : bool
+        Whether to restrict the assembly to the genomic regions of fusions
+        that are not annotated with a reference gene, rather than assembling
+        the entire alignment. As the assembly is only used to annotate these
+        fusions, this gives the same annotation in a fraction of the time.
+    assemble_padding : int
+        Padding (in bp) added around the fusion regions for targeted
+        assemblies, which should cover the transcripts of the fusions.
+    sort_memory : str
+        Maximum memory per thread (for example '768M') used by samtools
+        when sorting the alignment externally.
+    decompress_command : List[str]
+        Command used to decompress gzipped fastq files, by STAR
+        (``--readFilesCommand``), when pre-filtering reads and when
+        counting reads for the FFPM scores. Defaults to pigz (using the
+        given number of threads) if available, or gunzip otherwise.
+    scratch_dir : Path
+        Directory (preferably on fast, local storage) in which STAR is run
+        and the alignment is sorted. Only the final outputs (the sorted
+        alignment and its index, the junction files and the STAR logs) are
+        moved to the output directory, after which the intermediate files
+        are removed from the scratch directory (also if the alignment fails).
+        If not given, STAR is run directly in the output directory.
 
     """
 
@@ -148,16 +229,53 @@ class StarAligner(Aligner):
             merge_junction_dist=10,  # type: int
             max_spanning_dist=300,  # type: int
             max_junction_dist=10000,  # type: int
-            star_fusion_ref_path=None  # type: Path
+            star_fusion_ref_path=None,  # type: Path
+            write_alignment=True,  # type: bool
+            shared_genome=False,  # type: Optional[bool]
+            prefilter=False,  # type: bool
+            prefilter_k=None,  # type: int
+            chimeric_output='Junctions',  # type: str
+            two_pass=True,  # type: bool
+            assemble_targeted=False,  # type: bool
+            assemble_padding=10000,  # type: int
+            sort_memory=None,  # type: str
+            decompress_command=None,  # type: List[str]
+            scratch_dir=None  # type: Path
     ):  # type: (...) -> None
 
         super().__init__(reference=reference, logger=logger)
 
+        if prefilter:
+            # Alignment of pre-filtered reads is not useful downstream.
+            write_alignment = False
+
+        if assemble and not write_alignment:
+            raise ValueError('Assembly requires the alignment to be written')
+
+        if chimeric_output not in {'Junctions', 'WithinBAM'}:
+            raise ValueError(
+                'Unknown chimeric output type {!r}'.format(chimeric_output))
+
+        if chimeric_output == 'WithinBAM':
+            if not write_alignment:
+                raise ValueError('WithinBAM chimeric output requires the '
+                                 'alignment to be written')
+
+            if star_fusion_ref_path is not None:
+                raise ValueError('STAR-Fusion requires Junctions '
+                                 'chimeric output')
+
         self._assemble = assemble
         self._assemble_args = assemble_args or {}
+        self._assemble_targeted = assemble_targeted
+        self._assemble_padding = assemble_padding
         self._min_flank = min_flank
         self._threads = threads
         self._external_sort = external_sort
+        self._sort_memory = sort_memory
+        self._scratch_dir = scratch_dir
+        self._decompress_command = (decompress_command or
+                                    default_decompress_command(threads))
         self._extra_args = extra_args or {}
 
         self._merge_junction_dist = merge_junction_dist
@@ -169,6 +287,21 @@ class StarAligner(Aligner):
         self._filter_blacklist = filter_blacklist
 
         self._star_fusion_ref_path = star_fusion_ref_path
+        self._write_alignment = write_alignment
+        self._prefilter = prefilter
+        self._prefilter_k = prefilter_k or min_flank
+        self._chimeric_output = chimeric_output
+
+        if shared_genome is None:
+            shared_genome = reference.junctions_path.exists()
+
+        if shared_genome and two_pass:
+            self._logger.warning(
+                'Two-pass alignment is not supported for shared STAR '
+                'genomes, samples are aligned single-pass instead')
+
+        self._shared_genome = shared_genome
+        self._two_pass = two_pass
 
     @property
     def dependencies(self):
@@ -184,6 +317,56 @@ class StarAligner(Aligner):
 
         return programs
 
+    @property
+    def threads(self):
+        """Number of threads used by the aligner per sample."""
+        return self._threads
+
+    @property
+    def shared_memory(self):
+        """Memory (in bytes) shared between samples processed in a batch."""
+
+        if not self._shared_genome:
+            return 0
+
+        index_path = self._reference.index_path
+        return sum((index_path / file_name).stat().st_size
+                   for file_name in ['Genome', 'SA', 'SAindex']
+                   if (index_path / file_name).exists())
+
+    @contextlib.contextmanager
+    def batch(self, output_dir):
+        """Context for processing multiple samples as a batch.
+
+        If the genome is shared, the STAR genome index is loaded into shared
+        memory before processing the samples and removed from memory after
+        all samples have been processed.
+
+        Parameters
+        ----------
+        output_dir : Path
+            Output directory of the batch.
+
+        """
+
+        self._load_reference()
+
+        if not self._shared_genome:
+            yield
+            return
+
+        genome_dir = output_dir / '_star_genome'
+
+        self._logger.info('Loading STAR genome into shared memory')
+        star_load_genome(self._reference.index_path, output_dir=genome_dir)
+
+        try:
+            yield
+        finally:
+            self._logger.info('Removing STAR genome from shared memory')
+            star_load_genome(
+                self._reference.index_path, output_dir=genome_dir, remove=True)
+
     def identify_insertions(self, fastq_path, output_dir, fastq2_path=None):
         """Identifies insertions from given reads.
 
@@ -193,14 +376,16 @@ class StarAligner(Aligner):
 
         Parameters
         ----------
-        fastq_path : Path
+        fastq_path : Path or List[Path]
             Path to fastq file containing sequence reads. For paired-end data,
-            this should refer to the first read of the pair.
+            this should refer to the first read of the pair. For samples
+            sequenced over multiple lanes, a list of the fastq files of
+            all lanes can be given.
         output_dir : Path
             Output directory, to use for output files such as the alignment.
-        fastq2_path : Path
-            For paired-end sequencing data, path to fastq file containing
-            the second read of the pair.
+        fastq2_path : Path or List[Path]
+            For paired-end sequencing data, path(s) to fastq file(s)
+            containing the second read of the pair.
 
         Yields
         ------
@@ -209,92 +394,256 @@ class StarAligner(Aligner):
         """
 
         output_dir.mkdir(parents=True, exist_ok=True)
+        manifest = StageManifest.for_sample(output_dir)
 
         # Perform alignment using STAR.
         alignment_path = output_dir / 'alignment.bam'
+        alignment_index_path = alignment_path.with_suffix('.bam.bai')
         star_dir = output_dir / '_star'
+        junction_path = star_dir / 'Chimeric.out.junction'
 
-        if not alignment_path.exists():
-            self._logger.info('Performing alignment using STAR')
+        if self._write_alignment:
+            align_outputs = [alignment_path, alignment_index_path]
+        else:
+            align_outputs = []
 
-            self._align(
-                fastq_path=fastq_path,
-                output_dir=star_dir,
-                fastq2_path=fastq2_path)
+        if self._chimeric_output == 'Junctions':
+            align_outputs.append(junction_path)
 
-            path.symlink_relative(
-                src_path=star_dir / 'Aligned.sortedByCoord.out.bam',
-                dest_path=alignment_path)
+        align_kws = dict(
+            inputs=path.as_path_list(fastq_path) +
+            path.as_path_list(fastq2_path),
+            params=self._alignment_params(),
+            outputs=align_outputs)
 
-            pysam.index(native_str(alignment_path))
-        else:
+        if manifest.is_complete('alignment', **align_kws):
             self._logger.info('Using existing STAR alignment')
-
-        # Assemble transcripts if requested.
-        if self._assemble:
-            assembled_path = output_dir / 'assembled.gtf.gz'
-            if not assembled_path.exists():
-                self._logger.info('Assembling transcripts using Stringtie')
-
-                # Generate assembled GTF.
-                stringtie_out_path = assembled_path.with_suffix('')
-                stringtie_assemble(
-                    alignment_path,
-                    gtf_path=self._reference.gtf_path,
-                    output_path=stringtie_out_path)
-
-                # Compress and index.
-                tabix.index_gtf(stringtie_out_path, output_path=assembled_path)
-                stringtie_out_path.unlink()
-            else:
-                self._logger.info('Using existing Stringtie assembly')
         else:
-            assembled_path = None
-
-        # Extract identified fusions and corresponding insertions.
-        self._logger.info('Extracting gene-transposon fusions')
-        junction_path = star_dir / 'Chimeric.out.junction'
-        fusions = list(self._extract_fusions(junction_path))
-
-        self._logger.info('Summarizing insertions')
-        insertions = list(
-            util.extract_insertions(
-                fusions,
-                gtf_path=self._reference.indexed_gtf_path,
-                features_path=self._reference.features_path,
-                assembled_gtf_path=assembled_path,
-                ffpm_fastq_path=fastq_path,
-                chromosomes=None))
-
-        insertions = util.filter_insertions(
-            insertions,
-            features=self._filter_features,
-            orientation=self._filter_orientation,
-            blacklist=self._filter_blacklist)
-
-        # Identify endogenous fusions with STAR if requested.
-        if self._star_fusion_ref_path is not None:
-            self._logger.info('Identifying gene fusions using STAR-Fusion')
-            star_fusion_dir = output_dir / '_star_fusion'
-            star_fusion(
-                junction_path,
-                self._star_fusion_ref_path,
-                output_dir=star_fusion_dir)
-
-            path.symlink_relative(
-                src_path=star_fusion_dir /
-                'star-fusion.fusion_candidates.final.abridged',
-                dest_path=output_dir / 'gene_fusions.txt')
+            with self._stage('alignment', heavy=True):
+                manifest.invalidate('alignment')
+
+                if not self._write_alignment:
+                    if self._prefilter:
+                        self._logger.info('Pre-filtering reads for transposon '
+                                          'sequences')
+                        align_paths = self._prefilter_reads(
+                            fastq_path,
+                            output_dir=output_dir / '_prefilter',
+                            fastq2_path=fastq2_path)
+                    else:
+                        align_paths = (fastq_path, fastq2_path)
+
+                    self._logger.info('Performing alignment using STAR '
+                                      '(chimeric junctions only)')
+                    self._align(
+                        fastq_path=align_paths[0],
+                        output_dir=star_dir,
+                        fastq2_path=align_paths[1])
+                else:
+                    self._logger.info('Performing alignment using STAR')
+
+                    sorted_path = star_dir / 'Aligned.sortedByCoord.out.bam'
+                    sorted_index_path = sorted_path.with_suffix('.bam.bai')
+
+                    # Remove the index of any previous alignment, as it
+                    # would otherwise be used for the new alignment.
+                    if sorted_index_path.exists():
+                        sorted_index_path.unlink()
+
+                    self._align(
+                        fastq_path=fastq_path,
+                        output_dir=star_dir,
+                        fastq2_path=fastq2_path)
+
+                    # Index the sorted alignment, unless already indexed whilst
+                    # sorting, and link both into the expected locations.
+                    if not sorted_index_path.exists():
+                        index_bam(sorted_path, threads=self._threads)
+
+                    path.symlink_relative(
+                        src_path=sorted_path,
+                        dest_path=alignment_path,
+                        overwrite=True)
+                    path.symlink_relative(
+                        src_path=sorted_index_path,
+                        dest_path=alignment_index_path,
+                        overwrite=True)
+
+                manifest.record('alignment', **align_kws)
+
+        # Run post-alignment stages. Transcript assembly and STAR-Fusion
+        # run in the background whilst fusions are extracted, as only the
+        # assembly-based annotation of the fusions depends on their results.
+        # Load the gene annotation before starting any threads, so that it
+        # can be built using multiple processes if needed.
+        gene_reference = self._reference.transcript_reference(
+            workers=self._threads)
+
+        with self._stage('annotation'):
+            pool = log.thread_pool(2)
+
+            try:
+                assembled_path = self._start_assembly(pool, alignment_path,
+                                                      output_dir, manifest)
+
+                if self._star_fusion_ref_path is not None:
+                    gene_fusions = pool.apply_async(
+                        self._identify_gene_fusions,
+                        (junction_path, output_dir, manifest))
+                else:
+                    gene_fusions = None
+
+                # Extract identified fusions and corresponding insertions.
+                self._logger.info('Extracting gene-transposon fusions')
+                if self._chimeric_output == 'WithinBAM':
+                    fusions = list(
+                        self._extract_fusions(alignment_path, bam=True))
+                else:
+                    fusions = list(self._extract_fusions(junction_path))
+
+                self._logger.info('Summarizing insertions')
+                insertions = list(
+                    util.extract_insertions(
+                        fusions,
+                        gtf_path=gene_reference,
+                        features_path=self._reference.transposon_features,
+                        assembled_gtf_path=assembled_path,
+                        ffpm_fastq_path=fastq_path,
+                        chromosomes=None,
+                        decompress_command=self._decompress_command))
+
+                insertions = util.filter_insertions(
+                    insertions,
+                    features=self._filter_features,
+                    orientation=self._filter_orientation,
+                    blacklist=self._filter_blacklist)
+
+                if gene_fusions is not None:
+                    gene_fusions.get()
+            finally:
+                pool.close()
+                pool.join()
 
         for insertion in insertions:
             yield insertion
 
+    def _identify_gene_fusions(self, junction_path, output_dir, manifest):
+        """Identifies endogenous gene fusions using STAR-Fusion."""
+
+        star_fusion_dir = output_dir / '_star_fusion'
+        fusions_path = (star_fusion_dir /
+                        'star-fusion.fusion_candidates.final.abridged')
+
+        stage_kws = dict(
+            inputs=[junction_path],
+            params={'reference': self._star_fusion_ref_path},
+            outputs=[fusions_path])
+
+        if manifest.is_complete('gene_fusions', **stage_kws):
+            self._logger.info('Using existing STAR-Fusion gene fusions')
+            return
+
+        manifest.invalidate('gene_fusions')
+
+        self._logger.info('Identifying gene fusions using STAR-Fusion')
+
+        star_fusion(
+            junction_path,
+            self._star_fusion_ref_path,
+            output_dir=star_fusion_dir)
+
+        path.symlink_relative(
+            src_path=fusions_path,
+            dest_path=output_dir / 'gene_fusions.txt',
+            overwrite=True)
+
+        manifest.record('gene_fusions', **stage_kws)
+
+    def _alignment_params(self):
+        """Parameters affecting the alignment, used for the stage manifest."""
+
+        params = {
+            'index_path': self._reference.index_path,
+            'min_flank': self._min_flank,
+            'two_pass': self._two_pass and not self._shared_genome,
+            'chimeric_output': self._chimeric_output,
+            'write_alignment': self._write_alignment,
+            'extra_args': self._extra_args
+        }
+
+        if self._prefilter:
+            params['prefilter_k'] = self._prefilter_k
+
+        return params
+
+    def _prefilter_reads(self, fastq_path, output_dir, fastq2_path=None):
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        output_path = output_dir / 'reads.R1.fastq.gz'
+
+        if fastq2_path is not None:
+            output2_path = output_dir / 'reads.R2.fastq.gz'
+        else:
+            output2_path = None
+
+        kmers = prefilter.build_kmer_set(
+            self._reference.transposon_path, k=self._prefilter_k)
+
+        num_selected = prefilter.prefilter_fastq(
+            fastq_path,
+            output_path,
+            kmers=kmers,
+            k=self._prefilter_k,
+            fastq2_path=fastq2_path,
+            output2_path=output2_path,
+            workers=self._threads,
+            decompress_command=self._decompress_command)
+
+        self._logger.info('Selected %d reads containing transposon sequences',
+                          num_selected)
+
+        return output_path, output2_path
+
     def _align(self, fastq_path, output_dir, fastq2_path=None):
+        if self._scratch_dir is None:
+            self._run_star(fastq_path, output_dir, fastq2_path=fastq2_path)
+            return
+
+        # Run STAR in a temporary directory in the scratch directory and
+        # move the final outputs into the output directory afterwards.
+        self._scratch_dir.mkdir(parents=True, exist_ok=True)
+        scratch_dir = Path(
+            tempfile.mkdtemp(
+                prefix='imfusion_star_', dir=native_str(self._scratch_dir)))
+
+        try:
+            self._run_star(
+                fastq_path,
+                scratch_dir,
+                fastq2_path=fastq2_path,
+                tmp_dir=scratch_dir / '_sort')
+
+            output_dir.mkdir(parents=True, exist_ok=True)
+
+            for file_name in STAR_OUTPUT_FILES:
+                file_path = scratch_dir / file_name
+                if file_path.exists():
+                    shutil.move(
+                        native_str(file_path),
+                        native_str(output_dir / file_name))
+        finally:
+            shutil.rmtree(native_str(scratch_dir), ignore_errors=True)
+
+    def _run_star(self, fastq_path, output_dir, fastq2_path=None,
+                  tmp_dir=None):
         # Gather default arguments.
-        sort_type = 'Unsorted' if self._external_sort else 'SortedByCoordinate'
+        if self._external_sort or self._shared_genome:
+            sort_type = 'Unsorted'
+        else:
+            sort_type = 'SortedByCoordinate'
 
         args = {
-            '--twopassMode': ('Basic', ),
+            '--twopassMode': ('Basic' if self._two_pass else 'None', ),
             '--outReadsUnmapped': ('None', ),
             '--outSAMtype': ('BAM', sort_type),
             '--runThreadN': (self._threads, ),
@@ -302,24 +651,49 @@ class StarAligner(Aligner):
             '--outSAMstrandField': ('intronMotif', )  # XS field for Stringtie.
         }
 
+        if self._shared_genome:
+            # Two-pass mode is not supported with shared genomes.
+            args['--genomeLoad'] = ('LoadAndKeep', )
+            args['--twopassMode'] = ('None', )
+
+        if self._chimeric_output == 'WithinBAM':
+            args['--chimOutType'] = ('WithinBAM', )
+
+        if not self._write_alignment:
+            # Only chimeric junctions are needed, skip writing/sorting bam.
+            args['--outSAMtype'] = ('None', )
+            sort_type = None
+
         star_align(
             fastq_path=fastq_path,
             fastq2_path=fastq2_path,
             index_path=self._reference.index_path,
             output_dir=output_dir,
-            extra_args=toolz.merge(args, self._extra_args))
+            extra_args=toolz.merge(args, self._extra_args),
+            decompress_command=self._decompress_command)
 
         # If not yet sorted, sort bam file using samtools/sambamba.
         sorted_bam_path = output_dir / 'Aligned.sortedByCoord.out.bam'
 
         if sort_type == 'Unsorted':
             unsorted_bam_path = output_dir / 'Aligned.out.bam'
-            sort_bam(unsorted_bam_path, sorted_bam_path, threads=self._threads)
+            sort_bam(
+                unsorted_bam_path,
+                sorted_bam_path,
+                threads=self._threads,
+                memory=self._sort_memory,
+                tmp_dir=tmp_dir,
+                index=True)
             unsorted_bam_path.unlink()
 
-    def _extract_fusions(self, fusion_path):
+    def _extract_fusions(self, fusion_path, bam=False):
         # Read chimeric junction data.
-        chimeric_data = read_chimeric_junctions(fusion_path)
+        if bam:
+            chimeric_data = read_chimeric_bam(
+                fusion_path, transposon_name=self._reference.transposon_name)
+        else:
+            chimeric_data = read_chimeric_junctions_cached(
+                fusion_path, transposon_name=self._reference.transposon_name)
 
         # Extract transposon fusions.
         fusions = extract_transposon_fusions(
@@ -333,7 +707,7 @@ class StarAligner(Aligner):
             yield fusion
 
     @classmethod
-    def configure_args(cls, parser):
+    def configure_args(cls, parser, batch=False):
         """Configures an argument parser for the Indexer.
 
         Used by ``imfusion-build`` to configure the sub-command for
@@ -344,10 +718,13 @@ class StarAligner(Aligner):
         ----------
         parser : argparse.ArgumentParser
             Argument parser to configure.
+        batch : bool
+            Whether the parser is used for processing a batch of samples.
+            For batches, the genome is shared between samples by default.
 
         """
 
-        super().configure_args(parser)
+        super().configure_args(parser, batch=batch)
 
         star_group = parser.add_argument_group('STAR arguments')
         star_group.add_argument(
@@ -371,9 +748,105 @@ class StarAligner(Aligner):
                   'Takes longer, but results in lower memory usage for '
                   'large bam files.'))
 
+        star_group.add_argument(
+            '--star_sort_memory',
+            default=None,
+            help=('Maximum memory per thread used by samtools when sorting '
+                  'externally (for example 768M). Ignored if sambamba is '
+                  'used for sorting.'))
+
+        star_group.add_argument(
+            '--star_decompress_command',
+            type=shlex.split,
+            default=None,
+            help=('Command used to decompress gzipped fastq files (for '
+                  'example \'pigz -dc -p 4\'). Defaults to pigz if '
+                  'available, or gunzip otherwise.'))
+
+        star_group.add_argument(
+            '--scratch_dir',
+            type=Path,
+            default=None,
+            help=('Directory on fast (local) storage to use for STAR\'s '
+                  'intermediate files and for sorting. Only the final '
+                  'alignment, junctions and logs are moved to the output '
+                  'directory.'))
+
+        if batch:
+            shared_group = star_group.add_mutually_exclusive_group()
+
+            shared_group.add_argument(
+                '--star_shared_genome',
+                default=None,
+                action='store_true',
+                help=('Share the STAR genome in memory between samples. '
+                      'Sharing the genome disables two-pass alignment. '
+                      'By default, the genome is only shared if the '
+                      'reference includes the junctions of the cohort '
+                      '(built using imfusion-build --star_junctions).'))
+
+            shared_group.add_argument(
+                '--star_no_shared_genome',
+                dest='star_shared_genome',
+                action='store_false',
+                help='Don\'t share the STAR genome in memory between samples.')
+        else:
+            star_group.add_argument(
+                '--star_shared_genome',
+                default=False,
+                action='store_true',
+                help=('Keep the STAR genome in shared memory, so that it '
+                      'can be re-used by other STAR runs. Disables two-pass '
+                      'alignment.'))
+
+        star_group.add_argument(
+            '--star_no_two_pass',
+            dest='star_two_pass',
+            default=True,
+            action='store_false',
+            help=('Align single-pass instead of two-pass. Recommended for '
+                  'references that already include the junctions of the '
+                  'cohort (built using imfusion-build --star_junctions).'))
+
         star_group.add_argument(
             '--star_args', default='', help='Additional args to pass to STAR.')
 
+        star_group.add_argument(
+            '--star_chimeric_output',
+            default='Junctions',
+            choices=['Junctions', 'WithinBAM'],
+            help=('Where STAR should write chimeric alignments: in a '
+                  'separate junction file (Junctions) or in the main '
+                  'alignment (WithinBAM). WithinBAM avoids writing and '
+                  'parsing a (large) separate junction file, but cannot be '
+                  'combined with STAR-Fusion.'))
+
+        star_group.add_argument(
+            '--prefilter',
+            default=False,
+            action='store_true',
+            help=('Only align reads containing transposon sequences, '
+                  'identified using a k-mer based pre-screen. Provides a fast '
+                  'triage mode for identifying candidate insertions. '
+                  'Implies --no_alignment.'))
+
+        star_group.add_argument(
+            '--prefilter_kmer_size',
+            default=None,
+            type=int,
+            help=('Size of k-mers used for pre-filtering reads. '
+                  'Defaults to the value of --star_min_flank.'))
+
+        star_group.add_argument(
+            '--no_alignment',
+            dest='write_alignment',
+            default=True,
+            action='store_false',
+            help=('Only write the chimeric junctions needed for identifying '
+                  'insertions, rather than the full (sorted) alignment. '
+                  'Cannot be combined with --assemble and cannot be used '
+                  'for quantifying expression with imfusion-expression.'))
+
         star_group.add_argument(
             '--merge_junction_dist',
             default=10,
@@ -413,6 +886,21 @@ class StarAligner(Aligner):
             action='store_true',
             help='Perform de-novo transcript assembly using StringTie.')
 
+        assemble_group.add_argument(
+            '--assemble_targeted',
+            default=False,
+            action='store_true',
+            help=('Only assemble transcripts in the regions of fusions that '
+                  'are not annotated with a reference gene, rather than '
+                  'assembling the entire alignment.'))
+
+        assemble_group.add_argument(
+            '--assemble_padding',
+            default=10000,
+            type=int,
+            help=('Padding (in bp) added around fusion regions for '
+                  'targeted assemblies.'))
+
         filt_group = parser.add_argument_group('Filtering')
         filt_group.add_argument(
             '--no_filter_orientation',
@@ -456,14 +944,25 @@ class StarAligner(Aligner):
             threads=args.star_threads,
             extra_args=parse_arguments(args.star_args),
             external_sort=args.star_external_sort,
+            sort_memory=args.star_sort_memory,
+            decompress_command=args.star_decompress_command,
+            scratch_dir=args.scratch_dir,
             assemble=args.assemble,
+            assemble_targeted=args.assemble_targeted,
+            assemble_padding=args.assemble_padding,
             merge_junction_dist=args.merge_junction_dist,
             max_spanning_dist=args.max_spanning_dist,
             max_junction_dist=args.max_junction_dist,
             filter_features=args.filter_features,
             filter_orientation=args.filter_orientation,
             filter_blacklist=args.blacklisted_genes,
-            star_fusion_ref_path=args.star_fusion_reference)
+            star_fusion_ref_path=args.star_fusion_reference,
+            write_alignment=args.write_alignment,
+            prefilter=args.prefilter,
+            prefilter_k=args.prefilter_kmer_size,
+            chimeric_output=args.star_chimeric_output,
+            shared_genome=args.star_shared_genome,
+            two_pass=args.star_two_pass)
 
         return toolz.merge(super()._parse_args(args), kws)
 
@@ -471,13 +970,27 @@ class StarAligner(Aligner):
 register_aligner('star', StarAligner)
 
 
-def read_chimeric_junctions(chimeric_path):
+def read_chimeric_junctions(chimeric_path,
+                            transposon_name=None,
+                            chunksize=CHIMERIC_CHUNKSIZE):
     """Reads junctions from STARs Chimeric.out.junction output file.
 
+    The junction file is read in chunks. If ``transposon_name`` is given,
+    each chunk is filtered for junctions in which exactly one side involves
+    the transposon before the chunks are combined, so that memory usage
+    scales with the number of transposon reads rather than with the total
+    number of chimeric reads. Sequence names are returned as categoricals
+    and positions as compact integer types.
+
     Parameters
     ----------
-    pathlib.Path
+    chimeric_path : pathlib.Path
         Path to the Chimeric.out.junction file.
+    transposon_name : str
+        Optional name of the transposon sequence. If given, only junctions
+        that involve the transposon on exactly one side are returned.
+    chunksize : int
+        Number of rows to read per chunk.
 
     Returns
     -------
@@ -521,20 +1034,361 @@ def read_chimeric_junctions(chimeric_path):
         'first_segment_cigar', 'second_segment_base', 'second_segment_cigar'
     ]
 
-    junctions = pd.read_csv(
+    dtypes = {
+        'seqname_a': 'str',
+        'location_a': np.int32,
+        'strand_a': 'str',
+        'seqname_b': 'str',
+        'location_b': np.int32,
+        'strand_b': 'str',
+        'junction_type': np.int8,
+        'repeat_length_left': np.int32,
+        'repeat_length_right': np.int32,
+        'read_name': 'str',
+        'first_segment_base': np.int32,
+        'first_segment_cigar': 'str',
+        'second_segment_base': np.int32,
+        'second_segment_cigar': 'str'
+    }
+
+    reader = pd.read_csv(
         str(chimeric_path),
         sep='\t',
         header=None,
         names=names,
-        dtype={'seqname_a': 'str',
-               'seqname_b': 'str'})
+        dtype=dtypes,
+        chunksize=chunksize)
+
+    if transposon_name is not None:
+        chunks = (chunk.loc[(chunk['seqname_a'] == transposon_name) ^
+                            (chunk['seqname_b'] == transposon_name)]
+                  for chunk in reader) # yapf: disable
+    else:
+        chunks = reader
+
+    junctions = pd.concat(list(chunks), axis=0, ignore_index=True)
+
+    # Convert seqnames to categoricals with shared categories, so that
+    # columns can be swapped when normalizing junctions.
+    categories = sorted(
+        set(junctions['seqname_a'].unique()) |
+        set(junctions['seqname_b'].unique()))
+
+    for seq_col in ['seqname_a', 'seqname_b']:
+        junctions[seq_col] = pd.Categorical(
+            junctions[seq_col], categories=categories)
 
     for strand_col in ['strand_a', 'strand_b']:
-        junctions[strand_col] = junctions[strand_col].map({'+': 1, '-': -1})
+        junctions[strand_col] = (junctions[strand_col]
+                                 .map({'+': 1, '-': -1})
+                                 .astype(np.int8)) # yapf: disable
 
     return junctions
 
 
+_Segment = namedtuple(
+    'Segment', ['seqname', 'start', 'end', 'strand', 'cigar', 'cigartuples'])
+
+_CHIMERIC_COLUMNS = [
+    'seqname_a', 'location_a', 'strand_a', 'seqname_b', 'location_b',
+    'strand_b', 'junction_type', 'repeat_length_left', 'repeat_length_right',
+    'read_name', 'first_segment_base', 'first_segment_cigar',
+    'second_segment_base', 'second_segment_cigar'
+]
+
+
+def read_chimeric_bam(bam_path, transposon_name):
+    """Reads transposon chimeric alignments from a (WithinBAM) STAR alignment.
+
+    Reads chimeric alignments written by STAR into the main alignment using
+    ``--chimOutType WithinBAM``. Only alignments on the transposon sequence
+    are read (using the index of the alignment), after which the genomic
+    partner of each chimeric alignment is identified using the SA tag (for
+    split reads) or the mate information (for spanning mate pairs). Each
+    fragment is only reported once, preferring split reads over spanning
+    mate pairs. The result uses the same format as
+    ``read_chimeric_junctions``, meaning that locations refer to the first
+    intronic bases of the donor/acceptor.
+
+    Parameters
+    ----------
+    bam_path : pathlib.Path
+        Path to the (coordinate-sorted and indexed) alignment.
+    transposon_name : str
+        Name of the transposon sequence.
+
+    Returns
+    -------
+    pd.DataFrame
+        Pandas DataFrame containing the junction data.
+
+    """
+
+    split_rows, spanning_rows = {}, {}
+
+    with pysam.AlignmentFile(native_str(bam_path)) as bam_file:
+        for read in bam_file.fetch(transposon_name):
+            if read.is_unmapped or read.is_secondary:
+                continue
+
+            if read.has_tag('SA'):
+                row = _split_read_junction(read, transposon_name)
+                rows = split_rows
+            elif not read.is_supplementary:
+                row = _spanning_read_junction(read, transposon_name)
+                rows = spanning_rows
+            else:
+                row = None
+
+            if row is not None:
+                rows.setdefault(read.query_name, row)
+
+    # Count each fragment once, like the Chimeric.out.junction output.
+    # Fragments in which one mate is split are not counted as spanning,
+    # even though the other mate may span the fusion by itself.
+    rows = list(split_rows.values())
+    rows += [row for name, row in spanning_rows.items()
+             if name not in split_rows]
+
+    junctions = pd.DataFrame.from_records(rows, columns=_CHIMERIC_COLUMNS)
+
+    # Use same types as read_chimeric_junctions.
+    categories = sorted(
+        set(junctions['seqname_a']) | set(junctions['seqname_b']))
+
+    for seq_col in ['seqname_a', 'seqname_b']:
+        junctions[seq_col] = pd.Categorical(
+            junctions[seq_col], categories=categories)
+
+    for col in ['location_a', 'location_b', 'first_segment_base',
+                'second_segment_base', 'repeat_length_left',
+                'repeat_length_right']:
+        junctions[col] = junctions[col].astype(np.int32)
+
+    for col in ['strand_a', 'strand_b', 'junction_type']:
+        junctions[col] = junctions[col].astype(np.int8)
+
+    return junctions
+
+
+def _split_read_junction(read, transposon_name):
+    """Builds junction row for a split read from its SA partner."""
+
+    # Use the first supplementary alignment on another sequence.
+    partner = None
+    for sa_entry in read.get_tag('SA').strip(';').split(';'):
+        seqname, pos, strand, cigar = sa_entry.split(',')[:4]
+        if seqname != transposon_name:
+            partner = (seqname, int(pos) - 1, strand, cigar)
+            break
+
+    if partner is None:
+        return None
+
+    seqname, start, strand, cigar = partner
+    cigar_tuples = _parse_cigar(cigar)
+
+    segments = [
+        _Segment(read.reference_name, read.reference_start,
+                 read.reference_end, -1 if read.is_reverse else 1,
+                 read.cigarstring, read.cigartuples),
+        _Segment(seqname, start, start + _reference_length(cigar_tuples),
+                 -1 if strand == '-' else 1, cigar, cigar_tuples)
+    ]
+
+    # Determine the order of the segments within the read (donor first).
+    # Positions and strands of second mates are reversed with respect to
+    # the orientation of the fragment.
+    read_starts = [_query_start(seg) for seg in segments]
+
+    if read.is_read2:
+        segments = [seg._replace(strand=-seg.strand) for seg in segments]
+        read_starts = [-start for start in read_starts]
+
+    if read_starts[0] > read_starts[1]:
+        segments = segments[::-1]
+
+    donor, acceptor = segments
+
+    return _junction_row(donor, acceptor, read.query_name, junction_type=1)
+
+
+def _spanning_read_junction(read, transposon_name):
+    """Builds junction row for a mate pair spanning the fusion."""
+
+    if (not read.is_paired or read.mate_is_unmapped or
+            read.next_reference_name == transposon_name):
+        return None
+
+    if read.has_tag('MC'):
+        mate_end = read.next_reference_start + _reference_length(
+            _parse_cigar(read.get_tag('MC')))
+    else:
+        mate_end = read.next_reference_start + read.query_length
+
+    segments = [
+        _Segment(read.reference_name, read.reference_start,
+                 read.reference_end, -1 if read.is_reverse else 1,
+                 read.cigarstring, read.cigartuples),
+        _Segment(read.next_reference_name, read.next_reference_start,
+                 mate_end, -1 if read.mate_is_reverse else 1,
+                 read.get_tag('MC') if read.has_tag('MC') else '', None)
+    ]
+
+    # The first mate is the donor, strand of the second mate is reversed.
+    if read.is_read2:
+        segments = segments[::-1]
+
+    donor, acceptor = segments
+    acceptor = acceptor._replace(strand=-acceptor.strand)
+
+    return _junction_row(donor, acceptor, read.query_name, junction_type=-1)
+
+
+def _junction_row(donor, acceptor, read_name, junction_type):
+    # Locations are the first (1-based) intronic bases next to the segments.
+    location_a = donor.end + 1 if donor.strand == 1 else donor.start
+    location_b = acceptor.start if acceptor.strand == 1 else acceptor.end + 1
+
+    return (donor.seqname, location_a, donor.strand, acceptor.seqname,
+            location_b, acceptor.strand, junction_type, 0, 0, read_name,
+            donor.start + 1, donor.cigar, acceptor.start + 1, acceptor.cigar)
+
+
+def _parse_cigar(cigar):
+    return [(_CIGAR_OPS.index(op), int(length))
+            for length, op in CIGAR_OP_REGEX.findall(cigar)]
+
+
+def _reference_length(cigar_tuples):
+    # Operations M, D, N, = and X consume the reference.
+    return sum(length for op, length in cigar_tuples if op in {0, 2, 3, 7, 8})
+
+
+def _query_start(segment):
+    """Returns start of the aligned part of a segment within the read."""
+
+    cigar = segment.cigartuples
+    if segment.strand == -1:
+        cigar = cigar[::-1]
+
+    # Count leading clipped bases (S/H operations).
+    start = 0
+    for op, length in cigar:
+        if op not in {4, 5}:
+            break
+        start += length
+
+    return start
+
+
+def read_chimeric_junctions_cached(chimeric_path,
+                                   transposon_name=None,
+                                   cache_path=None):
+    """Reads chimeric junctions, using a binary cache if possible.
+
+    On the first call, junctions are parsed from the Chimeric.out.junction
+    file (see ``read_chimeric_junctions``) and the resulting (typed) frame
+    is stored column-wise in a binary NumPy (.npz) file. Subsequent calls
+    load the junctions from this cache, unless the size or modification
+    time of the junction file has changed or a different transposon was
+    used for filtering, in which case the junctions are parsed again.
+
+    Parameters
+    ----------
+    chimeric_path : pathlib.Path
+        Path to the Chimeric.out.junction file.
+    transposon_name : str
+        Optional name of the transposon sequence. If given, only junctions
+        that involve the transposon on exactly one side are returned.
+    cache_path : pathlib.Path
+        Path to the cache file. Defaults to the junction path,
+        suffixed with '.npz'.
+
+    Returns
+    -------
+    pd.DataFrame
+        Pandas DataFrame containing the junction data.
+
+    """
+
+    if cache_path is None:
+        cache_path = chimeric_path.with_name(chimeric_path.name + '.npz')
+
+    source_key = _junction_cache_key(chimeric_path, transposon_name)
+
+    if cache_path.exists():
+        junctions = _read_junction_cache(cache_path, source_key)
+        if junctions is not None:
+            return junctions
+
+    junctions = read_chimeric_junctions(
+        chimeric_path, transposon_name=transposon_name)
+    _write_junction_cache(junctions, cache_path, source_key)
+
+    return junctions
+
+
+def _junction_cache_key(chimeric_path, transposon_name):
+    stat = chimeric_path.stat()
+    return {
+        '_source_size': np.array(stat.st_size, dtype=np.int64),
+        '_source_mtime': np.array(stat.st_mtime, dtype=np.float64),
+        '_transposon_name': np.array(transposon_name or '', dtype='U')
+    }
+
+
+def _write_junction_cache(junctions, cache_path, source_key):
+    arrays = dict(source_key)
+    arrays['_columns'] = np.array(list(junctions.columns), dtype='U')
+
+    for col in junctions.columns:
+        values = junctions[col]
+
+        if str(values.dtype) == 'category':
+            arrays[col + '.codes'] = values.cat.codes.values
+            arrays[col + '.categories'] = np.array(
+                list(values.cat.categories), dtype='U')
+        elif values.dtype == object:
+            arrays[col] = values.values.astype('U')
+        else:
+            arrays[col] = values.values
+
+    # Write to temporary file first to avoid leaving incomplete caches.
+    tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+
+    with tmp_path.open('wb') as file_:
+        np.savez(file_, **arrays)
+
+    tmp_path.rename(cache_path)
+
+
+def _read_junction_cache(cache_path, source_key):
+    try:
+        with np.load(str(cache_path), allow_pickle=False) as data:
+            for key, value in source_key.items():
+                if data[key] != value:
+                    return None
+
+            columns = [str(col) for col in data['_columns']]
+
+            junctions = {}
+            for col in columns:
+                if col + '.codes' in data.files:
+                    junctions[col] = pd.Categorical.from_codes(
+                        data[col + '.codes'],
+                        categories=data[col + '.categories'].astype(object))
+                elif data[col].dtype.kind == 'U':
+                    junctions[col] = data[col].astype(object)
+                else:
+                    junctions[col] = data[col]
+    except (IOError, KeyError, ValueError):
+        # Treat unreadable caches as missing.
+        return None
+
+    return pd.DataFrame(junctions, columns=columns)
+
+
 def normalize_chimeric_junctions(chimeric_data, seqname=None):
     """Normalizes chimeric junction data so that seqnames are ordered.
 
@@ -566,8 +1420,11 @@ def normalize_chimeric_junctions(chimeric_data, seqname=None):
     if seqname is None:
         # Reads are 'normal' if seq_a < seq_b or, in the case that
         # seq_a == seq_b, if loc_a < loc_b.
-        same_seq = chimeric_data.seqname_a == chimeric_data.seqname_b
-        seq_ordered = (chimeric_data.seqname_a < chimeric_data.seqname_b)
+        seqname_a = chimeric_data.seqname_a.astype(str)
+        seqname_b = chimeric_data.seqname_b.astype(str)
+
+        same_seq = seqname_a == seqname_b
+        seq_ordered = seqname_a < seqname_b
         loc_ordered = (chimeric_data.location_a < chimeric_data.location_b)
 
         norm_mask = (seq_ordered | (same_seq & loc_ordered))
@@ -635,7 +1492,8 @@ def extract_transposon_fusions(chimeric_data,
         max_dist_right=max_junction_dist)
 
     # Extract spanning fusions from unused reads.
-    spanning = extract_spanning_fusions(unassigned, max_dist=max_spanning_dist)
+    spanning = Fusion.from_frame(
+        extract_spanning_fusions(unassigned, max_dist=max_spanning_dist))
     fusions = itertools.chain.from_iterable([junctions, spanning])
 
     # Convert to transposon fusions.
@@ -653,14 +1511,17 @@ def extract_junction_fusions(chimeric_data, merge_dist=None):
         # Add flanking annotation.
         chimeric_data = chimeric_data.copy()
 
-        flanks = (_flank_sizes(t) for t in chimeric_data.itertuples())
-        chimeric_data['flank_a'], chimeric_data['flank_b'] = zip(*flanks)
+        flank_a, flank_b = _flank_sizes(chimeric_data)
+        chimeric_data['flank_a'] = flank_a
+        chimeric_data['flank_b'] = flank_b
 
         # Group by position and summarize.
-        grouped = chimeric_data.groupby([
-            'seqname_a', 'location_a', 'strand_a', 'seqname_b', 'location_b',
-            'strand_b'
-        ])
+        grouped = chimeric_data.groupby(
+            [
+                'seqname_a', 'location_a', 'strand_a', 'seqname_b',
+                'location_b', 'strand_b'
+            ],
+            observed=True)
 
         summarized = (grouped.agg({
             'flank_a': 'max',
@@ -682,191 +1543,302 @@ def extract_junction_fusions(chimeric_data, merge_dist=None):
             yield fusion
 
 
-def _flank_sizes(row):
-    return (_flank_size(row, donor=True), _flank_size(row, donor=False))
+def _flank_sizes(chimeric_data):
+    """Calculates flank sizes of chimeric reads on both sides of the fusion.
 
+    Flank sizes are calculated as the number of matching bases of the
+    relevant mate in the CIGAR strings of the first (donor) and second
+    (acceptor) segments. Computed for all reads at once using vectorized
+    string operations.
 
-def _flank_size(row, donor=True):
-    """Calculates flank size of a spanning read on one side of the fusion."""
+    Parameters
+    ----------
+    chimeric_data : pd.DataFrame
+        Chimeric junction data.
 
-    if donor:
-        mate_index = -1 if row.strand_a == 1 else 0
-        cigar = row.first_segment_cigar
-    else:
-        mate_index = 0 if row.strand_b == 1 else -1
-        cigar = row.second_segment_cigar
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Flank sizes for the donor (a) and acceptor (b) sides.
+
+    """
+
+    flank_a = _sum_matches(
+        _select_mate(
+            chimeric_data['first_segment_cigar'],
+            first=chimeric_data['strand_a'].values != 1))
 
-    cigar_split = cigar.split('p')
-    size = _sum_matches(cigar_split[mate_index])
+    flank_b = _sum_matches(
+        _select_mate(
+            chimeric_data['second_segment_cigar'],
+            first=chimeric_data['strand_b'].values == 1))
 
-    return size
+    return flank_a, flank_b
 
 
-def _sum_matches(cigar_str):
-    """Sums the number of matches in a CIGAR string."""
-    matches = CIGAR_MATCH_REGEX.findall(cigar_str)
-    return sum(map(int, matches))
+def _select_mate(cigars, first):
+    """Selects first/last mate from (paired) CIGAR strings separated by 'p'."""
 
+    cigars = pd.Series(np.asarray(cigars, dtype=object))
 
-def assign_spanning_reads(junctions, chimeric_data, max_dist_left,
-                          max_dist_right):
-    """Assigns spanning reads to the closest junction that they support."""
+    first_mate = cigars.str.split('p', n=1).str[0]
+    last_mate = cigars.str.rsplit('p', n=1).str[-1]
+
+    return first_mate.where(first, last_mate)
+
+
+def _sum_matches(cigars):
+    """Sums the number of matches in a Series of CIGAR strings."""
+
+    matches = cigars.str.extractall(CIGAR_MATCH_REGEX)[0].astype(np.int64)
+    sums = matches.groupby(level=0).sum()
+
+    return sums.reindex(cigars.index, fill_value=0).values
+
+
+def assign_spanning_reads(junctions,
+                          chimeric_data,
+                          max_dist_left,
+                          max_dist_right,
+                          slack=5):
+    """Assigns spanning reads to the closest junction that they support.
+
+    Spanning reads support a junction if the junction lies on the same
+    sequences and strands, within ``max_dist_left`` bases downstream of the
+    donor location of the read and within ``max_dist_right`` bases upstream
+    of the acceptor location of the read (with ``slack`` bases of leeway in
+    the opposite direction). Reads supporting multiple junctions are
+    assigned to the junction with the smallest (summed) distance, ties are
+    broken in favor of the first junction.
+
+    Parameters
+    ----------
+    junctions : List[Fusion]
+        Junction fusions to assign reads to.
+    chimeric_data : pd.DataFrame
+        Chimeric read data. Only spanning reads (with a negative junction
+        type) are considered for assignment.
+    max_dist_left : int
+        Maximum distance between the donor locations of read and junction.
+    max_dist_right : int
+        Maximum distance between the acceptor locations of read and junction.
+    slack : int
+        Number of bases a junction may lie in the 'wrong' direction.
+
+    Returns
+    -------
+    Tuple[List[Fusion], pd.DataFrame]
+        Junctions, updated with the number of assigned spanning reads,
+        and a frame containing the spanning reads that were not assigned.
+
+    """
 
     # Ensure chimeric data only contains spanning reads.
     chimeric_data = chimeric_data.query('junction_type < 0')
 
     # Assign chimeric reads to junctions.
-    trees_a = _build_lookup_trees(junctions, side='a')
-    trees_b = _build_lookup_trees(junctions, side='b')
-
-    assignments = collections.defaultdict(list)
-    unassigned_idx = []
-
-    for spanning_read in chimeric_data.itertuples():
-        junc = _lookup_closest(spanning_read, trees_a, trees_b, max_dist_left,
-                               max_dist_right)
+    assigned = _assign_closest(
+        junctions,
+        chimeric_data,
+        max_dist_left=max_dist_left,
+        max_dist_right=max_dist_right,
+        slack=slack)
 
-        if junc is not None:
-            assignments[junc].append(spanning_read)
-        else:
-            unassigned_idx.append(spanning_read.Index)
+    counts = np.bincount(
+        assigned[assigned >= 0], minlength=len(junctions))
 
     # Augment junctions.
     new_juncs = [
-        junc._replace(
-            support_spanning=junc.support_spanning + len(assignments[junc]))
-        for junc in junctions
+        junc._replace(support_spanning=junc.support_spanning + int(count))
+        for junc, count in zip(junctions, counts)
     ]
 
     # Select unassigned reads.
-    unassigned = chimeric_data.loc[unassigned_idx]
+    unassigned = chimeric_data.loc[assigned < 0]
 
     return new_juncs, unassigned
 
 
-def _build_lookup_trees(fusions, side='a'):
-    # Define attr getters.
-    get_seq = operator.attrgetter('seqname_' + side)
-    get_loc = operator.attrgetter('location_' + side)
-    get_strand = operator.attrgetter('strand_' + side)
-
-    # Setup keyfunc.
-    def _keyfunc(fusion):
-        return (get_seq(fusion), get_strand(fusion))
-
-    # Sort and group fusions.
-    fusions = sorted(fusions, key=_keyfunc)
-    grouped = itertools.groupby(fusions, key=_keyfunc)
-
-    trees = {}
-    for key, grp in grouped:
-        trees[key] = IntervalTree.from_tuples(
-            (get_loc(fus), get_loc(fus) + 1, fus) for fus in grp)
-
-    return trees
-
-
-def _lookup_closest(fusion,
-                    trees_a,
-                    trees_b,
-                    max_dist_left,
-                    max_dist_right,
-                    slack=5):
-    def _dist(fusion, hit):
-        return (abs(fusion.location_a - hit.location_a) +
-                abs(fusion.location_b - hit.location_b))
-
-    # Identify candidate fusions.
-    overlap_a = _lookup_tree(
-        fusion, trees_a, side='a', max_dist=max_dist_left, slack=slack)
-    overlap_b = _lookup_tree(
-        fusion, trees_b, side='b', max_dist=max_dist_right, slack=slack)
-    overlap = list(overlap_a & overlap_b)
-
-    if len(overlap) > 0:
-        distances = np.array(_dist(fusion, hit) for hit in overlap)
-        return overlap[distances.argmin()]
-    else:
-        return None
+def _assign_closest(junctions, spanning_data, max_dist_left, max_dist_right,
+                    slack):
+    """Returns index of the closest supported junction for each read.
 
+    Reads are matched against junctions with the same seqnames/strands
+    using a sorted sweep over the donor locations of the junctions. Reads
+    that do not support any junction are assigned -1.
+    """
 
-def _lookup_tree(fusion, trees, side, max_dist=300, slack=5):
+    assigned = np.full(len(spanning_data), -1, dtype=np.int64)
 
-    # Define attr getters.
-    get_seq = operator.attrgetter('seqname_' + side)
-    get_loc = operator.attrgetter('location_' + side)
-    get_strand = operator.attrgetter('strand_' + side)
+    if len(junctions) == 0 or len(spanning_data) == 0:
+        return assigned
 
-    # Setup tree, query range.
-    strand = get_strand(fusion)
+    junc_frame = Fusion.to_frame(junctions).assign(
+        index=np.arange(len(junctions)))
 
-    try:
-        tree = trees[(get_seq(fusion), strand)]
+    key_cols = ['seqname_a', 'strand_a', 'seqname_b', 'strand_b']
 
-        direction = (-1 if side == 'a' else 1) * strand
+    for key, grp in junc_frame.groupby(key_cols):
+        # Select reads on the same seqnames/strands.
+        read_mask = np.ones(len(spanning_data), dtype=bool)
+        for col, value in zip(key_cols, key):
+            read_mask &= (spanning_data[col] == value).values
 
-        loc = get_loc(fusion)
-        if direction == 1:
-            start, end = loc - max_dist, loc + slack
+        if not read_mask.any():
+            continue
+
+        read_loc_a = spanning_data['location_a'].values[read_mask]
+        read_loc_b = spanning_data['location_b'].values[read_mask]
+
+        read_loc_a = read_loc_a.astype(np.int64)
+        read_loc_b = read_loc_b.astype(np.int64)
+
+        # Determine (half-open) query ranges on both sides. Junctions are
+        # expected downstream of the donor and upstream of the acceptor.
+        _, strand_a, _, strand_b = key
+
+        if strand_a == 1:
+            start_a, end_a = read_loc_a - slack, read_loc_a + max_dist_left
         else:
-            start, end = loc - slack, loc + max_dist
+            start_a, end_a = read_loc_a - max_dist_left, read_loc_a + slack
+
+        if strand_b == 1:
+            start_b, end_b = read_loc_b - max_dist_right, read_loc_b + slack
+        else:
+            start_b, end_b = read_loc_b - slack, read_loc_b + max_dist_right
+
+        # Find junctions within range of the donor using the sorted
+        # junction donor locations.
+        grp = grp.sort_values(['location_a', 'index'])
+
+        junc_loc_a = grp['location_a'].values.astype(np.int64)
+        junc_loc_b = grp['location_b'].values.astype(np.int64)
+        junc_index = grp['index'].values
+
+        left = np.searchsorted(junc_loc_a, start_a, side='left')
+        right = np.searchsorted(junc_loc_a, end_a, side='left')
+        sizes = np.maximum(right - left, 0)
 
-        # Determine overlap and return fusions.
-        overlap = set(tup[2] for tup in tree[start:end])
+        # Expand to (read, junction) candidate pairs.
+        read_idx = np.repeat(np.arange(len(read_loc_a)), sizes)
+        offsets = np.arange(sizes.sum()) - np.repeat(
+            np.cumsum(sizes) - sizes, sizes)
+        junc_idx = np.repeat(left, sizes) + offsets
 
-        return overlap
-    except KeyError:
-        return set()
+        # Filter candidates within range of the acceptor.
+        in_range = ((junc_loc_b[junc_idx] >= start_b[read_idx]) &
+                    (junc_loc_b[junc_idx] < end_b[read_idx]))
+
+        read_idx, junc_idx = read_idx[in_range], junc_idx[in_range]
+
+        # Select closest junction per read.
+        dist = (np.abs(read_loc_a[read_idx] - junc_loc_a[junc_idx]) +
+                np.abs(read_loc_b[read_idx] - junc_loc_b[junc_idx]))
+
+        order = np.lexsort((junc_index[junc_idx], dist, read_idx))
+        read_idx, junc_idx = read_idx[order], junc_idx[order]
+
+        is_first = np.ones(len(read_idx), dtype=bool)
+        is_first[1:] = read_idx[1:] != read_idx[:-1]
+
+        read_positions = np.flatnonzero(read_mask)
+        assigned[read_positions[read_idx[is_first]]] = \
+            junc_index[junc_idx[is_first]]
+
+    return assigned
 
 
 def extract_spanning_fusions(chimeric_data, max_dist):
-    """Extracts spanning fusions from a STAR chimeric read dataframe."""
+    """Extracts spanning fusions from a STAR chimeric read dataframe.
+
+    Spanning reads are clustered on both sides of the fusion, with reads
+    being assigned to the same cluster if they lie within ``max_dist`` of
+    each other (single linkage) and share the same seqnames/strands.
+
+    Parameters
+    ----------
+    chimeric_data : pd.DataFrame
+        Chimeric read data. Only spanning reads (with a negative junction
+        type) are used.
+    max_dist : int
+        Maximum distance between reads in a cluster.
+
+    Returns
+    -------
+    pd.DataFrame
+        Frame of spanning fusions (with the same columns as ``Fusion``).
+
+    """
 
     # Select spanning fusions.
     chimeric_data = chimeric_data.query('junction_type < 0')
 
-    # Group by position and summarize.
-    for grp in _groupby_position(chimeric_data, max_dist=max_dist):
-        first = grp.iloc[0]
+    if len(chimeric_data) == 0:
+        return pd.DataFrame.from_records([], columns=Fusion._fields)
 
-        agg_donor = max if first.strand_a == 1 else min
-        agg_acc = min if first.strand_b == 1 else max
+    # Cluster reads by position.
+    grp_cols = ['seqname_a', 'seqname_b', 'strand_a', 'strand_b']
+    keys = chimeric_data.groupby(grp_cols, observed=True).ngroup().values
 
-        yield Fusion(
-            seqname_a=first.seqname_a,
-            location_a=agg_donor(grp.location_a),
-            strand_a=first.strand_a,
-            seqname_b=first.seqname_b,
-            location_b=agg_acc(grp.location_b),
-            strand_b=first.strand_b,
-            support_junction=0,
-            support_spanning=len(grp),
-            flank_a=0,
-            flank_b=0)
+    loc_a = chimeric_data['location_a'].values.astype(np.int64)
+    loc_b = chimeric_data['location_b'].values.astype(np.int64)
 
+    clust_a = _cluster_positions(keys, loc_a, max_dist=max_dist)
+    clust_b = _cluster_positions(keys, loc_b, max_dist=max_dist)
 
-def _groupby_position(spanning_data, max_dist):
-    """Groups reads within given distance at both locations."""
+    # Determine groups of reads with identical clusters on both sides.
+    order = np.lexsort((clust_b, clust_a))
+    clust_a, clust_b = clust_a[order], clust_b[order]
 
-    grp_cols = ['seqname_a', 'seqname_b', 'strand_a', 'strand_b']
+    is_start = np.ones(len(order), dtype=bool)
+    is_start[1:] = ((clust_a[1:] != clust_a[:-1]) |
+                    (clust_b[1:] != clust_b[:-1]))
+    starts = np.flatnonzero(is_start)
+
+    # Summarize locations, using the location closest to the junction.
+    loc_a, loc_b = loc_a[order], loc_b[order]
+    first = order[starts]
+
+    strand_a = chimeric_data['strand_a'].values[first]
+    strand_b = chimeric_data['strand_b'].values[first]
+
+    location_a = np.where(strand_a == 1,
+                          np.maximum.reduceat(loc_a, starts),
+                          np.minimum.reduceat(loc_a, starts))
+
+    location_b = np.where(strand_b == 1,
+                          np.minimum.reduceat(loc_b, starts),
+                          np.maximum.reduceat(loc_b, starts))
+
+    fusions = pd.DataFrame(
+        {
+            'seqname_a': chimeric_data['seqname_a'].values[first],
+            'location_a': location_a,
+            'strand_a': strand_a,
+            'seqname_b': chimeric_data['seqname_b'].values[first],
+            'location_b': location_b,
+            'strand_b': strand_b,
+            'flank_a': 0,
+            'flank_b': 0,
+            'support_junction': 0,
+            'support_spanning': np.diff(np.append(starts, len(order)))
+        },
+        columns=Fusion._fields)
+
+    return fusions
 
-    for _, grp in spanning_data.groupby(grp_cols):
-        if len(grp) == 1:
-            yield grp
-        else:
-            clust_a = _cluster_positions(
-                grp, col='location_a', max_dist=max_dist)
-            clust_b = _cluster_positions(
-                grp, col='location_b', max_dist=max_dist)
 
-            for _, loc_grp in grp.groupby([clust_a, clust_b]):
-                yield loc_grp
+def _cluster_positions(keys, locations, max_dist):
+    """Clusters locations within max_dist of each other, per key."""
 
+    order = np.lexsort((locations, keys))
+    sorted_keys, sorted_locs = keys[order], locations[order]
 
-def _cluster_positions(df, col, max_dist):
-    locs = df[col].sort_values()
+    is_new = np.ones(len(order), dtype=bool)
+    is_new[1:] = ((sorted_keys[1:] != sorted_keys[:-1]) |
+                  (np.diff(sorted_locs) > max_dist))
 
-    diff = np.diff(np.insert(locs.values, 0, 0))
-    groups = pd.Series(np.cumsum(diff > max_dist), index=locs.index)
+    clusters = np.empty(len(order), dtype=np.int64)
+    clusters[order] = np.cumsum(is_new)
 
-    return groups.loc[df.index]
+    return clusters
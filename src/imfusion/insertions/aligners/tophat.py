@@ -6,22 +6,21 @@ from __future__ import absolute_import, division, print_function
 from builtins import *
 # pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
 
-from future.utils import native_str
+import numpy as np
 import pandas as pd
 from pathlib2 import Path
-import pysam
 import toolz
 
 from imfusion.build.indexers.tophat import TophatReference
-from imfusion.external.stringtie import stringtie_assemble
+from imfusion.external.compound import index_bam
 from imfusion.external.tophat import tophat2_align
-from imfusion.external.util import parse_arguments
+from imfusion.external.util import decompress_command, parse_arguments
 from imfusion.model import TransposonFusion
-from imfusion.util import path, tabix
-from imfusion.util.frozendict import frozendict
+from imfusion.util import log, path
 
 from .base import Aligner, register_aligner
 from .. import util
+from ..manifest import StageManifest
 
 
 class TophatAligner(Aligner):
@@ -61,6 +60,14 @@ class TophatAligner(Aligner):
         transposon feature is in the wrong orientation.
     filter_blacklist : List[str]
         List of gene ids to filter insertions for.
+    assemble_targeted : bool
+        Whether to restrict the assembly to the genomic regions of fusions
+        that are not annotated with a reference gene, rather than assembling
+        the entire alignment. As the assembly is only used to annotate these
+        fusions, this gives the same annotation in a fraction of the time.
+    assemble_padding : int
+        Padding (in bp) added around the fusion regions for targeted
+        assemblies, which should cover the transcripts of the fusions.
 
     """
 
@@ -74,12 +81,16 @@ class TophatAligner(Aligner):
                  logger=None,
                  filter_features=True,
                  filter_orientation=True,
-                 filter_blacklist=None):
+                 filter_blacklist=None,
+                 assemble_targeted=False,
+                 assemble_padding=10000):
 
         super().__init__(reference=reference, logger=logger)
 
         self._assemble = assemble
         self._assemble_args = assemble_args or {}
+        self._assemble_targeted = assemble_targeted
+        self._assemble_padding = assemble_padding
         self._min_flank = min_flank
         self._threads = threads
         self._extra_args = extra_args or {}
@@ -97,60 +108,84 @@ class TophatAligner(Aligner):
 
         return programs
 
+    @property
+    def threads(self):
+        return self._threads
+
     def identify_insertions(self, fastq_path, output_dir, fastq2_path=None):
         """Identifies insertions from given reads."""
 
-        # Perform alignment using STAR.
+        output_dir.mkdir(parents=True, exist_ok=True)
+        manifest = StageManifest.for_sample(output_dir)
+
+        # Perform alignment using Tophat2.
         alignment_path = output_dir / 'alignment.bam'
-        if not alignment_path.exists():
-            self._logger.info('Performing alignment using Tophat2')
-            self._align(fastq_path, output_dir, fastq2_path=fastq2_path)
-            pysam.index(native_str(alignment_path))
-        else:
-            self._logger.info('Using existing Tophat2 alignment')
+        fusion_path = output_dir / 'fusions.out'
 
-        # Assemble transcripts if requested.
-        if self._assemble:
-            assembled_path = output_dir / 'assembled.gtf.gz'
-            if not assembled_path.exists():
-                self._logger.info('Assembling transcripts using Stringie')
-
-                # Generate assembled GTF.
-                stringtie_out_path = assembled_path.with_suffix('')
-                stringtie_assemble(
-                    alignment_path,
-                    gtf_path=self._reference.gtf_path,
-                    output_path=stringtie_out_path)
-
-                # Compress and index.
-                tabix.index_gtf(stringtie_out_path, output_path=assembled_path)
-                stringtie_out_path.unlink()
-            else:
-                self._logger.info('Using existing Stringtie assembly')
+        align_kws = dict(
+            inputs=path.as_path_list(fastq_path) +
+            path.as_path_list(fastq2_path),
+            params={
+                'index_path': self._reference.index_path,
+                'min_flank': self._min_flank,
+                'extra_args': self._extra_args
+            },
+            outputs=[
+                alignment_path, alignment_path.with_suffix('.bam.bai'),
+                fusion_path
+            ])
+
+        if manifest.is_complete('alignment', **align_kws):
+            self._logger.info('Using existing Tophat2 alignment')
         else:
-            assembled_path = None
-
-        # Extract identified fusions.
-        self._logger.info('Extracting gene-transposon fusions')
-        fusion_path = output_dir / 'fusions.out'
-        fusions = self._extract_fusions(fusion_path)
-
-        # Extract insertions.
-        self._logger.info('Summarizing insertions')
-        insertions = list(
-            util.extract_insertions(
-                fusions,
-                gtf_path=self._reference.indexed_gtf_path,
-                features_path=self._reference.features_path,
-                assembled_gtf_path=assembled_path,
-                ffpm_fastq_path=fastq_path,
-                chromosomes=None))
-
-        insertions = util.filter_insertions(
-            insertions,
-            features=self._filter_features,
-            orientation=self._filter_orientation,
-            blacklist=self._filter_blacklist)
+            with self._stage('alignment', heavy=True):
+                manifest.invalidate('alignment')
+
+                self._logger.info('Performing alignment using Tophat2')
+                self._align(fastq_path, output_dir, fastq2_path=fastq2_path)
+                index_bam(alignment_path, threads=self._threads)
+
+                manifest.record('alignment', **align_kws)
+
+        # Assemble transcripts in the background whilst fusions are
+        # extracted, as only the assembly-based annotation of the fusions
+        # depends on the assembly.
+        # Load the gene annotation before starting any threads, so that it
+        # can be built using multiple processes if needed.
+        gene_reference = self._reference.transcript_reference(
+            workers=self._threads)
+
+        with self._stage('annotation'):
+            pool = log.thread_pool(1)
+
+            try:
+                assembled_path = self._start_assembly(pool, alignment_path,
+                                                      output_dir, manifest)
+
+                # Extract identified fusions.
+                self._logger.info('Extracting gene-transposon fusions')
+                fusions = list(self._extract_fusions(fusion_path))
+
+                # Extract insertions.
+                self._logger.info('Summarizing insertions')
+                insertions = list(
+                    util.extract_insertions(
+                        fusions,
+                        gtf_path=gene_reference,
+                        features_path=self._reference.transposon_features,
+                        assembled_gtf_path=assembled_path,
+                        ffpm_fastq_path=fastq_path,
+                        chromosomes=None,
+                        decompress_command=decompress_command(self._threads)))
+
+                insertions = util.filter_insertions(
+                    insertions,
+                    features=self._filter_features,
+                    orientation=self._filter_orientation,
+                    blacklist=self._filter_blacklist)
+            finally:
+                pool.close()
+                pool.join()
 
         for insertion in insertions:
             yield insertion
@@ -182,11 +217,13 @@ class TophatAligner(Aligner):
         # Symlink alignment into expected location for gene counts.
         path.symlink_relative(
             src_path=tophat_dir / 'accepted_hits.bam',
-            dest_path=output_dir / 'alignment.bam')
+            dest_path=output_dir / 'alignment.bam',
+            overwrite=True)
 
         path.symlink_relative(
             src_path=tophat_dir / 'fusions.out',
-            dest_path=output_dir / 'fusions.out')
+            dest_path=output_dir / 'fusions.out',
+            overwrite=True)
 
     def _extract_fusions(self, fusion_path):
         fusion_data = read_fusion_out(fusion_path)
@@ -198,8 +235,8 @@ class TophatAligner(Aligner):
             yield fusion
 
     @classmethod
-    def configure_args(cls, parser):
-        super().configure_args(parser)
+    def configure_args(cls, parser, batch=False):
+        super().configure_args(parser, batch=batch)
 
         group = parser.add_argument_group('Tophat2 arguments')
         group.add_argument(
@@ -228,6 +265,21 @@ class TophatAligner(Aligner):
             action='store_true',
             help='Perform de-novo transcript assembly using StringTie.')
 
+        assemble_group.add_argument(
+            '--assemble_targeted',
+            default=False,
+            action='store_true',
+            help=('Only assemble transcripts in the regions of fusions that '
+                  'are not annotated with a reference gene, rather than '
+                  'assembling the entire alignment.'))
+
+        assemble_group.add_argument(
+            '--assemble_padding',
+            default=10000,
+            type=int,
+            help=('Padding (in bp) added around fusion regions for '
+                  'targeted assemblies.'))
+
         filt_group = parser.add_argument_group('Filtering')
         filt_group.add_argument(
             '--no_filter_orientation',
@@ -257,6 +309,8 @@ class TophatAligner(Aligner):
             threads=args.tophat_threads,
             extra_args=args.tophat_args,
             assemble=args.assemble,
+            assemble_targeted=args.assemble_targeted,
+            assemble_padding=args.assemble_padding,
             filter_features=args.filter_features,
             filter_orientation=args.filter_orientation,
             filter_blacklist=args.blacklisted_genes)
@@ -294,13 +348,9 @@ def read_fusion_out(fusion_path):
     fusions = pd.read_csv(
         fusion_path, sep='\t', header=None, usecols=range(0, 10), names=names)
 
-    # Split combined entries.
+    # Split combined entries (also maps orientation to strands).
     fusions = _split_fields(fusions)
 
-    # Map orientation to strands.
-    fusions['strand_a'] = fusions['strand_a'].map({'f': 1, 'r': -1})
-    fusions['strand_b'] = fusions['strand_b'].map({'f': 1, 'r': -1})
-
     return fusions
 
 
@@ -318,11 +368,15 @@ def _split_fields(fusions):
         fusions = pd.DataFrame.from_records([], columns=columns)
     else:
         # Split combined entries.
-        fusions['seqname_a'], fusions['seqname_b'] = \
-            zip(*fusions['seqnames'].str.split('-'))
+        seqnames = fusions['seqnames'].str.split('-', n=1, expand=True)
+        fusions['seqname_a'] = seqnames[0]
+        fusions['seqname_b'] = seqnames[1]
 
-        fusions['strand_a'], fusions['strand_b'] = \
-            zip(*fusions['orientation'].apply(list))
+        orientation = fusions['orientation'].values.astype(str)
+        fusions['strand_a'] = np.where(
+            np.char.startswith(orientation, 'f'), 1, -1)
+        fusions['strand_b'] = np.where(
+            np.char.endswith(orientation, 'f'), 1, -1)
 
         # Subset/Reorder columns.
         fusions = fusions[columns]
@@ -336,8 +390,36 @@ def extract_transposon_fusions(fusion_data, transposon_name):
 
     Parameters
     ----------
-    file_path : pathlib.Path
-        Path to the Tophat fusion file (fusions.out).
+    fusion_data : pandas.DataFrame
+        DataFrame containing Tophat fusions (see ``read_fusion_out``).
+    transposon_name : str
+        Name of the transposon sequence in the augmented reference
+        genome that was used for the alignment.
+
+    Yields
+    ------
+    TransposonFusion
+        Yields the identified gene-transposon fusions.
+
+    """
+
+    fusion_frame = transposon_fusion_frame(fusion_data, transposon_name)
+
+    for fusion in TransposonFusion.from_frame(fusion_frame):
+        yield fusion
+
+
+def transposon_fusion_frame(fusion_data, transposon_name):
+    """Converts Tophat fusions to a frame of gene-transposon fusions.
+
+    Selects fusions between the transposon and the genome and determines
+    the genomic/transposon side of each fusion, the corresponding flank
+    signs and the support of each fusion in a single columnar pass.
+
+    Parameters
+    ----------
+    fusion_data : pandas.DataFrame
+        DataFrame containing Tophat fusions (see ``read_fusion_out``).
     transposon_name : str
         Name of the transposon sequence in the augmented reference
         genome that was used for the alignment.
@@ -345,7 +427,8 @@ def extract_transposon_fusions(fusion_data, transposon_name):
     Returns
     -------
     pandas.DataFrame
-        DataFrame containing gene-transposon fusions.
+        DataFrame containing gene-transposon fusions, with columns
+        corresponding to the fields of ``TransposonFusion``.
 
     """
 
@@ -357,37 +440,43 @@ def extract_transposon_fusions(fusion_data, transposon_name):
         (fusion_data['seqname_a'] == transposon_name) ^
         (fusion_data['seqname_b'] == transposon_name))]
 
-    # Build frame with candidate insertions.
-    for _, fusion_row in fusion_data.iterrows():
-        yield _to_fusion_obj(fusion_row, transposon_name, is_paired)
+    # Side a is the transposon if its seqname matches, otherwise side b.
+    tr_is_a = (fusion_data['seqname_a'] == transposon_name).values
 
+    def _select(column, transposon=False):
+        values_a = fusion_data[column + '_a'].values
+        values_b = fusion_data[column + '_b'].values
 
-def _to_fusion_obj(fusion, transposon_name, is_paired):
-    if fusion.seqname_a == transposon_name:
-        gen_id, tr_id = 'b', 'a'
-        gen_dir, tr_dir = 1, -1
-    else:
-        gen_id, tr_id = 'a', 'b'
-        gen_dir, tr_dir = -1, 1
+        if transposon:
+            return np.where(tr_is_a, values_a, values_b)
+        return np.where(tr_is_a, values_b, values_a)
+
+    # Genome flanks point away from side a, transposon flanks from side b.
+    gen_dir = np.where(tr_is_a, 1, -1)
 
-    strand_genome = fusion['strand_' + gen_id]
-    strand_transposon = fusion['strand_' + tr_id]
+    strand_genome = _select('strand')
+    strand_transposon = _select('strand', transposon=True)
 
     if is_paired:
-        support_junction = fusion.supp_spanning_mates
-        support_spanning = fusion.supp_mates
+        support_junction = fusion_data['supp_spanning_mates'].values
+        support_spanning = fusion_data['supp_mates'].values
     else:
-        support_junction = fusion.supp_reads
-        support_spanning = 0
-
-    return TransposonFusion(
-        seqname=fusion['seqname_' + gen_id],
-        anchor_genome=fusion['location_' + gen_id],
-        anchor_transposon=fusion['location_' + tr_id],
-        flank_genome=fusion['flank_' + gen_id] * strand_genome * gen_dir,
-        flank_transposon=fusion['flank_' + tr_id] * strand_transposon * tr_dir,
-        strand_genome=strand_genome,
-        strand_transposon=strand_transposon,
-        support_junction=support_junction,
-        support_spanning=support_spanning,
-        metadata=frozendict())
+        support_junction = fusion_data['supp_reads'].values
+        support_spanning = np.zeros(len(fusion_data), dtype=int)
+
+    fusion_frame = pd.DataFrame(
+        {
+            'seqname': _select('seqname'),
+            'anchor_genome': _select('location'),
+            'anchor_transposon': _select('location', transposon=True),
+            'strand_genome': strand_genome,
+            'strand_transposon': strand_transposon,
+            'flank_genome': _select('flank') * strand_genome * gen_dir,
+            'flank_transposon': (_select('flank', transposon=True) *
+                                 strand_transposon * -gen_dir),
+            'support_junction': support_junction,
+            'support_spanning': support_spanning
+        },
+        columns=TransposonFusion._get_columns())
+
+    return fusion_frame
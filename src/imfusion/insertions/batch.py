@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""Functionality for identifying insertions for batches of samples."""
+
+# pylint: disable=wildcard-import,redefined-builtin,unused-wildcard-import
+from __future__ import absolute_import, division, print_function
+from builtins import *
+# pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
+
+from collections import namedtuple
+import contextlib
+import functools
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import threading
+
+import pandas as pd
+from pathlib2 import Path
+
+from imfusion.model import Insertion
+from imfusion.util import log
+
+Sample = namedtuple('Sample', ['name', 'fastq_path', 'fastq2_path'])
+
+LOG_FORMAT = '[%(asctime)-15s] %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def read_sample_sheet(sheet_path):
+    """Reads samples from a sample sheet.
+
+    The sample sheet should be a tab-separated file containing the columns
+    'sample' (the sample name), 'fastq' (path to the fastq file) and,
+    optionally, 'fastq2' (path to the fastq file of the second mate, for
+    paired-end data). Samples sequenced over multiple lanes can list the
+    fastq files of all lanes as comma-separated lists. Relative fastq paths
+    are interpreted relative to the location of the sample sheet.
+
+    Parameters
+    ----------
+    sheet_path : pathlib.Path
+        Path to the sample sheet.
+
+    Returns
+    -------
+    List[Sample]
+        List of samples described in the sample sheet.
+
+    """
+
+    sheet = pd.read_csv(str(sheet_path), sep='\t', dtype=str)
+
+    missing = {'sample', 'fastq'} - set(sheet.columns)
+    if missing:
+        raise ValueError('Sample sheet is missing required columns: {}'
+                         .format(', '.join(sorted(missing))))
+
+    if sheet['sample'].duplicated().any():
+        raise ValueError('Sample sheet contains duplicate sample names')
+
+    if 'fastq2' not in sheet.columns:
+        sheet['fastq2'] = None
+
+    def _to_paths(value):
+        if pd.isnull(value):
+            return None
+        return [sheet_path.parent / Path(fp) for fp in value.split(',')]
+
+    return [
+        Sample(name=name, fastq_path=_to_paths(fq), fastq2_path=_to_paths(fq2))
+        for name, fq, fq2 in zip(sheet['sample'], sheet['fastq'],
+                                 sheet['fastq2'])
+    ]
+
+
+def identify_insertions_batch(aligner,
+                              samples,
+                              output_dir,
+                              max_threads=None,
+                              max_memory=None,
+                              sample_memory=None,
+                              logger=None):
+    """Identifies insertions for a batch of samples.
+
+    Samples are processed concurrently within the given thread and memory
+    budgets. The processing stages of the samples are scheduled separately
+    (see ``StageScheduler``): all stages reserve the threads of the aligner,
+    but only heavy stages (the alignment, including sorting) also reserve
+    ``sample_memory``. This allows light stages (such as the annotation of
+    insertions) of some samples to run whilst others are being aligned,
+    even if the memory budget does not allow more alignments. Resources
+    shared between samples (such as a genome index loaded into shared
+    memory) are set up once for the entire batch by the aligner.
+
+    Identified insertions are written to the file ``insertions.txt`` in the
+    output directory of each sample, which is created as a sub-directory of
+    ``output_dir``. Log messages of each sample are also written to the file
+    ``imfusion.log`` in its output directory. Failure of a sample does not
+    affect the processing of other samples. The status of all samples is
+    summarized in the file ``summary.txt`` in ``output_dir``.
+
+    Parameters
+    ----------
+    aligner : Aligner
+        Aligner to use for identifying insertions.
+    samples : List[Sample]
+        Samples to process.
+    output_dir : pathlib.Path
+        Output directory for the batch.
+    max_threads : int
+        Maximum number of threads to use. Defaults to the number of CPUs.
+    max_memory : float
+        Maximum amount of memory to use (in GB). If not given, the number of
+        concurrent alignments is only limited by ``max_threads``.
+    sample_memory : float
+        Expected memory usage (in GB) of the alignment of a single sample,
+        excluding any memory that is shared between samples.
+    logger : logging.Logger
+        Logger to be used for logging messages.
+
+    Returns
+    -------
+    List[str]
+        Names of the samples that failed.
+
+    """
+
+    logger = logger or logging.getLogger()
+
+    if max_threads is None:
+        max_threads = multiprocessing.cpu_count()
+
+    # Memory shared between samples is not available to the stages.
+    if max_memory is not None:
+        stage_memory = max_memory - aligner.shared_memory / 1e9
+    else:
+        stage_memory = None
+
+    scheduler = StageScheduler(
+        max_threads=max_threads,
+        max_memory=stage_memory,
+        stage_threads=aligner.threads,
+        heavy_memory=sample_memory)
+
+    workers = max(min(len(samples), max_threads // aligner.threads), 1)
+
+    logger.info('Processing %d samples (%d concurrently, with up to %d '
+                'concurrent alignments)', len(samples), workers,
+                _num_workers(
+                    aligner,
+                    num_samples=len(samples),
+                    max_threads=max_threads,
+                    max_memory=max_memory,
+                    sample_memory=sample_memory))
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    with aligner.batch(output_dir), aligner.scheduled(scheduler):
+        func = functools.partial(
+            _identify_sample,
+            aligner=aligner,
+            output_dir=output_dir,
+            logger=logger)
+
+        pool = ThreadPool(workers)
+
+        try:
+            errors = pool.map(func, samples)
+        finally:
+            pool.close()
+            pool.join()
+
+    # Summarize results.
+    _write_summary(samples, errors, output_dir / 'summary.txt')
+
+    failed = [(sample, error) for sample, error in zip(samples, errors)
+              if error is not None]
+
+    if failed:
+        logger.error('Processing failed for %d of %d samples:',
+                     len(failed), len(samples))
+
+        for sample, error in failed:
+            logger.error('- %s: %s (see %s)', sample.name, error,
+                         output_dir / sample.name / 'imfusion.log')
+    else:
+        logger.info('Processed all %d samples successfully', len(samples))
+
+    return [sample.name for sample, _ in failed]
+
+
+class StageScheduler(object):
+    """Schedules processing stages of samples within resource budgets.
+
+    Stages wait until their resources fit within the remaining thread and
+    memory budgets. All stages reserve ``stage_threads`` threads, as light
+    stages may also run multi-threaded tools, but only heavy stages reserve
+    ``heavy_memory`` GB of memory. To avoid stages waiting indefinitely,
+    a stage is always started if no other stages are running, even if it
+    exceeds the budgets.
+
+    Parameters
+    ----------
+    max_threads : int
+        Maximum number of threads to use.
+    max_memory : float
+        Maximum amount of memory to use (in GB). Memory usage is not
+        limited if not given.
+    stage_threads : int
+        Number of threads used by a stage.
+    heavy_memory : float
+        Expected memory usage (in GB) of a heavy stage.
+
+    """
+
+    def __init__(self,
+                 max_threads,
+                 max_memory=None,
+                 stage_threads=1,
+                 heavy_memory=None):
+        self._max_threads = max_threads
+        self._max_memory = max_memory
+        self._stage_threads = stage_threads
+        self._heavy_memory = heavy_memory or 0
+
+        self._threads = 0
+        self._memory = 0
+        self._running = 0
+
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def stage(self, name, heavy=False):
+        """Context for running a stage, waiting for resources if needed.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage.
+        heavy : bool
+            Whether the stage is a heavy stage.
+
+        """
+
+        threads = self._stage_threads
+        memory = self._heavy_memory if heavy else 0
+
+        with self._condition:
+            while not self._fits(threads, memory):
+                self._condition.wait()
+
+            self._threads += threads
+            self._memory += memory
+            self._running += 1
+
+        logging.debug('Started stage %s (%d threads in use)', name,
+                      self._threads)
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._threads -= threads
+                self._memory -= memory
+                self._running -= 1
+                self._condition.notify_all()
+
+    def _fits(self, threads, memory):
+        if self._running == 0:
+            return True
+
+        if self._threads + threads > self._max_threads:
+            return False
+
+        if (self._max_memory is not None and
+                self._memory + memory > self._max_memory):
+            return False
+
+        return True
+
+
+def _num_workers(aligner, num_samples, max_threads, max_memory,
+                 sample_memory):
+    """Determines the number of samples that can be aligned concurrently."""
+
+    workers = min(num_samples, max_threads // aligner.threads)
+
+    if max_memory is not None and sample_memory is not None:
+        available = max_memory * 1e9 - aligner.shared_memory
+        workers = min(workers, int(available // (sample_memory * 1e9)))
+
+    return max(workers, 1)
+
+
+def _identify_sample(sample, aligner, output_dir, logger):
+    """Identifies insertions for a sample, returning any raised error."""
+
+    sample_dir = output_dir / sample.name
+    sample_dir.mkdir(parents=True, exist_ok=True)
+
+    with log.sample_context(sample.name), \
+            _sample_log(sample_dir / 'imfusion.log', sample.name, logger):
+        logger.info('Processing sample %s', sample.name)
+
+        try:
+            insertions = aligner.identify_insertions(
+                fastq_path=sample.fastq_path,
+                output_dir=sample_dir,
+                fastq2_path=sample.fastq2_path)
+
+            write_insertions(insertions, sample_dir / 'insertions.txt')
+        except Exception as error:  # pylint: disable=broad-except
+            logger.exception('Processing failed for sample %s', sample.name)
+            return error
+
+        logger.info('Finished processing sample %s', sample.name)
+
+    return None
+
+
+@contextlib.contextmanager
+def _sample_log(log_path, sample_name, logger):
+    """Context that writes messages logged for a sample to a log file."""
+
+    handler = logging.FileHandler(str(log_path))
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+    handler.addFilter(log.SampleFilter(sample_name))
+
+    logger.addHandler(handler)
+
+    try:
+        yield
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def _write_summary(samples, errors, output_path):
+    """Writes the processing status of the samples to a summary file."""
+
+    summary = pd.DataFrame({
+        'sample': [sample.name for sample in samples],
+        'status': ['failed' if error is not None else 'completed'
+                   for error in errors],
+        'error': [str(error) if error is not None else ''
+                  for error in errors]
+    }, columns=['sample', 'status', 'error'])
+
+    summary.to_csv(str(output_path), sep='\t', index=False)
+
+
+def write_insertions(insertions, output_path):
+    """Writes insertions to a tab-separated file, sorted by support."""
+
+    insertion_frame = Insertion.to_frame(insertions)
+    insertion_frame = insertion_frame.sort_values('support', ascending=False)
+
+    insertion_frame.to_csv(str(output_path), sep='\t', index=False)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Functionality for tracking completed processing stages of samples."""
+
+# pylint: disable=wildcard-import,redefined-builtin,unused-wildcard-import
+from __future__ import absolute_import, division, print_function
+from builtins import *
+# pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
+
+import json
+import os
+import threading
+
+from future.utils import native_str
+
+MANIFEST_NAME = 'stages.json'
+
+
+class StageManifest(object):
+    """Manifest recording the completed processing stages of a sample.
+
+    For each completed stage, the manifest records the stage inputs and
+    outputs (by their size and modification time) and the parameters used.
+    A stage is only considered complete if all of these still match, which
+    means that stages are re-run if their inputs or parameters changed, or
+    if their outputs were modified or only partially written. As outputs of
+    a stage are typically used as inputs of subsequent stages, re-running
+    a stage also invalidates any downstream stages.
+
+    The manifest is stored as a JSON file (``stages.json``) in the output
+    directory of the sample and is updated whenever a stage is recorded.
+    Stages may be recorded from multiple threads.
+
+    Parameters
+    ----------
+    manifest_path : pathlib.Path
+        Path to the manifest file.
+
+    """
+
+    def __init__(self, manifest_path):
+        self._path = manifest_path
+        self._lock = threading.Lock()
+        self._stages = self._read(manifest_path)
+
+    @classmethod
+    def for_sample(cls, output_dir):
+        """Returns the manifest of the sample in given output directory."""
+        return cls(output_dir / MANIFEST_NAME)
+
+    @property
+    def stages(self):
+        """Names of the recorded stages."""
+        return list(self._stages.keys())
+
+    @staticmethod
+    def _read(manifest_path):
+        if not manifest_path.exists():
+            return {}
+
+        try:
+            with manifest_path.open('r') as file_:
+                return json.load(file_)
+        except ValueError:
+            # Corrupt manifest (for example, from an interrupted write).
+            return {}
+
+    def is_complete(self, stage, inputs=None, params=None, outputs=None):
+        """Checks if the given stage has been completed.
+
+        Parameters
+        ----------
+        stage : str
+            Name of the stage.
+        inputs : List[pathlib.Path]
+            Input files of the stage.
+        params : Dict[str, Any]
+            Parameters of the stage. Should be JSON serializable, with
+            the exception of paths which are compared as strings.
+        outputs : List[pathlib.Path]
+            Output files of the stage.
+
+        Returns
+        -------
+        bool
+            Whether the stage was completed using the same inputs and
+            parameters, with its outputs still intact.
+
+        """
+
+        with self._lock:
+            entry = self._stages.get(stage)
+
+        if entry is None:
+            return False
+
+        current = self._entry(inputs, params, outputs)
+
+        if any(sig is None for sig in current['outputs'].values()):
+            return False
+
+        return entry == current
+
+    def record(self, stage, inputs=None, params=None, outputs=None):
+        """Records the completion of the given stage.
+
+        Should be called after all outputs of the stage have been written.
+        See ``is_complete`` for a description of the parameters.
+        """
+
+        entry = self._entry(inputs, params, outputs)
+
+        with self._lock:
+            self._stages[stage] = entry
+            self._write()
+
+    def invalidate(self, stage):
+        """Removes the given stage from the manifest.
+
+        Should be called before (re-)running a stage, so that the stage is
+        not considered to be complete if it is interrupted.
+        """
+
+        with self._lock:
+            if self._stages.pop(stage, None) is not None:
+                self._write()
+
+    def _write(self):
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file first to avoid corrupting the
+        # manifest if the process is interrupted whilst writing.
+        tmp_path = self._path.with_name(self._path.name + '.tmp')
+
+        with tmp_path.open('w') as file_:
+            file_.write(str(json.dumps(self._stages, indent=2,
+                                       sort_keys=True)))
+
+        os.rename(native_str(tmp_path), native_str(self._path))
+
+    @staticmethod
+    def _entry(inputs, params, outputs):
+        return {
+            'inputs': {str(fp): _file_signature(fp)
+                       for fp in inputs or []},
+            'params': json.loads(
+                json.dumps(params or {}, sort_keys=True, default=str)),
+            'outputs': {str(fp): _file_signature(fp)
+                        for fp in outputs or []}
+        }
+
+
+def _file_signature(file_path):
+    """Returns the size and modification time of a file (if it exists)."""
+
+    if not file_path.exists():
+        return None
+
+    stat = file_path.stat()
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""Functionality for pre-filtering reads for transposon sequences."""
+
+# pylint: disable=wildcard-import,redefined-builtin,unused-wildcard-import
+from __future__ import absolute_import, division, print_function
+from builtins import *
+# pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
+
+import functools
+import gzip
+import logging
+import multiprocessing
+import threading
+
+from future.utils import native_str
+import pyfaidx
+import toolz
+
+from imfusion.external.util import open_decompressed
+from imfusion.util.path import as_path_list
+
+_COMPLEMENT = {ord(k): ord(v) for k, v in zip('ACGTN', 'TGCAN')}
+
+_kmers = None
+
+
+def build_kmer_set(fasta_path, k):
+    """Builds the set of k-mers present in the given sequence(s).
+
+    K-mers are collected from both strands of all sequences in the given
+    Fasta file. K-mers containing ambiguous bases (N) are skipped.
+
+    Parameters
+    ----------
+    fasta_path : pathlib.Path
+        Path to the Fasta file (for example, the transposon sequence).
+    k : int
+        Size of the k-mers.
+
+    Returns
+    -------
+    Set[bytes]
+        Set of k-mers.
+
+    """
+
+    fasta = pyfaidx.Fasta(native_str(fasta_path))
+
+    kmers = set()
+    for record in fasta:
+        seq = str(record).upper()
+
+        for strand_seq in (seq, _reverse_complement(seq)):
+            strand_seq = strand_seq.encode('ascii')
+
+            for i in range(len(strand_seq) - k + 1):
+                kmer = strand_seq[i:i + k]
+                if b'N' not in kmer:
+                    kmers.add(kmer)
+
+    return kmers
+
+
+def _reverse_complement(seq):
+    return seq.translate(_COMPLEMENT)[::-1]
+
+
+def prefilter_fastq(fastq_path,
+                    output_path,
+                    kmers,
+                    k,
+                    fastq2_path=None,
+                    output2_path=None,
+                    workers=1,
+                    chunk_size=100000,
+                    decompress_command=None):
+    """Selects reads (or read pairs) containing any of the given k-mers.
+
+    Reads are streamed from the input fastq file(s) in chunks, which are
+    screened in parallel using the given number of workers. For paired-end
+    data, a pair is selected if either of its mates contains a k-mer.
+    Selected reads are written (gzipped) to the given output paths. Fastq
+    files of multiple lanes can be given as lists of paths, in which case
+    the selected reads of all lanes are written to the same output file.
+
+    Parameters
+    ----------
+    fastq_path : pathlib.Path or List[pathlib.Path]
+        Path(s) to the input fastq file(s).
+    output_path : pathlib.Path
+        Output path for the selected reads.
+    kmers : Set[bytes]
+        Set of k-mers to screen for (see ``build_kmer_set``).
+    k : int
+        Size of the k-mers.
+    fastq2_path : pathlib.Path or List[pathlib.Path]
+        Path(s) to the input fastq file(s) of the second mates
+        (paired-end only).
+    output2_path : pathlib.Path
+        Output path for the selected second mates (paired-end only).
+    workers : int
+        Number of worker processes to use. As forking a process with
+        multiple running threads can deadlock, reads are screened in the
+        current process if other threads are running.
+    chunk_size : int
+        Number of reads (or pairs) per chunk.
+    decompress_command : List[str]
+        Command used to decompress gzipped fastq files (for example,
+        ``['pigz', '-dc']``), which is run with the file path as its last
+        argument. Gzipped files are decompressed using the gzip module
+        if not given.
+
+    Returns
+    -------
+    int
+        Number of selected reads (or pairs).
+
+    """
+
+    if (fastq2_path is None) != (output2_path is None):
+        raise ValueError('Both fastq2_path and output2_path should be '
+                         'given for paired-end data')
+
+    input_paths = [as_path_list(fastq_path)]
+    output_paths = [output_path]
+
+    if fastq2_path is not None:
+        input_paths.append(as_path_list(fastq2_path))
+        output_paths.append(output2_path)
+
+        if len(input_paths[0]) != len(input_paths[1]):
+            raise ValueError('Number of fastq2 files does not match '
+                             'the number of fastq files')
+
+    out_files = [gzip.open(native_str(fp), 'wb') for fp in output_paths]
+
+    # Processes are only forked if this is the only running thread, as
+    # locks held by other threads (e.g. of logging handlers) are copied
+    # into the forked processes without being released.
+    if workers > 1 and threading.active_count() == 1:
+        pool = multiprocessing.Pool(
+            workers, initializer=_init_worker, initargs=(kmers, ))
+        map_func = pool.imap
+    else:
+        if workers > 1:
+            logging.debug('Other threads are running, pre-filtering reads '
+                          'without using additional processes')
+        pool = None
+        map_func = map
+        _init_worker(kmers)
+
+    try:
+        records = _zip_mates([
+            _iter_lane_records(paths, decompress_command=decompress_command)
+            for paths in input_paths
+        ])
+        chunks = toolz.partition_all(chunk_size, records)
+
+        num_selected = 0
+        func = functools.partial(_screen_chunk, k=k)
+
+        for selected in map_func(func, chunks):
+            for pair in selected:
+                for out_file, record in zip(out_files, pair):
+                    out_file.write(record)
+            num_selected += len(selected)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        for file_obj in out_files:
+            file_obj.close()
+
+    return num_selected
+
+
+def _iter_lane_records(file_paths, decompress_command=None):
+    """Iterates over (raw) fastq records in given files (lanes)."""
+
+    for file_path in file_paths:
+        with open_decompressed(file_path, decompress_command) as file_obj:
+            for record in _iter_records(file_obj, file_path):
+                yield record
+
+
+def _iter_records(file_obj, file_path):
+    """Iterates over (raw) fastq records in given file."""
+
+    lines = iter(file_obj)
+
+    for header in lines:
+        try:
+            seq, sep, qual = next(lines), next(lines), next(lines)
+        except StopIteration:
+            raise ValueError('Truncated fastq record at the end of {}'
+                             .format(file_path))
+
+        yield header + seq + sep + qual
+
+
+def _zip_mates(record_iters):
+    """Zips records of mates, checking if all mates have the same reads."""
+
+    missing = object()
+
+    while True:
+        records = tuple(next(iter_, missing) for iter_ in record_iters)
+        num_missing = sum(record is missing for record in records)
+
+        if num_missing == len(records):
+            return
+
+        if num_missing > 0:
+            raise ValueError('Fastq files of the first and second mates '
+                             'contain different numbers of reads')
+
+        yield records
+
+
+def _init_worker(kmers):
+    global _kmers  # pylint: disable=global-statement
+    _kmers = kmers
+
+
+def _screen_chunk(chunk, k):
+    """Returns records (pairs) in chunk containing any k-mer."""
+    return [pair for pair in chunk
+            if any(_contains_kmer(record, _kmers, k) for record in pair)]
+
+
+def _contains_kmer(record, kmers, k):
+    """Checks if the sequence of a fastq record contains any k-mer."""
+
+    seq = record.split(b'\n', 2)[1].upper()
+
+    for i in range(len(seq) - k + 1):
+        if seq[i:i + k] in kmers:
+            return True
+
+    return False
@@ -7,43 +7,77 @@ from builtins import *
 # pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
 
 from collections import namedtuple
-import gzip
+import contextlib
+import functools
 import itertools
+import logging
+import multiprocessing
 import operator
-from typing import Any, Callable, Iterable, Tuple
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
 
 import pathlib2 as pathlib
 
 from future.utils import native_str
 import numpy as np
+import pandas as pd
 import pysam
 import toolz
 
 from intervaltree import IntervalTree
 
+from imfusion.external.util import open_decompressed
 from imfusion.model import MetadataFrameMixin, Insertion, Fusion
 from imfusion.util import tabix
 from imfusion.util.frozendict import frozendict
+from imfusion.util.path import as_path_list
 
 
 def extract_insertions(
         fusions,  # type: Iterable[Fusion]
-        gtf_path,  # type: pathlib.Path
-        features_path,  # type: pathlib.Path
+        gtf_path,  # type: Union[pathlib.Path, TranscriptReference]
+        features_path,  # type: Union[pathlib.Path, pd.DataFrame]
         chromosomes=None,  # type: List[str]
-        assembled_gtf_path=None,  # type: pathlib.Path
-        ffpm_fastq_path=None  # type: pathlib.Path
+        assembled_gtf_path=None,  # type: Union[pathlib.Path, Callable]
+        ffpm_fastq_path=None,  # type: pathlib.Path
+        workers=1,  # type: int
+        decompress_command=None  # type: List[str]
 ):  # type: (...) -> Iterable[Insertion]
-    """Extract insertions from gene-transposon fusions."""
+    """Extract insertions from gene-transposon fusions.
+
+    Genes are annotated using the gtf file given by ``gtf_path``, which may
+    also be given as a previously loaded ``TranscriptReference`` (see
+    ``Reference.transcript_reference``) to avoid loading the annotation for
+    every call.
+
+    The ``assembled_gtf_path`` may also be given as a callable, which is
+    called with the (gene-annotated) fusions once these have been annotated
+    for genes and should return the path to the assembly (or None). This
+    allows the assembly to be generated concurrently with the extraction
+    and annotation of the fusions, or to be restricted to the loci of
+    fusions that were not annotated with a gene.
+
+    If given, ``decompress_command`` is used to decompress gzipped fastq
+    files when counting reads for the FFPM scores (see ``count_lines``).
+    """
 
     # Annotate for genes.
-    gtf_reference = TranscriptReference.from_gtf(
-        gtf_path, chromosomes=chromosomes)
+    if isinstance(gtf_path, TranscriptReference):
+        gtf_reference = gtf_path
+    else:
+        gtf_reference = TranscriptReference.from_gtf(
+            gtf_path, chromosomes=chromosomes, workers=workers)
 
     annotated = annotate_fusions_for_genes(fusions, gtf_reference)
 
     # Annotate for assembly (if given).
+    if callable(assembled_gtf_path):
+        annotated = list(annotated)
+        assembled_gtf_path = assembled_gtf_path(annotated)
+
     if assembled_gtf_path is not None:
+        # The assembly is small (especially if targeted), so is built
+        # without starting additional processes.
         assem_reference = TranscriptReference.from_gtf(
             assembled_gtf_path, chromosomes=chromosomes)
 
@@ -59,7 +93,10 @@ def extract_insertions(
 
     # Calculate FFPM scores.
     if ffpm_fastq_path is not None:
-        annotated = annotate_ffpm(annotated, fastq_path=ffpm_fastq_path)
+        annotated = annotate_ffpm(
+            annotated,
+            fastq_path=ffpm_fastq_path,
+            decompress_command=decompress_command)
 
     # Convert to insertions.
     insertions = Insertion.from_transposon_fusions(
@@ -111,8 +148,11 @@ def annotate_fusions_for_transposon(fusions, feature_path):
     ----------
     fusions : iterable[TransposonFusion]
         Fusions to annotate.
-    feature_path : str or pathlib.Path
-        Path to TSV file containing transposon features.
+    feature_path : str, pathlib.Path or pandas.DataFrame
+        Path to TSV file containing transposon features. Alternatively,
+        a DataFrame of previously loaded features may be given (see
+        ``Reference.transposon_features``), which avoids re-reading the
+        features for every call.
 
     Yields
     ------
@@ -121,25 +161,39 @@ def annotate_fusions_for_transposon(fusions, feature_path):
 
     """
 
-    def _lookup_tree(tree, region):
-        start, end = region
-        overlap = tree[start:end]
-        return [tup[2] for tup in overlap]
+    if isinstance(feature_path, pd.DataFrame):
+        features = feature_path
+    else:
+        features = TransposonFeature.read_csv(feature_path, sep='\t')
 
-    # Build the feature tree.
-    features = TransposonFeature.from_csv(feature_path, sep='\t')
-    tree = IntervalTree.from_tuples((feat.start, feat.end, feat)
-                                    for feat in features)
+    features = features.sort_values('start')
 
-    for fusion in fusions:
-        overlap = _lookup_tree(tree, fusion.transposon_region)
+    # Overlap transposon regions of all fusions with the features.
+    fusions = list(fusions)
+
+    regions = np.array(
+        [fusion.transposon_region for fusion in fusions],
+        dtype=np.int64).reshape(-1, 2)
+
+    idx, feature_idx = _overlap_join(regions[:, 0], regions[:, 1],
+                                     features['start'].values,
+                                     features['end'].values)
+
+    # Split overlapping features per fusion (idx is sorted).
+    fusion_hits = np.split(feature_idx,
+                           np.searchsorted(idx, np.arange(1, len(fusions))))
 
-        if len(overlap) > 0:
-            for feature in overlap:
+    names = features['name'].values
+    types = features['type'].values
+    strands = features['strand'].values
+
+    for fusion, hits in zip(fusions, fusion_hits):
+        if len(hits) > 0:
+            for hit in hits:
                 new_meta = {
-                    'feature_name': feature.name,
-                    'feature_type': feature.type,
-                    'feature_strand': feature.strand
+                    'feature_name': names[hit],
+                    'feature_type': types[hit],
+                    'feature_strand': int(strands[hit])
                 }
                 merged_meta = toolz.merge(fusion.metadata, new_meta)
                 yield fusion._replace(metadata=frozendict(merged_meta))
@@ -153,10 +207,17 @@ def annotate_fusions_for_assembly(
         assembly,  # type: TranscriptReference
         skip_annotated=True  # type: bool
 ):  # type: (...) -> Iterable[Fusion]
-    """Annotates fusions using the assembled GTF."""
+    """Annotates fusions using the assembled GTF.
+
+    Fusions overlapping an assembled transcript are annotated with the
+    reference genes that overlap the exons of this transcript. If no genes
+    overlap, the transcript itself is used as novel gene. The mapping of
+    assembled transcripts to reference genes is computed once for the entire
+    assembly (using a single interval join between exons), so that the
+    annotation of each fusion only involves a lookup.
+    """
 
-    def _exon_region(exon):
-        return (exon.chromosome, exon.start, exon.end)
+    gene_map = None
 
     for fusion in fusions:
         if skip_annotated and 'gene_id' in fusion.metadata:
@@ -167,41 +228,193 @@ def annotate_fusions_for_assembly(
             transcripts = assembly.overlap_transcripts(fusion.genome_region)
 
             if len(transcripts) > 0:
-                for transcript in transcripts:
-                    # Lookup genes that overlap with exons.
-                    exons = assembly.get_exons(transcript.id)
+                if gene_map is None:
+                    gene_map = _build_transcript_gene_map(reference, assembly)
 
-                    genes = set(
-                        itertools.chain.from_iterable(
-                            reference.overlap_genes(_exon_region(exon))
-                            for exon in exons))
+                for transcript in transcripts:
+                    genes = gene_map.get(transcript.id, [])
 
                     if len(genes) > 0:
-                        for gene in genes:
-                            # Yield with information from overlapping genes.
-                            new_meta = {
-                                'gene_name': gene.name,
-                                'gene_strand': gene.strand,
-                                'gene_id': gene.id,
-                                'novel_transcript': transcript.id
-                            }
-                            yield fusion._replace(metadata=toolz.merge(
-                                fusion.metadata, new_meta))
+                        # Yield with information from overlapping genes.
+                        gene_metas = genes
                     else:
                         # No gene overlap, yield with transcript info.
-                        new_meta = {
+                        gene_metas = [{
                             'gene_name': transcript.id,
                             'gene_id': transcript.id,
-                            'gene_strand': transcript.strand,
-                            'novel_transcript': transcript.id
-                        }
-                        yield fusion._replace(
-                            metadata=toolz.merge(fusion.metadata, new_meta))
+                            'gene_strand': transcript.strand
+                        }]
+
+                    for gene_meta in gene_metas:
+                        merged_meta = toolz.merge(
+                            fusion.metadata, gene_meta,
+                            {'novel_transcript': transcript.id})
+                        yield fusion._replace(metadata=frozendict(merged_meta))
             else:
                 # No overlap.
                 yield fusion
 
 
+def assembly_regions(fusions, padding=10000, skip_annotated=True):
+    # type: (Iterable[Fusion], int, bool) -> List[Tuple[str, int, int]]
+    """Determines the genomic regions to assemble for the given fusions.
+
+    Regions are formed by the (padded) genomic regions of the fusions,
+    merging regions that overlap. As the assembly is only used to annotate
+    fusions that are not annotated with a reference gene (see
+    ``annotate_fusions_for_assembly``), already annotated fusions are
+    skipped by default.
+
+    Parameters
+    ----------
+    fusions : iterable[TransposonFusion]
+        Fusions to determine regions for.
+    padding : int
+        Padding to add on both sides of the fusion regions.
+    skip_annotated : bool
+        Whether to skip fusions that are already annotated with a gene.
+
+    Returns
+    -------
+    List[Tuple[str, int, int]]
+        Sorted list of (seqname, start, end) regions.
+
+    """
+
+    regions = sorted(
+        fusion.genome_region for fusion in fusions
+        if not (skip_annotated and 'gene_id' in fusion.metadata))
+
+    merged = []  # type: List[Tuple[str, int, int]]
+
+    for seqname, start, end in regions:
+        start, end = max(start - padding, 0), end + padding
+
+        if merged and merged[-1][0] == seqname and start <= merged[-1][2]:
+            prev = merged.pop()
+            start, end = prev[1], max(prev[2], end)
+
+        merged.append((seqname, start, end))
+
+    return merged
+
+
+def subset_alignment(bam_path, regions, output_path):
+    # type: (pathlib.Path, List[Tuple[str, int, int]], pathlib.Path) -> None
+    """Writes the alignments within the given regions to a new bam file.
+
+    The written bam file is coordinate sorted and indexed. Regions should
+    not overlap (see ``assembly_regions``). Reads overlapping multiple
+    regions are only written once.
+
+    Parameters
+    ----------
+    bam_path : pathlib.Path
+        Path to the (coordinate sorted and indexed) input bam file.
+    regions : List[Tuple[str, int, int]]
+        List of (seqname, start, end) regions.
+    output_path : pathlib.Path
+        Output path for the subset bam file.
+
+    """
+
+    with contextlib.closing(pysam.AlignmentFile(
+            native_str(bam_path), 'rb')) as in_file:  # yapf: disable
+
+        # Order regions to match the sort order of the bam file.
+        regions = [region for region in regions
+                   if in_file.get_tid(region[0]) >= 0]
+        regions = sorted(
+            regions, key=lambda r: (in_file.get_tid(r[0]), r[1], r[2]))
+
+        with contextlib.closing(pysam.AlignmentFile(
+                native_str(output_path), 'wb',
+                template=in_file)) as out_file:  # yapf: disable
+
+            prev_seqname, prev_end = None, None
+
+            for seqname, start, end in regions:
+                for read in in_file.fetch(seqname, start, end):
+                    # Skip reads already written for the previous region.
+                    if (seqname == prev_seqname and
+                            read.reference_start < prev_end):
+                        continue
+                    out_file.write(read)
+
+                prev_seqname, prev_end = seqname, end
+
+    pysam.index(native_str(output_path))
+
+
+def _build_transcript_gene_map(reference, assembly):
+    # type: (TranscriptReference, TranscriptReference) -> Dict[str, List[Dict]]
+    """Maps assembled transcripts to the reference genes they overlap."""
+
+    assembly_exons = assembly.exon_frame()
+    reference_groups = reference.chromosome_exons()
+
+    gene_map = {}
+
+    for chrom, assembly_grp in assembly_exons.groupby('chromosome'):
+        if chrom not in reference_groups:
+            continue
+
+        reference_grp = reference_groups[chrom]
+
+        # Join overlapping exons.
+        idx, ref_idx = _overlap_join(
+            assembly_grp['start'].values, assembly_grp['end'].values,
+            reference_grp['start'].values, reference_grp['end'].values)
+
+        pairs = pd.DataFrame({
+            'transcript_id': assembly_grp['transcript_id'].values[idx],
+            'gene_id': reference_grp['gene_id'].values[ref_idx],
+            'gene_name': reference_grp['gene_name'].values[ref_idx],
+            'gene_strand': reference_grp['strand'].values[ref_idx]
+        }).drop_duplicates(subset=['transcript_id', 'gene_id'])
+
+        pairs = pairs.sort_values(['transcript_id', 'gene_id'])
+
+        for tup in pairs.itertuples():
+            gene_meta = {
+                'gene_name': tup.gene_name,
+                'gene_strand': int(tup.gene_strand),
+                'gene_id': tup.gene_id
+            }
+            gene_map.setdefault(tup.transcript_id, []).append(gene_meta)
+
+    return gene_map
+
+
+def _overlap_join(starts, ends, other_starts, other_ends):
+    """Returns index pairs of overlapping (half-open) intervals.
+
+    Expects the other intervals to be sorted by their start position.
+    Empty intervals do not overlap anything, in line with IntervalTree.
+    """
+
+    if len(other_starts) > 0:
+        max_ends = np.maximum.accumulate(other_ends)
+    else:
+        max_ends = other_ends
+
+    # Candidates have start < end and a running max end > start.
+    first = np.searchsorted(max_ends, starts, side='right')
+    last = np.searchsorted(other_starts, ends, side='left')
+
+    counts = np.maximum(last - first, 0)
+    offsets = np.cumsum(counts) - counts
+
+    idx = np.repeat(np.arange(len(starts)), counts)
+    other_idx = (np.arange(counts.sum()) - np.repeat(offsets, counts) +
+                 np.repeat(first, counts))
+
+    mask = ((other_ends[other_idx] > starts[idx]) &
+            (starts[idx] < ends[idx]))
+
+    return idx[mask], other_idx[mask]
+
+
 class TranscriptReference(object):
     """Reference class, used for efficiently looking up features in
     the reference transciptome."""
@@ -210,54 +423,62 @@ class TranscriptReference(object):
         self._transcripts = transcript_trees
         self._exons = exon_trees
 
+        self._chromosome_exons = None
+        self._lock = threading.Lock()
+
     @classmethod
     def from_gtf(
             cls,
             gtf_path,  # type: pathlib.Path
             chromosomes=None,  # type: List[str]
-            record_filter=None  # type: Callable[[Any], bool]
+            record_filter=None,  # type: Callable[[Any], bool]
+            workers=1  # type: int
     ):  # type: (...) -> TranscriptReference
-        """Builds an Reference instance from the given GTF file."""
-
-        # Open gtf file.
-        gtf = pysam.TabixFile(native_str(gtf_path), parser=pysam.asGTF())
+        """Builds an Reference instance from the given GTF file.
+
+        Parameters
+        ----------
+        gtf_path : pathlib.Path
+            Path to the (tabix indexed) GTF file.
+        chromosomes : List[str]
+            Chromosomes to include. Defaults to all contigs in the GTF.
+        record_filter : Callable
+            Optional function used to filter GTF records. Should be picklable
+            (i.e., not a lambda) if multiple workers are used.
+        workers : int
+            Number of processes to use. If larger than one, the trees of
+            each chromosome are built in a separate process, which reads
+            its own region from the GTF file. As forking a process with
+            multiple running threads can deadlock, processes are only used
+            if no other threads are running.
+
+        Returns
+        -------
+        TranscriptReference
+            Reference instance for the given GTF file.
+
+        """
 
         if chromosomes is None:
+            gtf = pysam.TabixFile(native_str(gtf_path), parser=pysam.asGTF())
             chromosomes = gtf.contigs
+            gtf.close()
 
         # Build the trees.
-        transcript_trees = {}
-        exon_trees = {}
-
-        for chrom in chromosomes:
-            # Collect exons and transcripts.
-            transcripts = []
-            exons = []
-
-            records = gtf.fetch(reference=chrom)
-
-            if record_filter is not None:
-                records = (rec for rec in records if record_filter(rec))
-
-            for record in records:
-                if record.feature == 'transcript':
-                    transcripts.append(cls._record_to_transcript(record))
-                elif record.feature == 'exon':
-                    exons.append(cls._record_to_exon(record))
+        build_func = functools.partial(
+            _build_chromosome_trees,
+            gtf_path=native_str(gtf_path),
+            record_filter=record_filter)
 
-            # Build transcript lookup tree.
-            transcript_trees[chrom] = IntervalTree.from_tuples(
-                (tr.start, tr.end, tr) for tr in transcripts)
+        results = _map_chromosomes(build_func, chromosomes, workers=workers)
 
-            # Build exon lookup tree.
-            keyfunc = lambda rec: rec.transcript_id
-
-            exons = sorted(exons, key=keyfunc)
-            grouped = itertools.groupby(exons, key=keyfunc)
+        # Merge trees of the different chromosomes.
+        transcript_trees = {}
+        exon_trees = {}
 
-            for tr_id, grp in grouped:
-                exon_trees[tr_id] = IntervalTree.from_tuples(
-                    (exon.start, exon.end, exon) for exon in grp)
+        for chrom, chrom_transcript_tree, chrom_exon_trees in results:
+            transcript_trees[chrom] = chrom_transcript_tree
+            exon_trees.update(chrom_exon_trees)
 
         return cls(transcript_trees, exon_trees)
 
@@ -288,6 +509,11 @@ class TranscriptReference(object):
     @staticmethod
     def _lookup_genomic(trees, region):
         chrom, start, end = region
+
+        # Chromosomes without any transcripts have no overlap.
+        if chrom not in trees:
+            return []
+
         overlap = trees[chrom][start:end]
         return [tup[2] for tup in overlap]
 
@@ -332,6 +558,401 @@ class TranscriptReference(object):
         """Returns exons for given transcript."""
         return [interval[2] for interval in self._exons[transcript_id].items()]
 
+    def exon_frame(self):
+        # type: (...) -> pd.DataFrame
+        """Returns a DataFrame containing all exons in the reference."""
+        exons = (interval[2]
+                 for tree in self._exons.values() for interval in tree.items())
+        return pd.DataFrame.from_records(exons, columns=Exon._fields)
+
+    def chromosome_exons(self):
+        # type: (...) -> Dict[str, pd.DataFrame]
+        """Returns exons per chromosome, sorted by start position.
+
+        Built from ``exon_frame`` once and cached, as the same reference is
+        typically used to annotate the assemblies of many samples.
+        """
+
+        with self._lock:
+            if self._chromosome_exons is None:
+                self._chromosome_exons = {
+                    chrom: grp.sort_values('start')
+                    for chrom, grp in self.exon_frame().groupby('chromosome')
+                }
+        return self._chromosome_exons
+
+
+def _map_chromosomes(func, chromosomes, workers=1):
+    """Applies func to the chromosomes, using processes if possible."""
+
+    # Processes are only forked if this is the only running thread, as
+    # locks held by other threads (e.g. of logging handlers) are copied
+    # into the forked processes without being released.
+    if workers <= 1 or threading.active_count() > 1:
+        if workers > 1:
+            logging.debug('Other threads are running, processing '
+                          'chromosomes serially')
+        return (func(chrom) for chrom in chromosomes)
+
+    pool = multiprocessing.Pool(processes=workers)
+
+    try:
+        return pool.map(func, chromosomes)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _build_chromosome_trees(chromosome, gtf_path, record_filter=None):
+    """Builds transcript and exon trees for a single chromosome.
+
+    Defined at module level (and opening its own GTF handle) so that it
+    can be used by worker processes in ``TranscriptReference.from_gtf``.
+    """
+
+    transcripts, exons = _read_chromosome_features(
+        chromosome, gtf_path, record_filter=record_filter)
+
+    # Build transcript lookup tree.
+    transcript_tree = IntervalTree.from_tuples(
+        (tr.start, tr.end, tr) for tr in transcripts)
+
+    # Build exon lookup trees.
+    keyfunc = lambda rec: rec.transcript_id
+
+    exons = sorted(exons, key=keyfunc)
+    grouped = itertools.groupby(exons, key=keyfunc)
+
+    exon_trees = {}
+    for tr_id, grp in grouped:
+        exon_trees[tr_id] = IntervalTree.from_tuples(
+            (exon.start, exon.end, exon) for exon in grp)
+
+    return chromosome, transcript_tree, exon_trees
+
+
+def _read_chromosome_features(chromosome, gtf_path, record_filter=None):
+    """Reads transcripts and exons of a single chromosome from a GTF file."""
+
+    gtf = pysam.TabixFile(gtf_path, parser=pysam.asGTF())
+
+    try:
+        transcripts = []
+        exons = []
+
+        records = gtf.fetch(reference=chromosome)
+
+        if record_filter is not None:
+            records = (rec for rec in records if record_filter(rec))
+
+        for record in records:
+            if record.feature == 'transcript':
+                transcripts.append(
+                    TranscriptReference._record_to_transcript(record))
+            elif record.feature == 'exon':
+                exons.append(TranscriptReference._record_to_exon(record))
+    finally:
+        gtf.close()
+
+    return transcripts, exons
+
+
+class ArrayTranscriptReference(TranscriptReference):
+    """Array-based variant of the TranscriptReference class.
+
+    Stores transcripts and their exons in flat NumPy arrays, which are sorted
+    by position within each chromosome. These arrays can be saved to a
+    directory of ``.npy`` files (typically within the IM-Fusion reference)
+    and loaded as read-only memory maps. As memory-mapped pages are shared
+    by the operating system, concurrent processes that load the same
+    annotation effectively share a single copy in memory.
+    """
+
+    _array_names = ('chromosomes', 'chromosome_offsets', 'transcript_start',
+                    'transcript_end', 'transcript_max_end',
+                    'transcript_strand', 'transcript_id',
+                    'transcript_gene_id', 'transcript_gene_name',
+                    'exon_offsets', 'exon_start', 'exon_end', 'sorted_ids',
+                    'sorted_id_index')
+
+    def __init__(self, arrays):
+        # pylint: disable=super-init-not-called
+        self._arrays = arrays
+        self._chrom_index = {
+            _decode(chrom): i
+            for i, chrom in enumerate(arrays['chromosomes'])
+        }
+
+        self._chromosome_exons = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_gtf(
+            cls,
+            gtf_path,  # type: pathlib.Path
+            chromosomes=None,  # type: List[str]
+            record_filter=None,  # type: Callable[[Any], bool]
+            workers=1  # type: int
+    ):  # type: (...) -> ArrayTranscriptReference
+        """Builds an ArrayTranscriptReference from the given GTF file.
+
+        Takes the same arguments as ``TranscriptReference.from_gtf``.
+        """
+
+        if chromosomes is None:
+            gtf = pysam.TabixFile(native_str(gtf_path), parser=pysam.asGTF())
+            chromosomes = gtf.contigs
+            gtf.close()
+
+        read_func = functools.partial(
+            _read_chromosome_features,
+            gtf_path=native_str(gtf_path),
+            record_filter=record_filter)
+
+        features = _map_chromosomes(read_func, chromosomes, workers=workers)
+
+        # Collect (sorted) transcripts and their exons per chromosome.
+        chrom_offsets = [0]
+        transcripts = []
+        exon_offsets = [0]
+        exons = []
+
+        keyfunc = operator.attrgetter('start', 'end')
+
+        for chrom_transcripts, chrom_exons in features:
+            exon_lookup = toolz.groupby(
+                operator.attrgetter('transcript_id'), chrom_exons)
+
+            for transcript in sorted(chrom_transcripts, key=keyfunc):
+                transcripts.append(transcript)
+                exons += sorted(
+                    exon_lookup.get(transcript.id, []), key=keyfunc)
+                exon_offsets.append(len(exons))
+
+            chrom_offsets.append(len(transcripts))
+
+        return cls(
+            cls._build_arrays(chromosomes, chrom_offsets, transcripts,
+                              exon_offsets, exons))
+
+    @staticmethod
+    def _build_arrays(chromosomes, chrom_offsets, transcripts, exon_offsets,
+                      exons):
+        chrom_offsets = np.array(chrom_offsets, dtype=np.int64)
+
+        starts = np.array([tr.start for tr in transcripts], dtype=np.int64)
+        ends = np.array([tr.end for tr in transcripts], dtype=np.int64)
+
+        # Running maximum of transcript ends (per chromosome),
+        # used to find the first transcript that may overlap a region.
+        max_ends = ends.copy()
+        for lo, hi in zip(chrom_offsets[:-1], chrom_offsets[1:]):
+            if hi > lo:
+                max_ends[lo:hi] = np.maximum.accumulate(ends[lo:hi])
+
+        ids = _encode([tr.id for tr in transcripts])
+        sorted_id_index = np.argsort(ids, kind='mergesort')
+
+        return {
+            'chromosomes': _encode(chromosomes),
+            'chromosome_offsets': chrom_offsets,
+            'transcript_start': starts,
+            'transcript_end': ends,
+            'transcript_max_end': max_ends,
+            'transcript_strand': np.array(
+                [tr.strand for tr in transcripts], dtype=np.int8),
+            'transcript_id': ids,
+            'transcript_gene_id': _encode(
+                [tr.gene_id for tr in transcripts]),
+            'transcript_gene_name': _encode(
+                [tr.gene_name for tr in transcripts]),
+            'exon_offsets': np.array(exon_offsets, dtype=np.int64),
+            'exon_start': np.array(
+                [exon.start for exon in exons], dtype=np.int64),
+            'exon_end': np.array([exon.end for exon in exons], dtype=np.int64),
+            'sorted_ids': ids[sorted_id_index],
+            'sorted_id_index': sorted_id_index
+        }
+
+    def save(self, dir_path):
+        # type: (pathlib.Path) -> None
+        """Saves the reference arrays as .npy files in given directory."""
+
+        dir_path.mkdir(parents=True, exist_ok=True)
+
+        for name in self._array_names:
+            np.save(
+                native_str(dir_path / (name + '.npy')),
+                self._arrays[name],
+                allow_pickle=False)
+
+    @classmethod
+    def load(cls, dir_path, mmap=True):
+        # type: (pathlib.Path, bool) -> ArrayTranscriptReference
+        """Loads a reference that was saved using ``save``.
+
+        Parameters
+        ----------
+        dir_path : pathlib.Path
+            Directory containing the saved arrays.
+        mmap : bool
+            Whether to load the arrays as read-only memory maps, rather
+            than reading them into (process-specific) memory.
+
+        Returns
+        -------
+        ArrayTranscriptReference
+            The loaded reference.
+
+        """
+
+        mmap_mode = 'r' if mmap else None
+
+        arrays = {
+            name: np.load(
+                native_str(dir_path / (name + '.npy')),
+                mmap_mode=mmap_mode,
+                allow_pickle=False)
+            for name in cls._array_names
+        }
+
+        return cls(arrays)
+
+    def overlap_transcripts(self, region, strict=True):
+        # type: (Tuple[str, int, int], bool) -> List[Transcript]
+        """Returns transcripts that overlap with given region."""
+
+        chrom, start, end = region
+
+        indices = self._overlap_indices(chrom, start, end)
+
+        if strict:
+            indices = [
+                i for i in indices if self._overlaps_exons(i, start, end)
+            ]
+
+        return [self._get_transcript(i, chrom) for i in indices]
+
+    def _overlap_indices(self, chrom, start, end):
+        arrays = self._arrays
+
+        if chrom not in self._chrom_index or start >= end:
+            return np.array([], dtype=np.int64)
+
+        chrom_idx = self._chrom_index[chrom]
+        lo, hi = arrays['chromosome_offsets'][chrom_idx:chrom_idx + 2]
+
+        # Candidates have start < end and a running max end > start.
+        first = lo + np.searchsorted(
+            arrays['transcript_max_end'][lo:hi], start, side='right')
+        last = lo + np.searchsorted(
+            arrays['transcript_start'][lo:hi], end, side='left')
+
+        candidates = np.arange(first, last)
+        return candidates[arrays['transcript_end'][first:last] > start]
+
+    def _overlaps_exons(self, index, start, end):
+        arrays = self._arrays
+
+        lo, hi = arrays['exon_offsets'][index:index + 2]
+        exon_overlap = ((arrays['exon_start'][lo:hi] < end) &
+                        (arrays['exon_end'][lo:hi] > start))
+
+        return exon_overlap.any()
+
+    def _get_transcript(self, index, chrom):
+        arrays = self._arrays
+
+        return Transcript(
+            id=_decode(arrays['transcript_id'][index]),
+            chromosome=chrom,
+            start=int(arrays['transcript_start'][index]),
+            end=int(arrays['transcript_end'][index]),
+            strand=int(arrays['transcript_strand'][index]),
+            gene_name=_decode(arrays['transcript_gene_name'][index]),
+            gene_id=_decode(arrays['transcript_gene_id'][index]))
+
+    def get_exons(self, transcript_id):
+        # type: (str) -> List[Exon]
+        """Returns exons for given transcript."""
+
+        arrays = self._arrays
+
+        # Lookup transcript index using sorted ids.
+        key = transcript_id.encode('utf-8')
+        sorted_pos = np.searchsorted(arrays['sorted_ids'], key)
+
+        if (sorted_pos == len(arrays['sorted_ids']) or
+                arrays['sorted_ids'][sorted_pos] != key):
+            raise KeyError(transcript_id)
+
+        index = arrays['sorted_id_index'][sorted_pos]
+
+        chrom_idx = np.searchsorted(
+            arrays['chromosome_offsets'], index, side='right') - 1
+        transcript = self._get_transcript(
+            index, chrom=_decode(arrays['chromosomes'][chrom_idx]))
+
+        lo, hi = arrays['exon_offsets'][index:index + 2]
+
+        return [
+            Exon(
+                chromosome=transcript.chromosome,
+                start=int(start),
+                end=int(end),
+                strand=transcript.strand,
+                gene_name=transcript.gene_name,
+                gene_id=transcript.gene_id,
+                transcript_id=transcript.id)
+            for start, end in zip(arrays['exon_start'][lo:hi],
+                                  arrays['exon_end'][lo:hi])
+        ]
+
+    def exon_frame(self):
+        # type: (...) -> pd.DataFrame
+        """Returns a DataFrame containing all exons in the reference."""
+
+        arrays = self._arrays
+
+        chrom_counts = np.diff(arrays['chromosome_offsets'])
+        exon_counts = np.diff(arrays['exon_offsets'])
+
+        transcript_chroms = np.repeat(arrays['chromosomes'], chrom_counts)
+
+        def _expand(name):
+            return _decode_array(np.repeat(arrays[name], exon_counts))
+
+        return pd.DataFrame(
+            {
+                'chromosome':
+                _decode_array(np.repeat(transcript_chroms, exon_counts)),
+                'start': np.asarray(arrays['exon_start']),
+                'end': np.asarray(arrays['exon_end']),
+                'strand': np.repeat(arrays['transcript_strand'], exon_counts),
+                'gene_name': _expand('transcript_gene_name'),
+                'gene_id': _expand('transcript_gene_id'),
+                'transcript_id': _expand('transcript_id')
+            },
+            columns=Exon._fields)
+
+
+def _encode(values):
+    """Encodes strings into a fixed-width bytes array (None as empty)."""
+    encoded = [(value or '').encode('utf-8') for value in values]
+    return np.array(encoded, dtype=bytes)
+
+
+def _decode(value):
+    """Decodes a bytes value from an encoded array (empty as None)."""
+    return native_str(value.decode('utf-8')) if value else None
+
+
+def _decode_array(values):
+    """Decodes an encoded bytes array into an object array."""
+    uniques, inverse = np.unique(values, return_inverse=True)
+    decoded = np.array([_decode(value) for value in uniques], dtype=object)
+    return decoded[inverse]
+
 
 _Exon = namedtuple('Exon', [
     'chromosome', 'start', 'end', 'strand', 'gene_name', 'gene_id',
@@ -517,12 +1138,114 @@ def filter_wrong_orientation(insertions, drop_na=False):
             yield ins
 
 
-def annotate_ffpm(fusions, fastq_path):
-    # type: (Iterable[Fusion], pathlib.Path) -> Iterable[Fusion]
-    """Annotates fusions with FFPM (Fusion Fragments Per Million) score."""
+def filter_insertions_frame(
+        insertions,  # type: pd.DataFrame
+        features=True,  # type: bool
+        orientation=True,  # type: bool
+        blacklist=None  # type: Set[str]
+):  # type: (...) -> pd.DataFrame
+    """Filters false positive insertions in an insertion DataFrame.
+
+    Frame-based equivalent of ``filter_insertions``, which combines the
+    requested filters into a single boolean mask. This avoids converting
+    (merged) insertion frames to ``Insertion`` objects and back.
+
+    Parameters
+    ----------
+    insertions : pandas.DataFrame
+        Insertions to filter.
+    features : bool
+        Whether to filter insertions that correspond to unexpected
+        features of the transposon (non SA/SD) features.
+    orientation : bool
+        Whether to filter insertions that have the conflicting orientations
+        between gene and transposon features.
+    blacklist : set[str]
+        List of blacklisted genes to filter for.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Filtered insertions.
+
+    """
+
+    mask = np.ones(len(insertions), dtype=bool)
+
+    if features:
+        mask &= _unexpected_features_mask(insertions)
+
+    if blacklist is not None:
+        mask &= _blacklist_mask(insertions, blacklist)
+
+    if orientation:
+        mask &= _wrong_orientation_mask(insertions)
+
+    return insertions.loc[mask]
+
+
+def filter_unexpected_features_frame(insertions):
+    # type: (pd.DataFrame) -> pd.DataFrame
+    """Frame-based equivalent of ``filter_unexpected_features``."""
+    return insertions.loc[_unexpected_features_mask(insertions)]
+
+
+def filter_blacklist_frame(insertions, genes, field='gene_name'):
+    # type: (pd.DataFrame, Set[str], str) -> pd.DataFrame
+    """Frame-based equivalent of ``filter_blacklist``."""
+    return insertions.loc[_blacklist_mask(insertions, genes, field=field)]
+
+
+def filter_wrong_orientation_frame(insertions, drop_na=False):
+    # type: (pd.DataFrame, bool) -> pd.DataFrame
+    """Frame-based equivalent of ``filter_wrong_orientation``."""
+    mask = _wrong_orientation_mask(insertions, drop_na=drop_na)
+    return insertions.loc[mask]
+
+
+def _unexpected_features_mask(insertions):
+    return insertions['feature_type'].isin(['SA', 'SD']).values
+
+
+def _blacklist_mask(insertions, genes, field='gene_name'):
+    return ~insertions[field].isin(list(genes)).values
+
+
+def _wrong_orientation_mask(insertions, drop_na=False):
+    feat_strand = _get_column(insertions, 'feature_strand')
+    gene_strand = _get_column(insertions, 'gene_strand')
+
+    feat_ori = insertions['strand'].values * feat_strand
+
+    # Note that NaN comparisons are always False.
+    mask = feat_ori == gene_strand
+
+    if not drop_na:
+        mask |= np.isnan(feat_ori) | np.isnan(gene_strand)
+
+    return mask
+
+
+def _get_column(insertions, column):
+    """Returns float values of column, using NaNs for missing columns."""
+
+    if column in insertions.columns:
+        return insertions[column].values.astype(float)
+    else:
+        return np.full(len(insertions), np.nan)
+
+
+def annotate_ffpm(fusions, fastq_path, decompress_command=None):
+    # type: (Iterable[Fusion], Any, List[str]) -> Iterable[Fusion]
+    """Annotates fusions with FFPM (Fusion Fragments Per Million) score.
+
+    For samples sequenced over multiple lanes, ``fastq_path`` may be given
+    as a list of fastq files, in which case reads are counted over all lanes.
+    """
 
     # Calculate normalization factor.
-    n_reads = count_lines(fastq_path) // 4
+    n_reads = count_lines(
+        fastq_path, decompress_command=decompress_command) // 4
     norm_factor = (1.0 / n_reads) * 1e6
 
     for fusion in fusions:
@@ -535,16 +1258,24 @@ def annotate_ffpm(fusions, fastq_path):
         yield fusion._replace(metadata=frozendict(merged_meta))
 
 
-def count_lines(file_path):
-    # type: (pathlib.Path) -> int
-    """Counts number of lines in (gzipped) file."""
+def count_lines(file_path, decompress_command=None):
+    # type: (Union[pathlib.Path, List[pathlib.Path]], List[str]) -> int
+    """Counts number of lines in (gzipped) file(s).
+
+    If multiple files are given, the total number of lines is returned.
+    Gzipped files are decompressed using the gzip module, unless a
+    ``decompress_command`` is given (for example, ``['pigz', '-dc']``),
+    in which case the file is decompressed by running the command with
+    the file path as its last argument and reading from its stdout
+    (see ``imfusion.external.util.open_decompressed``).
+    """
+
+    count = 0
+
+    for path in as_path_list(file_path):
+        with open_decompressed(path, decompress_command) as file_obj:
+            count += _count_lines(file_obj)
 
-    if file_path.suffixes[-1] == '.gz':
-        with gzip.open(str(file_path)) as file_obj:
-            count = _count_lines(file_obj)
-    else:
-        with file_path.open() as file_obj:
-            count = _count_lines(file_obj)
     return count
 
 
@@ -12,7 +12,9 @@ import sys
 
 import imfusion
 
-VALID_SUBCOMMANDS = {'build', 'insertions', 'expression', 'merge', 'ctg'}
+VALID_SUBCOMMANDS = {
+    'build', 'insertions', 'expression', 'merge', 'filter', 'ctg'
+}
 
 
 def main():
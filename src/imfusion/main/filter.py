@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Script for (re-)filtering insertion datasets."""
+
+# pylint: disable=wildcard-import,redefined-builtin,unused-wildcard-import
+from __future__ import absolute_import, division, print_function
+from builtins import *
+# pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
+
+import argparse
+
+from pathlib2 import Path
+
+import imfusion
+from imfusion.insertions.util import filter_insertions_frame
+from imfusion.model import Insertion
+
+
+def main():
+    """Main function of imfusion-filter."""
+
+    args = _parse_args()
+
+    # Read insertions directly into a frame, avoiding object conversion.
+    insertions = Insertion.read_csv(args.insertions, sep='\t')
+
+    blacklist = None
+    if args.blacklisted_genes is not None:
+        blacklist = set(args.blacklisted_genes)
+
+    filtered = filter_insertions_frame(
+        insertions,
+        features=args.filter_features,
+        orientation=args.filter_orientation,
+        blacklist=blacklist)
+
+    # Write output.
+    filtered.to_csv(str(args.output), sep='\t', index=False)
+
+
+def _parse_args():
+    """Parses command-line arguments for imfusion-filter."""
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--version',
+        action='version',
+        version='IM-Fusion ' + imfusion.__version__)
+
+    parser.add_argument(
+        '--insertions',
+        type=Path,
+        required=True,
+        help='Path to the (merged) insertions file to filter.')
+
+    parser.add_argument(
+        '--output',
+        type=Path,
+        required=True,
+        help='Output path for the filtered insertion file.')
+
+    filt_group = parser.add_argument_group('Filtering')
+    filt_group.add_argument(
+        '--no_filter_orientation',
+        dest='filter_orientation',
+        default=True,
+        action='store_false',
+        help=('Don\'t filter fusions with transposon features and genes '
+              'in opposite (incompatible) orientations.'))
+
+    filt_group.add_argument(
+        '--no_filter_feature',
+        dest='filter_features',
+        default=True,
+        action='store_false',
+        help=('Don\'t filter fusions with non-SA/SD features.'))
+
+    filt_group.add_argument(
+        '--blacklisted_genes',
+        nargs='+',
+        help='Blacklisted genes to filter.')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
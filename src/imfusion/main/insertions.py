@@ -8,12 +8,14 @@ from builtins import *
 
 import argparse
 import logging
+import sys
 
 from pathlib2 import Path
 
 import imfusion
 from imfusion.insertions.aligners import get_aligners
-from imfusion.model import Insertion
+from imfusion.insertions.batch import (identify_insertions_batch,
+                                       read_sample_sheet, write_insertions)
 
 FORMAT = "[%(asctime)-15s] %(message)s"
 logging.basicConfig(
@@ -29,18 +31,28 @@ def main():
     aligner = args.aligner.from_args(args)
     aligner.check_dependencies()
 
-    insertions = aligner.identify_insertions(
-        fastq_path=args.fastq,
-        output_dir=args.output_dir,
-        fastq2_path=args.fastq2)
+    if args.batch:
+        samples = read_sample_sheet(args.sample_sheet)
 
-    # Convert to dataframe.
-    insertion_frame = Insertion.to_frame(insertions)
-    insertion_frame = insertion_frame.sort_values('support', ascending=False)
+        failed = identify_insertions_batch(
+            aligner,
+            samples,
+            output_dir=args.output_dir,
+            max_threads=args.max_threads,
+            max_memory=args.max_memory,
+            sample_memory=args.sample_memory)
 
-    # Write output.
-    output_path = args.output_dir / 'insertions.txt'
-    insertion_frame.to_csv(str(output_path), sep='\t', index=False)
+        if failed:
+            sys.exit(1)
+    else:
+        insertions = aligner.identify_insertions(
+            fastq_path=args.fastq,
+            output_dir=args.output_dir,
+            fastq2_path=args.fastq2)
+
+        # Write output.
+        output_path = args.output_dir / 'insertions.txt'
+        write_insertions(insertions, output_path)
 
 
 def parse_args():
@@ -60,6 +72,47 @@ def parse_args():
     for aligner_name, aligner_class in sorted(get_aligners().items()):
         aligner_parser = subparsers.add_parser(aligner_name)
         aligner_class.configure_args(aligner_parser)
-        aligner_parser.set_defaults(aligner=aligner_class)
+        aligner_parser.set_defaults(aligner=aligner_class, batch=False)
+
+    # Register batch versions of pipelines.
+    batch_parser = subparsers.add_parser('batch')
+
+    batch_subparsers = batch_parser.add_subparsers(dest='batch_aligner')
+    batch_subparsers.required = True
+
+    for aligner_name, aligner_class in sorted(get_aligners().items()):
+        aligner_parser = batch_subparsers.add_parser(aligner_name)
+        aligner_class.configure_args(aligner_parser, batch=True)
+        _configure_batch_args(aligner_parser)
+        aligner_parser.set_defaults(aligner=aligner_class, batch=True)
 
     return parser.parse_args()
+
+
+def _configure_batch_args(parser):
+    """Configures arguments for scheduling samples in batches."""
+
+    batch_group = parser.add_argument_group('Batch')
+
+    batch_group.add_argument(
+        '--max_threads',
+        type=int,
+        default=None,
+        help=('Maximum number of threads to use for processing samples '
+              'concurrently. Defaults to the number of CPUs.'))
+
+    batch_group.add_argument(
+        '--max_memory',
+        type=float,
+        default=None,
+        help=('Maximum amount of memory (in GB) to use for processing '
+              'samples concurrently.'))
+
+    batch_group.add_argument(
+        '--sample_memory',
+        type=float,
+        default=4,
+        help=('Expected memory usage (in GB) of the alignment of a sample '
+              '(including sorting), excluding memory shared between '
+              'samples (such as a shared STAR genome). Used to determine '
+              'how many samples are aligned concurrently.'))
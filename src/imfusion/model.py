@@ -28,7 +28,9 @@ class FrameMixin(object):
 
     @classmethod
     def _to_obj(cls, record):
-        return cls(**record._asdict())
+        record_dict = record._asdict()
+        record_dict.pop('Index', None)
+        return cls(**record_dict)
 
     @classmethod
     def read_csv(cls, file_path, **kwargs):
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""Implements a library interface for processing multiple samples."""
+
+# pylint: disable=wildcard-import,redefined-builtin,unused-wildcard-import
+from __future__ import absolute_import, division, print_function
+from builtins import *
+# pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
+
+import logging
+import threading
+
+from imfusion import ctg
+from imfusion.expression.counts import STRANDED_MAP, generate_exon_counts
+from imfusion.insertions.batch import write_insertions
+
+
+class Pipeline(object):
+    """Pipeline for analyzing multiple samples within a single process.
+
+    Provides the functionality of the ``imfusion-insertions``,
+    ``imfusion-expression`` and ``imfusion-ctg`` commands as methods, which
+    share the reference of the given aligner. Reference data (such as the
+    gene annotation, the transposon features and the reference sequence)
+    and the gene windows used for testing CTGs are only loaded once and are
+    re-used for all samples, rather than being loaded again for each
+    sample as is the case when running the separate commands.
+
+    Samples are described using ``Sample`` tuples (see
+    ``imfusion.insertions.batch``). The output of each sample is written
+    to a sub-directory of ``output_dir``, named after the sample.
+
+    Parameters
+    ----------
+    aligner : Aligner
+        Aligner to use for identifying insertions.
+    output_dir : pathlib.Path
+        Output directory, in which the sample directories are created.
+    logger : logging.Logger
+        Logger to be used for logging messages.
+
+    """
+
+    def __init__(self, aligner, output_dir, logger=None):
+        self._aligner = aligner
+        self._output_dir = output_dir
+        self._logger = logger or logging.getLogger()
+
+        self._gene_windows = {}
+        self._lock = threading.Lock()
+
+    @property
+    def aligner(self):
+        """Aligner used for identifying insertions."""
+        return self._aligner
+
+    @property
+    def reference(self):
+        """Reference shared by the analyses of the pipeline."""
+        return self._aligner.reference
+
+    def batch(self):
+        """Context for processing multiple samples as a batch.
+
+        Sets up any resources that the aligner shares between samples
+        (such as a genome index loaded into shared memory) for the duration
+        of the context (see ``Aligner.batch``).
+        """
+        return self._aligner.batch(self._output_dir)
+
+    def sample_dir(self, sample):
+        """Returns the output directory of the given sample."""
+        return self._output_dir / sample.name
+
+    def identify_insertions(self, sample):
+        """Identifies insertions for the given sample.
+
+        Identified insertions are also written to the file
+        ``insertions.txt`` in the output directory of the sample.
+
+        Parameters
+        ----------
+        sample : Sample
+            Sample to identify insertions for.
+
+        Returns
+        -------
+        List[Insertion]
+            Identified insertions.
+
+        """
+
+        sample_dir = self.sample_dir(sample)
+
+        self._logger.info('Identifying insertions for sample %s', sample.name)
+
+        insertions = list(
+            self._aligner.identify_insertions(
+                fastq_path=sample.fastq_path,
+                output_dir=sample_dir,
+                fastq2_path=sample.fastq2_path))
+
+        write_insertions(insertions, sample_dir / 'insertions.txt')
+
+        return insertions
+
+    def count_expression(self, sample, paired=False, stranded='unstranded'):
+        """Generates exon expression counts for the given sample.
+
+        Counts are generated from the alignment of the sample, which should
+        have been generated previously using ``identify_insertions``. The
+        counts are also written to the file ``expression.txt`` in the
+        output directory of the sample.
+
+        Parameters
+        ----------
+        sample : Sample
+            Sample to generate counts for.
+        paired : bool
+            Whether to count fragments instead of reads (for paired-end data).
+        stranded : str
+            Strandedness of the RNA-seq data ('unstranded', 'stranded'
+            or 'reverse').
+
+        Returns
+        -------
+        pandas.DataFrame
+            Exon expression counts of the sample.
+
+        """
+
+        sample_dir = self.sample_dir(sample)
+        bam_path = sample_dir / 'alignment.bam'
+
+        feature_counts_kws = {'-s': STRANDED_MAP[stranded]}
+
+        if paired:
+            feature_counts_kws['-p'] = True
+
+        self._logger.info('Generating exon counts for sample %s', sample.name)
+
+        exon_counts = generate_exon_counts(
+            [bam_path],
+            gtf_path=self.reference.exon_gtf_path,
+            names={str(bam_path): sample.name},
+            extra_kws=feature_counts_kws)
+
+        exon_counts.to_csv(
+            str(sample_dir / 'expression.txt'), sep='\t', index=True)
+
+        return exon_counts
+
+    def test_ctgs(self,
+                  insertions,
+                  gene_ids=None,
+                  chromosomes=None,
+                  pattern=None,
+                  per_sample=True,
+                  window=None):
+        """Identifies genes that are significantly enriched for insertions.
+
+        See ``imfusion.ctg.test_ctgs`` for a description of the parameters.
+        Gene windows are only built once for a given window and set of
+        chromosomes, so that repeated tests (for example, for different
+        subsets of insertions) avoid re-reading the reference annotation.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Results of CTG test for tested genes.
+
+        """
+
+        key = (tuple(window) if window is not None else None,
+               tuple(sorted(chromosomes)) if chromosomes is not None else None)
+
+        with self._lock:
+            if key not in self._gene_windows:
+                self._gene_windows[key] = ctg.build_gene_windows(
+                    self.reference, window=window, chromosomes=chromosomes)
+            gene_windows = self._gene_windows[key]
+
+        return ctg.test_ctgs(
+            insertions,
+            reference=self.reference,
+            gene_ids=gene_ids,
+            pattern=pattern,
+            per_sample=per_sample,
+            gene_windows=gene_windows)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Provides functionality for attributing log messages to samples."""
+
+# pylint: disable=wildcard-import,redefined-builtin,unused-wildcard-import
+from __future__ import absolute_import, division, print_function
+from builtins import *
+# pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
+
+import contextlib
+import logging
+from multiprocessing.pool import ThreadPool
+import threading
+
+_context = threading.local()
+
+
+def current_sample():
+    # type: () -> str
+    """Returns the sample processed by the current thread (if any)."""
+    return getattr(_context, 'sample', None)
+
+
+def _set_sample(sample):
+    _context.sample = sample
+
+
+@contextlib.contextmanager
+def sample_context(sample):
+    """Context in which the current thread processes the given sample.
+
+    Messages logged by the thread within this context (or by threads
+    started using ``thread_pool``) are attributed to the sample, which
+    allows them to be selected using a ``SampleFilter``.
+    """
+
+    previous = current_sample()
+    _set_sample(sample)
+
+    try:
+        yield
+    finally:
+        _set_sample(previous)
+
+
+def thread_pool(processes):
+    # type: (int) -> ThreadPool
+    """Creates a thread pool whose threads process the current sample.
+
+    Should be used instead of ``ThreadPool`` for processing a sample in
+    multiple threads, so that messages logged by the threads in the pool
+    are attributed to the same sample as the current thread.
+    """
+    return ThreadPool(
+        processes, initializer=_set_sample, initargs=(current_sample(), ))
+
+
+class SampleFilter(logging.Filter):
+    """Logging filter that selects messages logged for the given sample."""
+
+    def __init__(self, sample):
+        super().__init__()
+        self._sample = sample
+
+    def filter(self, record):
+        return current_sample() == self._sample
@@ -6,10 +6,38 @@ from __future__ import absolute_import, division, print_function
 from builtins import *
 # pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
 
+from typing import Iterable, List, Union
+
 import pathlib2 as pathlib
 
 
-def symlink_relative(src_path, dest_path):
-    # type: (pathlib.Path, pathlib.Path) -> None
-    """Symlinks file using relative path."""
+def symlink_relative(src_path, dest_path, overwrite=False):
+    # type: (pathlib.Path, pathlib.Path, bool) -> None
+    """Symlinks file using relative path.
+
+    If ``overwrite`` is True, any existing file (or link) at the
+    destination path is replaced.
+    """
+
+    if overwrite and (dest_path.is_symlink() or dest_path.exists()):
+        dest_path.unlink()
+
     dest_path.symlink_to(src_path.relative_to(dest_path.parent))
+
+
+def as_path_list(paths):
+    # type: (Union[pathlib.Path, Iterable[pathlib.Path]]) -> List[pathlib.Path]
+    """Returns given path(s) as a list of paths.
+
+    Used for arguments that accept either a single path or multiple paths,
+    such as the fastq files of a sample sequenced over multiple lanes.
+    Returns an empty list if ``paths`` is None.
+    """
+
+    if paths is None:
+        return []
+
+    if isinstance(paths, (pathlib.PurePath, str)):
+        return [paths]
+
+    return list(paths)
@@ -48,6 +48,7 @@ class TestStarIndexer(object):
         assert ref.transposon_name == 'T2onc'
         assert ref.transposon_path.exists()
         assert ref.features_path.exists()
+        assert ref.annotation_path.exists()
 
         # Check presence of augmented reference sequences.
         refseq = pyfaidx.Fasta(str(ref.fasta_path))
@@ -60,7 +61,30 @@ class TestStarIndexer(object):
             output_dir=ref.index_path,
             log_path=build_kws['output_dir'] / 'star.log',
             overhang=100,
-            threads=1)
+            threads=1,
+            sjdb_path=None)
+
+        assert not ref.junctions_path.exists()
+
+    def test_build_junctions(self, build_kws, junction_paths, mocker):
+        """Tests build with additional junctions."""
+
+        mock = mocker.patch.object(star, 'star_index')
+
+        indexer = star.StarIndexer(junction_paths=junction_paths)
+        indexer.build(**build_kws)
+
+        ref = star.StarReference(build_kws['output_dir'])
+        assert mock.call_args[1]['sjdb_path'] == ref.junctions_path
+
+        with ref.junctions_path.open() as file_:
+            lines = file_.read().splitlines()
+
+        # Junctions are compared with the reference GTF, rather than using
+        # the annotation column (which includes first-pass junctions).
+        assert lines == [
+            '1\t100\t200\t+', '1\t300\t400\t+', '2\t500\t800\t-'
+        ]
 
     def test_from_args(self, cmdline_args):
         """Tests creation from command line."""
@@ -82,11 +106,17 @@ class TestStarIndexer(object):
         # Check instance.
         assert indexer._overhang == 100
         assert indexer._threads == 1
+        assert indexer._junction_paths == []
 
     def test_from_args_extra(self, cmdline_args):
         """Tests creation from command line using extra args."""
 
-        cmdline_args += ['--star_overhang', '50', '--star_threads', '10']
+        cmdline_args += [
+            '--star_overhang', '50', '--star_threads', '10',
+            '--star_junctions', 'a.SJ.out.tab', 'b.SJ.out.tab',
+            '--star_min_junction_reads', '5',
+            '--star_min_junction_samples', '2'
+        ] # yapf: disable
 
         # Setup parser.
         parser = argparse.ArgumentParser()
@@ -99,6 +129,110 @@ class TestStarIndexer(object):
         # Check instance.
         assert indexer._overhang == 50
         assert indexer._threads == 10
+        assert indexer._junction_paths == [
+            Path('a.SJ.out.tab'), Path('b.SJ.out.tab')
+        ]
+        assert indexer._min_junction_reads == 5
+        assert indexer._min_junction_samples == 2
+
+
+@pytest.fixture
+def junction_paths(tmpdir):
+    """Example SJ.out.tab files for two samples."""
+
+    sample1 = ['1\t100\t200\t1\t1\t0\t10\t0\t30',
+               '1\t300\t400\t1\t1\t1\t20\t0\t30',
+               '2\t500\t800\t2\t2\t0\t3\t1\t30',
+               '2\t600\t900\t2\t0\t0\t10\t0\t30',
+               'T2onc\t10\t90\t1\t1\t0\t50\t0\t30'] # yapf: disable
+
+    sample2 = ['1\t100\t200\t1\t1\t0\t4\t0\t30',
+               '2\t1000\t1100\t1\t1\t0\t1\t0\t30'] # yapf: disable
+
+    paths = []
+    for i, lines in enumerate([sample1, sample2]):
+        path = Path(str(tmpdir / 'sample{}.SJ.out.tab'.format(i)))
+        with path.open('w') as file_:
+            file_.write('\n'.join(lines) + '\n')
+        paths.append(path)
+
+    return paths
+
+
+class TestMergeJunctions(object):
+    """Tests for the merge_junctions function."""
+
+    def test_example(self, junction_paths):
+        """Tests merging of example junctions."""
+
+        merged = star.merge_junctions(
+            junction_paths, min_reads=2, exclude_seqnames=['T2onc'])
+
+        assert list(merged.columns) == ['seqname', 'start', 'end', 'strand']
+        assert list(merged['seqname']) == ['1', '2']
+        assert list(merged['start']) == [100, 500]
+        assert list(merged['end']) == [200, 800]
+        assert list(merged['strand']) == ['+', '-']
+
+    def test_min_samples(self, junction_paths):
+        """Tests filtering of junctions on number of samples."""
+
+        merged = star.merge_junctions(junction_paths, min_samples=2)
+        assert list(merged['start']) == [100]
+
+
+    def test_two_pass(self, tmpdir, junction_gtf_path):
+        """Tests novel junctions from two-pass alignments are retained."""
+
+        # STAR marks junctions detected in the first pass as annotated.
+        path = Path(str(tmpdir / 'two_pass.SJ.out.tab'))
+        with path.open('w') as file_:
+            file_.write('1\t100\t200\t1\t1\t1\t10\t0\t30\n'
+                        '1\t300\t400\t1\t1\t1\t20\t0\t30\n')
+
+        merged = star.merge_junctions([path])
+        assert len(merged) == 0
+
+        merged = star.merge_junctions(
+            [path], annotated=star.gtf_junctions(junction_gtf_path))
+        assert list(merged['start']) == [300]
+        assert list(merged['end']) == [400]
+
+
+@pytest.fixture
+def junction_gtf_path(tmpdir):
+    """Example GTF with spliced and unspliced transcripts."""
+
+    lines = ['1\ttest\texon\t50\t99\t.\t+\t.\t'
+             'gene_id "g1"; transcript_id "t1";',
+             '1\ttest\texon\t201\t250\t.\t+\t.\t'
+             'gene_id "g1"; transcript_id "t1";',
+             '1\ttest\texon\t301\t350\t.\t+\t.\t'
+             'gene_id "g1"; transcript_id "t1";',
+             '1\ttest\texon\t201\t350\t.\t+\t.\t'
+             'gene_id "g1"; transcript_id "t2";',
+             '2\ttest\texon\t1\t100\t.\t-\t.\t'
+             'gene_id "g2"; transcript_id "t3";'] # yapf: disable
+
+    path = Path(str(tmpdir / 'reference.gtf'))
+    with path.open('w') as file_:
+        file_.write('\n'.join(lines) + '\n')
+
+    return path
+
+
+class TestGtfJunctions(object):
+    """Tests for the gtf_junctions function."""
+
+    def test_example(self, junction_gtf_path):
+        """Tests junctions of example GTF."""
+
+        junctions = star.gtf_junctions(junction_gtf_path)
+
+        assert list(junctions.columns) == ['seqname', 'start', 'end']
+        assert list(junctions['seqname']) == ['1', '1']
+        assert list(junctions['start']) == [100, 251]
+        assert list(junctions['end']) == [200, 300]
 
 
 class TestStarReference(object):
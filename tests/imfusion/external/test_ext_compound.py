@@ -3,6 +3,7 @@
 
 from pathlib2 import Path
 
+import pysam
 import pytest
 
 from imfusion.external import compound
@@ -20,7 +21,7 @@ class TestSortBam(object):
         compound.sort_bam(Path('test.bam'), Path('sorted.bam'))
 
         mock_sambamba.assert_called_once_with(
-            Path('test.bam'), Path('sorted.bam'), threads=1)
+            Path('test.bam'), Path('sorted.bam'), threads=1, tmp_dir=None)
 
     def test_pysam_call(self, mocker):
         """Tests call that uses pysam (samtools)."""
@@ -30,4 +31,81 @@ class TestSortBam(object):
         mock_pysam = mocker.patch.object(compound.pysam, 'sort')
         compound.sort_bam(Path('test.bam'), Path('sorted.bam'))
 
-        mock_pysam.assert_called_once_with('test.bam', 'sorted.bam')
+        mock_pysam.assert_called_once_with('-@', '1', '-o', 'sorted.bam',
+                                           'test.bam')
+
+    def test_pysam_call_extra(self, mocker, tmpdir):
+        """Tests pysam call with memory, tmp dir and index."""
+
+        mocker.patch.object(compound, 'which', return_value=None)
+        mocker.patch.object(
+            compound.pysam, '__samtools_version__', '1.10', create=True)
+
+        mock_pysam = mocker.patch.object(compound.pysam, 'sort')
+        mock_index = mocker.patch.object(compound.pysam, 'index')
+
+        tmp_dir = Path(str(tmpdir / 'tmp'))
+
+        compound.sort_bam(
+            Path('test.bam'),
+            Path('sorted.bam'),
+            threads=4,
+            memory='1G',
+            tmp_dir=tmp_dir,
+            index=True)
+
+        mock_pysam.assert_called_once_with(
+            '-@', '4', '-m', '1G', '-T', str(tmp_dir / 'sorted'),
+            '--write-index', '-o', 'sorted.bam##idx##sorted.bam.bai',
+            'test.bam')
+
+        assert tmp_dir.exists()
+        assert not mock_index.called
+
+    def test_pysam_call_index_unsupported(self, mocker):
+        """Tests separate indexing for samtools without --write-index."""
+
+        mocker.patch.object(compound, 'which', return_value=None)
+        mocker.patch.object(
+            compound.pysam, '__samtools_version__', '1.9', create=True)
+
+        mock_pysam = mocker.patch.object(compound.pysam, 'sort')
+        mock_index = mocker.patch.object(compound.pysam, 'index')
+
+        compound.sort_bam(
+            Path('test.bam'), Path('sorted.bam'), threads=2, index=True)
+
+        mock_pysam.assert_called_once_with('-@', '2', '-o', 'sorted.bam',
+                                           'test.bam')
+        mock_index.assert_called_once_with('-@', '2', 'sorted.bam')
+
+    def test_sort_index(self, mocker, tmpdir):
+        """Tests sorting and indexing of an example bam file."""
+
+        header = {'HD': {'VN': '1.0'}, 'SQ': [{'SN': '1', 'LN': 10000}]}
+
+        input_path = Path(str(tmpdir / 'unsorted.bam'))
+        output_path = Path(str(tmpdir / 'sorted.bam'))
+
+        with pysam.AlignmentFile(
+                str(input_path), 'wb', header=header) as bam_file:
+            for i, pos in enumerate([500, 100, 300]):
+                segment = pysam.AlignedSegment()
+                segment.query_name = 'R{}'.format(i)
+                segment.reference_id = 0
+                segment.reference_start = pos
+                segment.cigarstring = '10M'
+                segment.query_sequence = 'A' * 10
+                bam_file.write(segment)
+
+        mocker.patch.object(compound, 'which', return_value=None)
+        compound.sort_bam(input_path, output_path, threads=2, index=True)
+
+        assert Path(str(output_path) + '.bai').exists()
+
+        with pysam.AlignmentFile(str(output_path)) as bam_file:
+            positions = [
+                read.reference_start for read in bam_file.fetch('1', 0, 1000)
+            ]
+
+        assert positions == [100, 300, 500]
@@ -5,7 +5,7 @@ from pathlib2 import Path
 
 import pytest
 
-from imfusion.external import star
+from imfusion.external import star, util
 
 # pylint: disable=no-self-use,redefined-outer-name
 
@@ -35,6 +35,22 @@ class TestStarIndex(object):
             ],
             log_path=None)
 
+    def test_call_sjdb(self, mocker, tmpdir):
+        """Tests example call with additional junctions."""
+
+        mock_run = mocker.patch.object(star, 'run_command')
+
+        output_dir = Path(str(tmpdir / 'out'))
+
+        star.star_index(
+            Path('reference.fa'),
+            gtf_path=Path('reference.gtf'),
+            output_dir=output_dir,
+            sjdb_path=Path('junctions.txt'))
+
+        args = mock_run.call_args[1]['args']
+        assert args[-2:] == ['--sjdbFileChrStartEnd', 'junctions.txt']
+
 
 @pytest.fixture
 def star_align_kws(tmpdir):
@@ -100,6 +116,42 @@ class TestStarAlign(object):
             ],
             log_path=None)
 
+    def test_multiple_lanes(self, mocker, star_align_kws):
+        """Tests example call with paired-end data from multiple lanes."""
+
+        mock_run = mocker.patch.object(star, 'run_command')
+
+        star_align_kws['fastq_path'] = [
+            Path('sample.L1.R1.fastq.gz'), Path('sample.L2.R1.fastq.gz')
+        ]
+        star_align_kws['fastq2_path'] = [
+            Path('sample.L1.R2.fastq.gz'), Path('sample.L2.R2.fastq.gz')
+        ]
+        star.star_align(**star_align_kws)
+
+        mock_run.assert_called_once_with(
+            args=[
+                'STAR', '--genomeDir', 'index', '--outFileNamePrefix',
+                str(star_align_kws['output_dir']) + '/', '--readFilesIn',
+                'sample.L1.R1.fastq.gz,sample.L2.R1.fastq.gz',
+                'sample.L1.R2.fastq.gz,sample.L2.R2.fastq.gz',
+                '--readFilesCommand', 'gunzip', '-c'
+            ],
+            log_path=None)
+
+    def test_multiple_lanes_mismatch(self, mocker, star_align_kws):
+        """Tests call with different number of lanes per mate."""
+
+        mocker.patch.object(star, 'run_command')
+
+        star_align_kws['fastq_path'] = [
+            Path('sample.L1.R1.fastq.gz'), Path('sample.L2.R1.fastq.gz')
+        ]
+        star_align_kws['fastq2_path'] = [Path('sample.L1.R2.fastq.gz')]
+
+        with pytest.raises(ValueError):
+            star.star_align(**star_align_kws)
+
     def test_extra_arguments(self, mocker, star_align_kws):
         """Tests example call with extra arguments."""
 
@@ -121,6 +173,7 @@ class TestStarAlign(object):
         """Tests example call with extra arguments."""
 
         mock_run = mocker.patch.object(star, 'run_command')
+        mocker.patch.object(util, 'which', return_value=None)
 
         star_align_kws['threads'] = 5
         star.star_align(**star_align_kws)
@@ -133,3 +186,72 @@ class TestStarAlign(object):
                 '--runThreadN', '5'
             ],
             log_path=None)
+
+    def test_multiple_threads_pigz(self, mocker, star_align_kws):
+        """Tests decompression using pigz with multiple threads."""
+
+        mock_run = mocker.patch.object(star, 'run_command')
+        mocker.patch.object(util, 'which', return_value='/usr/bin/pigz')
+
+        star_align_kws['threads'] = 5
+        star.star_align(**star_align_kws)
+
+        mock_run.assert_called_once_with(
+            args=[
+                'STAR', '--genomeDir', 'index', '--outFileNamePrefix',
+                str(star_align_kws['output_dir']) + '/', '--readFilesIn',
+                'sample.R1.fastq.gz', '--readFilesCommand', 'pigz', '-dc',
+                '-p', '5', '--runThreadN', '5'
+            ],
+            log_path=None)
+
+    def test_decompress_command(self, mocker, star_align_kws):
+        """Tests call with a custom decompression command."""
+
+        mock_run = mocker.patch.object(star, 'run_command')
+
+        star_align_kws['decompress_command'] = ['zcat']
+        star.star_align(**star_align_kws)
+
+        mock_run.assert_called_once_with(
+            args=[
+                'STAR', '--genomeDir', 'index', '--outFileNamePrefix',
+                str(star_align_kws['output_dir']) + '/', '--readFilesIn',
+                'sample.R1.fastq.gz', '--readFilesCommand', 'zcat'
+            ],
+            log_path=None)
+
+
+class TestStarLoadGenome(object):
+    """Unit tests for the star_load_genome function."""
+
+    def test_load(self, mocker, tmpdir):
+        """Tests loading genome into shared memory."""
+
+        mock_run = mocker.patch.object(star, 'run_command')
+
+        output_dir = Path(str(tmpdir / 'out'))
+        star.star_load_genome(Path('index'), output_dir=output_dir)
+
+        mock_run.assert_called_once_with(
+            args=[
+                'STAR', '--genomeDir', 'index', '--genomeLoad', 'LoadAndExit',
+                '--outFileNamePrefix', str(output_dir) + '/'
+            ],
+            log_path=None)
+
+    def test_remove(self, mocker, tmpdir):
+        """Tests removing genome from shared memory."""
+
+        mock_run = mocker.patch.object(star, 'run_command')
+
+        output_dir = Path(str(tmpdir / 'out'))
+        star.star_load_genome(
+            Path('index'), output_dir=output_dir, remove=True)
+
+        mock_run.assert_called_once_with(
+            args=[
+                'STAR', '--genomeDir', 'index', '--genomeLoad', 'Remove',
+                '--outFileNamePrefix', str(output_dir) + '/'
+            ],
+            log_path=None)
@@ -82,6 +82,28 @@ class TestTophat2Align(object):
             ],
             log_path=None)
 
+    def test_multiple_lanes(self, mocker, tophat2_align_kws):
+        """Tests example call with paired-end data from multiple lanes."""
+
+        mock_run = mocker.patch.object(tophat, 'run_command')
+
+        tophat2_align_kws['fastq_path'] = [
+            Path('sample.L1.R1.fastq.gz'), Path('sample.L2.R1.fastq.gz')
+        ]
+        tophat2_align_kws['fastq2_path'] = [
+            Path('sample.L1.R2.fastq.gz'), Path('sample.L2.R2.fastq.gz')
+        ]
+        tophat.tophat2_align(**tophat2_align_kws)
+
+        mock_run.assert_called_once_with(
+            args=[
+                'tophat2', '--output-dir',
+                str(tophat2_align_kws['output_dir']), 'index',
+                'sample.L1.R1.fastq.gz,sample.L2.R1.fastq.gz',
+                'sample.L1.R2.fastq.gz,sample.L2.R2.fastq.gz'
+            ],
+            log_path=None)
+
     def test_extra_arguments(self, mocker, tophat2_align_kws):
         """Tests example call with extra arguments."""
 
@@ -6,6 +6,7 @@ from __future__ import absolute_import, division, print_function
 from builtins import *
 # pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
 
+import gzip
 import subprocess
 
 from future.utils import native_str
@@ -45,6 +46,67 @@ class TestCheckDependencies(object):
             util.check_dependencies(['non-existent-binary-path'])
 
 
+class TestDecompressCommand(object):
+    """Tests for the decompress_command function."""
+
+    def test_single_thread(self, mocker):
+        """Tests that gunzip is used for single-threaded decompression."""
+
+        mocker.patch.object(util, 'which', return_value='/usr/bin/pigz')
+        assert util.decompress_command(threads=1) == ['gunzip', '-c']
+
+    def test_pigz(self, mocker):
+        """Tests that pigz is used for multiple threads if available."""
+
+        mocker.patch.object(util, 'which', return_value='/usr/bin/pigz')
+        assert util.decompress_command(threads=4) == \
+            ['pigz', '-dc', '-p', '4']
+
+    def test_pigz_missing(self, mocker):
+        """Tests fallback to gunzip if pigz is not available."""
+
+        mocker.patch.object(util, 'which', return_value=None)
+        assert util.decompress_command(threads=4) == ['gunzip', '-c']
+
+
+class TestOpenDecompressed(object):
+    """Tests for the open_decompressed function."""
+
+    def test_plain(self, tmpdir):
+        """Tests reading a plain file without extension."""
+
+        file_path = Path(native_str(tmpdir)) / 'reads'
+        with file_path.open('wb') as file_:
+            file_.write(b'test\n')
+
+        with util.open_decompressed(file_path) as file_obj:
+            assert file_obj.read() == b'test\n'
+
+    def test_gzip(self, tmpdir):
+        """Tests reading a gzipped file, with and without a command."""
+
+        file_path = Path(native_str(tmpdir)) / 'reads.fastq.gz'
+        with gzip.open(native_str(file_path), 'wb') as file_:
+            file_.write(b'test\n')
+
+        with util.open_decompressed(file_path) as file_obj:
+            assert file_obj.read() == b'test\n'
+
+        with util.open_decompressed(
+                file_path, decompress_command=['gunzip', '-c']) as file_obj:
+            assert file_obj.read() == b'test\n'
+
+    def test_command_failure(self, tmpdir):
+        """Tests failing decompression command."""
+
+        file_path = Path(native_str(tmpdir)) / 'missing.fastq.gz'
+
+        with pytest.raises(subprocess.CalledProcessError):
+            with util.open_decompressed(
+                    file_path, decompress_command=['gunzip', '-c']) as fobj:
+                fobj.read()
+
+
 class TestParseArguments(object):
     """Tests for the parse_arguments function."""
 
@@ -11,12 +11,14 @@ import shutil
 
 from pathlib2 import Path
 
+import pysam
 import pytest
 
 from future.utils import native_str
 import pandas as pd
 
-from imfusion.insertions.aligners import star
+from imfusion.insertions.aligners import base as aligner_base, star
+from imfusion.insertions.manifest import StageManifest
 from imfusion.model import Fusion, TransposonFusion, Insertion
 from imfusion.util.frozendict import frozendict
 
@@ -60,6 +62,218 @@ class TestReadChimericJunctions(object):
         assert first.second_segment_base == 52139621
         assert first.second_segment_cigar == '8M1378N90M-70p68M32S'
 
+    def test_transposon_filter(self, chimeric_junctions_path, tmpdir):
+        """Tests filtering for transposon junctions while reading."""
+
+        # Add junction without transposon to the example data.
+        junction_path = Path(native_str(tmpdir)) / 'Chimeric.out.junction'
+        shutil.copy(str(chimeric_junctions_path), str(junction_path))
+
+        with junction_path.open('a') as file_:
+            file_.write('16\t100\t+\t8\t200\t-\t1\t0\t0\tR1\t50\t'
+                        '50M50S\t200\t50M50S\n')
+
+        df = star.read_chimeric_junctions(
+            junction_path, transposon_name='T2onc', chunksize=100)
+
+        assert df.shape == (505, 14)
+        assert str(df['seqname_a'].dtype) == 'category'
+        assert set(df['seqname_b'].cat.categories) == {'16', 'T2onc'}
+
+        # Check fusions are unaffected.
+        fusions = set(star.extract_transposon_fusions(df, 'T2onc'))
+        assert len(fusions) == 7
+
+
+class TestReadChimericJunctionsCached(object):
+    """Tests for read_chimeric_junctions_cached."""
+
+    def test_example(self, chimeric_junctions_path, tmpdir):
+        """Tests writing and re-using the junction cache."""
+
+        junction_path = Path(native_str(tmpdir)) / 'Chimeric.out.junction'
+        shutil.copy(str(chimeric_junctions_path), str(junction_path))
+
+        cache_path = Path(native_str(tmpdir)) / 'Chimeric.out.junction.npz'
+
+        # Check cache is created on first read.
+        expected = star.read_chimeric_junctions(
+            junction_path, transposon_name='T2onc')
+
+        df = star.read_chimeric_junctions_cached(
+            junction_path, transposon_name='T2onc')
+
+        assert cache_path.exists()
+        pd.testing.assert_frame_equal(df, expected)
+
+        # Check cached result is identical.
+        cached = star.read_chimeric_junctions_cached(
+            junction_path, transposon_name='T2onc')
+        pd.testing.assert_frame_equal(cached, expected)
+
+    def test_invalidated(self, chimeric_junctions_path, tmpdir):
+        """Tests cache is invalidated if the junction file changes."""
+
+        junction_path = Path(native_str(tmpdir)) / 'Chimeric.out.junction'
+        shutil.copy(str(chimeric_junctions_path), str(junction_path))
+
+        df = star.read_chimeric_junctions_cached(
+            junction_path, transposon_name='T2onc')
+        assert len(df) == 505
+
+        # Truncate junction file to its first 10 lines.
+        with junction_path.open() as file_:
+            lines = file_.readlines()[:10]
+
+        with junction_path.open('w') as file_:
+            file_.writelines(lines)
+
+        df = star.read_chimeric_junctions_cached(
+            junction_path, transposon_name='T2onc')
+        assert len(df) == 10
+
+
+def _segment(name, ref_id, pos, cigar, flag, tags, next_ref_id=-1,
+             next_pos=-1):
+    """Helper function to build an aligned segment."""
+
+    segment = pysam.AlignedSegment()
+    segment.query_name = name
+    segment.flag = flag
+    segment.reference_id = ref_id
+    segment.reference_start = pos
+    segment.cigarstring = cigar
+    segment.query_sequence = 'A' * segment.infer_query_length()
+    segment.mapping_quality = 255
+    segment.next_reference_id = next_ref_id
+    segment.next_reference_start = next_pos
+    segment.set_tags(tags)
+    return segment
+
+
+def _write_bam(tmpdir, segments):
+    """Helper function to write a sorted and indexed example alignment."""
+
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+              'SQ': [{'SN': '16', 'LN': 100000000},
+                     {'SN': 'T2onc', 'LN': 5000}]}  # yapf: disable
+
+    unsorted_path = native_str(tmpdir / 'unsorted.bam')
+    with pysam.AlignmentFile(unsorted_path, 'wb', header=header) as bam:
+        for segment in segments:
+            bam.write(segment)
+
+    bam_path = native_str(tmpdir / 'alignment.bam')
+    pysam.sort('-o', bam_path, unsorted_path)
+    pysam.index(bam_path)
+
+    return Path(bam_path)
+
+
+@pytest.fixture
+def chimeric_bam_path(tmpdir):
+    """Example alignment containing WithinBAM chimeric alignments."""
+
+    segments = [
+        # Split read, primary alignment on transposon.
+        _segment('R1', 1, 1508, '32M68S', 0,
+                 [('SA', '16,52141027,-,68M32S,255,0;')]),
+        _segment('R1', 0, 52141026, '68M32H', 2048 + 16,
+                 [('SA', 'T2onc,1509,+,32M68S,255,0;')]),
+        # Split read, primary alignment on genome.
+        _segment('R2', 0, 52141026, '68M32S', 16,
+                 [('SA', 'T2onc,1509,+,32M68H,255,0;')]),
+        _segment('R2', 1, 1508, '32M68H', 2048,
+                 [('SA', '16,52141027,-,68M32S,255,0;')]),
+        # Spanning mate pair.
+        _segment('P1', 1, 1400, '100M', 1 + 32 + 64, [('MC', '100M')],
+                 next_ref_id=0, next_pos=52141200),
+        _segment('P1', 0, 52141200, '100M', 1 + 16 + 128, [('MC', '100M')],
+                 next_ref_id=1, next_pos=1400)
+    ]
+
+    return _write_bam(tmpdir, segments)
+
+
+@pytest.fixture
+def paired_chimeric_bam_path(tmpdir):
+    """Example alignment of a fragment with a split mate."""
+
+    segments = [
+        # First mate split between genome and transposon.
+        _segment('F1', 0, 52141026, '68M32S', 1 + 16 + 64,
+                 [('SA', 'T2onc,1509,+,32M68H,255,0;'), ('MC', '100M')],
+                 next_ref_id=1, next_pos=1700),
+        _segment('F1', 1, 1508, '32M68H', 2048 + 1 + 64,
+                 [('SA', '16,52141027,-,68M32S,255,0;'), ('MC', '100M')],
+                 next_ref_id=1, next_pos=1700),
+        # Second mate fully on the transposon.
+        _segment('F1', 1, 1700, '100M', 1 + 32 + 128,
+                 [('MC', '68M32S')],
+                 next_ref_id=0, next_pos=52141026)
+    ]
+
+    return _write_bam(tmpdir, segments)
+
+
+class TestReadChimericBam(object):
+    """Tests for read_chimeric_bam."""
+
+    def test_example(self, chimeric_bam_path):
+        """Tests split reads and spanning mates."""
+
+        df = star.read_chimeric_bam(chimeric_bam_path, 'T2onc')
+        df = df.sort_values('read_name').set_index('read_name')
+
+        assert list(df.index) == ['P1', 'R1', 'R2']
+
+        for read_name in ['R1', 'R2']:
+            row = df.loc[read_name]
+            assert row.seqname_a == 'T2onc'
+            assert row.location_a == 1541
+            assert row.strand_a == 1
+            assert row.seqname_b == '16'
+            assert row.location_b == 52141095
+            assert row.strand_b == -1
+            assert row.junction_type >= 0
+
+        spanning = df.loc['P1']
+        assert spanning.seqname_a == 'T2onc'
+        assert spanning.location_a == 1501
+        assert spanning.strand_a == 1
+        assert spanning.seqname_b == '16'
+        assert spanning.location_b == 52141200
+        assert spanning.strand_b == 1
+        assert spanning.junction_type == -1
+
+    def test_fusions(self, chimeric_bam_path):
+        """Tests extraction of fusions from WithinBAM alignments."""
+
+        df = star.read_chimeric_bam(chimeric_bam_path, 'T2onc')
+        fusions = list(star.extract_transposon_fusions(df, 'T2onc'))
+
+        assert len(fusions) == 2
+
+        junction = [fus for fus in fusions if fus.support_junction > 0][0]
+        assert junction.seqname == '16'
+        assert junction.anchor_genome == 52141095
+        assert junction.anchor_transposon == 1541
+        assert junction.support_junction == 2
+
+    def test_paired_split(self, paired_chimeric_bam_path):
+        """Tests fragment with split mate is only counted once."""
+
+        df = star.read_chimeric_bam(paired_chimeric_bam_path, 'T2onc')
+
+        assert list(df['read_name']) == ['F1']
+        assert df.iloc[0].junction_type >= 0
+
+        fusions = list(star.extract_transposon_fusions(df, 'T2onc'))
+
+        assert len(fusions) == 1
+        assert fusions[0].support_junction == 1
+        assert fusions[0].support_spanning == 0
+
 
 @pytest.fixture
 def chimeric_data():
@@ -155,17 +369,59 @@ class TestExtractJunctionFusions(object):
         ]
 
 
+class TestAssignSpanningReads(object):
+    """Tests for assign_spanning_reads."""
+
+    def test_closest(self):
+        """Tests assignment of reads to the closest junction."""
+
+        junctions = [
+            Fusion('1', 300, 1, 'T2onc', 420, 1, 52, 62, 4, 0),
+            Fusion('1', 350, 1, 'T2onc', 420, 1, 52, 62, 2, 0),
+            Fusion('1', 350, -1, 'T2onc', 420, 1, 52, 62, 2, 0)
+        ]
+
+        chimeric_data = _build_chimeric_data(
+            [('1', 280, 1, 'T2onc', 435, 1, -1, '100M', '97M3S', 'S1'),
+             ('1', 340, 1, 'T2onc', 435, 1, -1, '100M', '98M2S', 'S2'),
+             ('1', 325, 1, 'T2onc', 435, 1, -1, '100M', '98M2S', 'S3'),
+             ('1', 500, 1, 'T2onc', 435, 1, -1, '100M', '98M2S', 'S4')])
+
+        assigned, unassigned = star.assign_spanning_reads(
+            junctions, chimeric_data, max_dist_left=300, max_dist_right=300)
+
+        assert [junc.support_spanning for junc in assigned] == [1, 2, 0]
+        assert list(unassigned['read_name']) == ['S4']
+
+
+class TestFlankSizes(object):
+    """Tests for _flank_sizes."""
+
+    def test_example(self):
+        """Tests flank sizes for different strands and mate pairs."""
+
+        chimeric_data = pd.DataFrame({
+            'first_segment_cigar': ['10S', '5M2p3M', '1M1M', '5M2p3M'],
+            'second_segment_cigar': ['3M', '4S', '2M-3p7M', '2M-3p7M'],
+            'strand_a': [1, -1, 1, 1],
+            'strand_b': [1, 1, -1, 1]
+        })
+
+        flank_a, flank_b = star._flank_sizes(chimeric_data)
+
+        assert list(flank_a) == [0, 5, 2, 3]
+        assert list(flank_b) == [3, 0, 7, 2]
+
+
 class TestExtractSpanningFusions(object):
     """Tests for extract_spanning_fusions."""
 
     def test_example(self, chimeric_data):
         """Test simple example."""
 
-        fusions = list(
-            star.extract_spanning_fusions(
-                chimeric_data, max_dist=300))
+        fusions = star.extract_spanning_fusions(chimeric_data, max_dist=300)
 
-        assert fusions == [
+        assert list(Fusion.from_frame(fusions)) == [
             Fusion(
                 seqname_a='1',
                 location_a=280,
@@ -179,6 +435,24 @@ class TestExtractSpanningFusions(object):
                 support_spanning=3)
         ]
 
+    def test_multiple_clusters(self, chimeric_data):
+        """Tests example with distant reads in separate clusters."""
+
+        fusions = star.extract_spanning_fusions(chimeric_data, max_dist=7)
+
+        assert list(fusions['location_a']) == [280, 270]
+        assert list(fusions['location_b']) == [435, 445]
+        assert list(fusions['support_spanning']) == [2, 1]
+
+    def test_empty(self, chimeric_data):
+        """Tests example without spanning reads."""
+
+        chimeric_data = chimeric_data.query('junction_type >= 0')
+        fusions = star.extract_spanning_fusions(chimeric_data, max_dist=300)
+
+        assert len(fusions) == 0
+        assert list(fusions.columns) == list(Fusion._fields)
+
 
 @pytest.fixture
 def read_paths():
@@ -271,7 +545,8 @@ class TestStarAligner(object):
                 '--runThreadN': (1, ),
                 '--chimSegmentMin': (12, ),
                 '--outSAMstrandField': ('intronMotif', )
-            })
+            },
+            decompress_command=['gunzip', '-c'])
 
         # Check result, including specific Cblb insertion.
         assert len(ins) == 5
@@ -294,6 +569,422 @@ class TestStarAligner(object):
         assert ins[2].metadata['ffpm_spanning'] == 59.0
         assert ins[2].metadata['ffpm'] == 249.0
 
+    def test_identify_insertions_shared(self, read_paths, star_reference,
+                                        star_output_dir, mocker):
+        """Tests alignment arguments when sharing the genome."""
+
+        star_mock = mocker.patch.object(star, 'star_align')
+        sort_mock = mocker.patch.object(star, 'sort_bam')
+        mocker.patch.object(star.util, 'count_lines', return_value=8e6)
+        mocker.patch.object(star.pysam, 'index')
+
+        # Simulate unsorted STAR output.
+        pytest.helpers.touch(star_output_dir / '_star' / 'Aligned.out.bam')
+
+        fastq, fastq2 = read_paths
+
+        aligner = star.StarAligner(star_reference, shared_genome=True)
+        list(
+            aligner.identify_insertions(
+                fastq, star_output_dir, fastq2_path=fastq2))
+
+        star_mock.assert_called_once_with(
+            fastq_path=fastq,
+            fastq2_path=fastq2,
+            output_dir=star_output_dir / '_star',
+            index_path=star_reference.index_path,
+            extra_args={
+                '--twopassMode': ('None', ),
+                '--genomeLoad': ('LoadAndKeep', ),
+                '--outReadsUnmapped': ('None', ),
+                '--outSAMtype': ('BAM', 'Unsorted'),
+                '--runThreadN': (1, ),
+                '--chimSegmentMin': (12, ),
+                '--outSAMstrandField': ('intronMotif', )
+            },
+            decompress_command=['gunzip', '-c'])
+
+        assert sort_mock.call_count == 1
+        assert sort_mock.call_args[1]['index']
+
+    def test_identify_insertions_stale_index(self, read_paths, star_reference,
+                                             star_output_dir, mocker):
+        """Tests index of a previous alignment is not re-used."""
+
+        mocker.patch.object(star, 'star_align')
+        mocker.patch.object(star.util, 'count_lines', return_value=8e6)
+        index_mock = mocker.patch.object(star, 'index_bam')
+
+        # Simulate index from a previous (incomplete) alignment.
+        index_path = (star_output_dir / '_star' /
+                      'Aligned.sortedByCoord.out.bam.bai')
+        pytest.helpers.touch(index_path)
+
+        fastq, fastq2 = read_paths
+
+        aligner = star.StarAligner(star_reference)
+        list(
+            aligner.identify_insertions(
+                fastq, star_output_dir, fastq2_path=fastq2))
+
+        index_mock.assert_called_once_with(
+            star_output_dir / '_star' / 'Aligned.sortedByCoord.out.bam',
+            threads=1)
+        assert not index_path.exists()
+
+    def test_identify_insertions_post_alignment(
+            self, read_paths, star_reference, star_output_dir, mocker):
+        """Tests running assembly and STAR-Fusion after alignment."""
+
+        mocker.patch.object(star, 'star_align')
+        mocker.patch.object(star.util, 'count_lines', return_value=8e6)
+        mocker.patch.object(star.pysam, 'index')
+
+        assemble_mock = mocker.patch.object(
+            star.StarAligner, '_assemble_transcripts', return_value=None)
+        fusion_mock = mocker.patch.object(star, 'star_fusion')
+        mocker.patch.object(star.path, 'symlink_relative')
+
+        fastq, fastq2 = read_paths
+
+        aligner = star.StarAligner(
+            star_reference,
+            assemble=True,
+            star_fusion_ref_path=Path('/path/to/star_fusion'))
+        ins = list(
+            aligner.identify_insertions(
+                fastq, star_output_dir, fastq2_path=fastq2))
+
+        assert len(ins) == 5
+
+        assemble_mock.assert_called_once_with(
+            star_output_dir / 'alignment.bam', star_output_dir, mocker.ANY)
+
+        fusion_mock.assert_called_once_with(
+            star_output_dir / '_star' / 'Chimeric.out.junction',
+            Path('/path/to/star_fusion'),
+            output_dir=star_output_dir / '_star_fusion')
+
+    def test_targeted_assembly(self, star_reference, mocker, tmpdir):
+        """Tests targeted assembly of unannotated fusion regions."""
+
+        stringtie_mock = mocker.patch.object(
+            aligner_base,
+            'stringtie_assemble',
+            side_effect=lambda *args, **kws: kws['output_path'].touch())
+        subset_mock = mocker.patch.object(star.util, 'subset_alignment')
+        mocker.patch.object(aligner_base.tabix, 'index_gtf')
+
+        fusion = TransposonFusion(
+            seqname='16',
+            anchor_genome=52141095,
+            anchor_transposon=1541,
+            strand_genome=-1,
+            strand_transposon=1,
+            flank_genome=-78,
+            flank_transposon=-76,
+            support_junction=380,
+            support_spanning=118,
+            metadata=frozendict({}))
+
+        output_dir = Path(native_str(tmpdir))
+        alignment_path = output_dir / 'alignment.bam'
+
+        aligner = star.StarAligner(
+            star_reference,
+            assemble=True,
+            assemble_targeted=True,
+            assemble_padding=100)
+        manifest = StageManifest.for_sample(output_dir)
+        assemble = aligner._start_assembly(None, alignment_path, output_dir,
+                                           manifest)
+
+        # No assembly without unannotated fusions.
+        annotated = fusion._replace(
+            metadata=frozendict({'gene_id': 'ENSMUSG00000022637'}))
+        assert assemble([annotated]) is None
+        assert not stringtie_mock.called
+
+        # Assembly restricted to padded region.
+        assembled_path = assemble([fusion])
+        assert assembled_path == output_dir / 'assembled.targeted.gtf.gz'
+
+        region_bam_path = output_dir / '_assembly' / 'regions.bam'
+        subset_mock.assert_called_once_with(
+            alignment_path, [('16', 52140917, 52141195)],
+            output_path=region_bam_path)
+
+        assert stringtie_mock.call_args[0][0] == region_bam_path
+
+    def test_identify_insertions_no_alignment(
+            self, read_paths, star_reference, star_output_dir, mocker):
+        """Tests identifying insertions without writing the alignment."""
+
+        star_mock = mocker.patch.object(star, 'star_align')
+        index_mock = mocker.patch.object(star.pysam, 'index')
+        mocker.patch.object(star.util, 'count_lines', return_value=8e6)
+
+        fastq, fastq2 = read_paths
+
+        aligner = star.StarAligner(star_reference, write_alignment=False)
+        ins = list(
+            aligner.identify_insertions(
+                fastq, star_output_dir, fastq2_path=fastq2))
+
+        assert star_mock.call_count == 1
+        assert not index_mock.called
+        assert not (star_output_dir / 'alignment.bam').exists()
+        assert len(ins) == 5
+
+        # Completed junctions should be re-used.
+        list(
+            aligner.identify_insertions(
+                fastq, star_output_dir, fastq2_path=fastq2))
+        assert star_mock.call_count == 1
+
+        # Alignment should be redone if parameters change.
+        aligner = star.StarAligner(
+            star_reference, write_alignment=False, min_flank=20)
+        list(
+            aligner.identify_insertions(
+                fastq, star_output_dir, fastq2_path=fastq2))
+        assert star_mock.call_count == 2
+
+    def test_align_no_alignment(self, read_paths, star_reference, mocker,
+                                tmpdir):
+        """Tests STAR arguments when not writing the alignment."""
+
+        star_mock = mocker.patch.object(star, 'star_align')
+        sort_mock = mocker.patch.object(star, 'sort_bam')
+
+        fastq, fastq2 = read_paths
+        output_dir = Path(native_str(tmpdir))
+
+        aligner = star.StarAligner(
+            star_reference, write_alignment=False, external_sort=True)
+        aligner._align(fastq, output_dir, fastq2_path=fastq2)
+
+        extra_args = star_mock.call_args[1]['extra_args']
+        assert extra_args['--outSAMtype'] == ('None', )
+        assert not sort_mock.called
+
+    def test_identify_insertions_prefilter(self, read_paths, star_reference,
+                                           tmpdir, mocker):
+        """Tests alignment of pre-filtered reads."""
+
+        align_mock = mocker.patch.object(star.StarAligner, '_align')
+        filter_mock = mocker.patch.object(
+            star.prefilter, 'prefilter_fastq', return_value=10)
+        mocker.patch.object(
+            star, 'extract_transposon_fusions', return_value=[])
+        mocker.patch.object(star.util, 'count_lines', return_value=8e6)
+
+        output_dir = Path(native_str(tmpdir))
+        fastq, fastq2 = read_paths
+
+        aligner = star.StarAligner(star_reference, prefilter=True)
+        assert not aligner._write_alignment
+
+        # Fake junction output.
+        def _align(output_dir, **_):
+            output_dir.mkdir(parents=True)
+            pytest.helpers.touch(output_dir / 'Chimeric.out.junction')
+
+        align_mock.side_effect = _align
+
+        list(aligner.identify_insertions(fastq, output_dir, fastq2))
+
+        assert filter_mock.call_args[1]['k'] == 12
+        align_mock.assert_called_once_with(
+            fastq_path=output_dir / '_prefilter' / 'reads.R1.fastq.gz',
+            output_dir=output_dir / '_star',
+            fastq2_path=output_dir / '_prefilter' / 'reads.R2.fastq.gz')
+
+    def test_align_within_bam(self, read_paths, star_reference, mocker,
+                              tmpdir):
+        """Tests STAR arguments for WithinBAM chimeric output."""
+
+        star_mock = mocker.patch.object(star, 'star_align')
+
+        fastq, fastq2 = read_paths
+
+        aligner = star.StarAligner(
+            star_reference, chimeric_output='WithinBAM')
+        aligner._align(fastq, Path(native_str(tmpdir)), fastq2_path=fastq2)
+
+        extra_args = star_mock.call_args[1]['extra_args']
+        assert extra_args['--chimOutType'] == ('WithinBAM', )
+
+        with pytest.raises(ValueError):
+            star.StarAligner(
+                star_reference,
+                chimeric_output='WithinBAM',
+                write_alignment=False)
+
+    def test_align_single_pass(self, read_paths, star_reference, mocker,
+                               tmpdir):
+        """Tests STAR arguments for single-pass alignment."""
+
+        star_mock = mocker.patch.object(star, 'star_align')
+
+        fastq, fastq2 = read_paths
+
+        aligner = star.StarAligner(star_reference, two_pass=False)
+        aligner._align(fastq, Path(native_str(tmpdir)), fastq2_path=fastq2)
+
+        extra_args = star_mock.call_args[1]['extra_args']
+        assert extra_args['--twopassMode'] == ('None', )
+
+    def test_align_scratch(self, read_paths, star_reference, mocker,
+                           tmpdir):
+        """Tests alignment in a scratch directory."""
+
+        # Fake STAR and sorting outputs.
+        def _star_align(output_dir, **_):
+            for file_name in ['Aligned.out.bam', 'Chimeric.out.junction',
+                              'SJ.out.tab', 'Log.final.out']:
+                pytest.helpers.touch(output_dir / file_name)
+
+        def _sort_bam(input_bam, output_bam, **_):
+            pytest.helpers.touch(output_bam)
+            pytest.helpers.touch(output_bam.with_suffix('.bam.bai'))
+
+        star_mock = mocker.patch.object(
+            star, 'star_align', side_effect=_star_align)
+        sort_mock = mocker.patch.object(
+            star, 'sort_bam', side_effect=_sort_bam)
+
+        fastq, fastq2 = read_paths
+        output_dir = Path(native_str(tmpdir / 'out'))
+        scratch_dir = Path(native_str(tmpdir / 'scratch'))
+
+        aligner = star.StarAligner(
+            star_reference, external_sort=True, scratch_dir=scratch_dir)
+        aligner._align(fastq, output_dir, fastq2_path=fastq2)
+
+        # Check STAR and sorting were run in the scratch directory.
+        star_dir = star_mock.call_args[1]['output_dir']
+        assert star_dir.parent == scratch_dir
+        assert sort_mock.call_args[1]['tmp_dir'] == star_dir / '_sort'
+
+        # Check final outputs were moved and intermediates removed.
+        assert sorted(fp.name for fp in output_dir.iterdir()) == [
+            'Aligned.sortedByCoord.out.bam',
+            'Aligned.sortedByCoord.out.bam.bai', 'Chimeric.out.junction',
+            'Log.final.out', 'SJ.out.tab'
+        ]
+        assert list(scratch_dir.iterdir()) == []
+
+    def test_align_scratch_failure(self, read_paths, star_reference, mocker,
+                                   tmpdir):
+        """Tests cleanup of the scratch directory if alignment fails."""
+
+        def _star_align(output_dir, **_):
+            pytest.helpers.touch(output_dir / 'Chimeric.out.junction')
+            raise ValueError('STAR failed')
+
+        mocker.patch.object(star, 'star_align', side_effect=_star_align)
+
+        fastq, fastq2 = read_paths
+        output_dir = Path(native_str(tmpdir / 'out'))
+        scratch_dir = Path(native_str(tmpdir / 'scratch'))
+
+        aligner = star.StarAligner(star_reference, scratch_dir=scratch_dir)
+
+        with pytest.raises(ValueError):
+            aligner._align(fastq, output_dir, fastq2_path=fastq2)
+
+        assert not output_dir.exists()
+        assert list(scratch_dir.iterdir()) == []
+
+    def test_no_alignment_assemble(self, star_reference):
+        """Tests assembly is not allowed without alignment."""
+
+        with pytest.raises(ValueError):
+            star.StarAligner(
+                star_reference, assemble=True, write_alignment=False)
+
+    def test_batch(self, star_reference, mocker, tmpdir):
+        """Tests loading/removing of shared genome for batches."""
+
+        load_mock = mocker.patch.object(star, 'star_load_genome')
+
+        output_dir = Path(native_str(tmpdir))
+        aligner = star.StarAligner(star_reference, shared_genome=True)
+
+        with aligner.batch(output_dir):
+            load_mock.assert_called_once_with(
+                star_reference.index_path,
+                output_dir=output_dir / '_star_genome')
+
+        load_mock.assert_called_with(
+            star_reference.index_path,
+            output_dir=output_dir / '_star_genome',
+            remove=True)
+
+    def test_from_args_batch(self, tmpdir):
+        """Tests creation with batch arguments."""
+
+        parser = argparse.ArgumentParser()
+        star.StarAligner.configure_args(parser, batch=True)
+
+        args = parser.parse_args([
+            '--sample_sheet', 'samples.txt', '--reference',
+            native_str(tmpdir), '--output_dir', '/path/to/out'
+        ])
+        aligner = star.StarAligner.from_args(args)
+
+        assert args.sample_sheet == Path('samples.txt')
+        assert not aligner._shared_genome
+        assert aligner._two_pass
+
+    def test_from_args_batch_junctions(self, tmpdir):
+        """Tests batch default if the reference includes junctions."""
+
+        tmpdir.join('junctions.txt').write('')
+
+        parser = argparse.ArgumentParser()
+        star.StarAligner.configure_args(parser, batch=True)
+
+        args = parser.parse_args([
+            '--sample_sheet', 'samples.txt', '--reference',
+            native_str(tmpdir), '--output_dir', '/path/to/out'
+        ])
+        aligner = star.StarAligner.from_args(args)
+
+        assert aligner._shared_genome
+
+    def test_from_args_batch_override(self, tmpdir):
+        """Tests explicitly sharing/not sharing the genome in batch mode."""
+
+        tmpdir.join('junctions.txt').write('')
+
+        parser = argparse.ArgumentParser()
+        star.StarAligner.configure_args(parser, batch=True)
+
+        base_args = [
+            '--sample_sheet', 'samples.txt', '--reference',
+            native_str(tmpdir), '--output_dir', '/path/to/out'
+        ]
+
+        args = parser.parse_args(base_args + ['--star_no_shared_genome'])
+        assert not star.StarAligner.from_args(args)._shared_genome
+
+        tmpdir.join('junctions.txt').remove()
+
+        args = parser.parse_args(base_args + ['--star_shared_genome'])
+        assert star.StarAligner.from_args(args)._shared_genome
+
+    def test_shared_two_pass_warning(self, star_reference, caplog):
+        """Tests that disabling two-pass alignment is logged."""
+
+        star.StarAligner(star_reference, shared_genome=True)
+        assert 'Two-pass alignment is not supported' in caplog.text
+
+        caplog.clear()
+        star.StarAligner(star_reference, shared_genome=True, two_pass=False)
+        assert 'Two-pass alignment is not supported' not in caplog.text
+
     def test_from_args_basic(self, cmdline_args):
         """Tests creation with minimal arguments."""
 
@@ -306,8 +997,8 @@ class TestStarAligner(object):
         aligner = star.StarAligner.from_args(args)
 
         # Check args.
-        assert args.fastq == Path('a.fastq.gz')
-        assert args.fastq2 == Path('b.fastq.gz')
+        assert args.fastq == [Path('a.fastq.gz')]
+        assert args.fastq2 == [Path('b.fastq.gz')]
         assert args.output_dir == Path('/path/to/out')
 
         # Check aligner.
@@ -323,17 +1014,26 @@ class TestStarAligner(object):
         assert aligner._filter_features
         assert aligner._filter_orientation
         assert aligner._filter_blacklist is None
+        assert not aligner._shared_genome
+        assert aligner._write_alignment
+        assert aligner._two_pass
+        assert aligner._sort_memory is None
+        assert aligner._decompress_command == ['gunzip', '-c']
+        assert aligner._scratch_dir is None
 
     def test_from_args_extra_args(self, cmdline_args):
         """Tests creation with extra options."""
 
         cmdline_args += [
             '--star_threads', '5', '--star_min_flank', '20',
-            '--star_external_sort', '--star_args', "--limitBAMsortRAM 2000",
+            '--star_external_sort', '--star_sort_memory', '2G',
+            '--star_args', "--limitBAMsortRAM 2000",
             '--merge_junction_dist', '20', '--max_spanning_dist', '600',
             '--max_junction_dist', '50000', '--assemble',
             '--no_filter_orientation', '--no_filter_feature',
-            '--blacklisted_genes', 'En2'
+            '--blacklisted_genes', 'En2', '--star_no_two_pass',
+            '--star_decompress_command', 'pigz -dc -p 5',
+            '--scratch_dir', '/scratch'
         ] # yapf:disable
 
         # Setup parser.
@@ -345,8 +1045,8 @@ class TestStarAligner(object):
         aligner = star.StarAligner.from_args(args)
 
         # Check args.
-        assert args.fastq == Path('a.fastq.gz')
-        assert args.fastq2 == Path('b.fastq.gz')
+        assert args.fastq == [Path('a.fastq.gz')]
+        assert args.fastq2 == [Path('b.fastq.gz')]
         assert args.output_dir == Path('/path/to/out')
 
         # Check aligner.
@@ -355,6 +1055,7 @@ class TestStarAligner(object):
         assert aligner._min_flank == 20
         assert aligner._threads == 5
         assert aligner._external_sort
+        assert aligner._sort_memory == '2G'
         assert aligner._extra_args == {'--limitBAMsortRAM': ('2000', )}
         assert aligner._merge_junction_dist == 20
         assert aligner._max_spanning_dist == 600
@@ -362,3 +1063,6 @@ class TestStarAligner(object):
         assert not aligner._filter_features
         assert not aligner._filter_orientation
         assert aligner._filter_blacklist == ['En2']
+        assert not aligner._two_pass
+        assert aligner._decompress_command == ['pigz', '-dc', '-p', '5']
+        assert aligner._scratch_dir == Path('/scratch')
@@ -92,7 +92,7 @@ class TestTophatAligner(object):
         tophat_mock = mocker.patch.object(tophat, 'tophat2_align')
         mocker.patch.object(tophat.util, 'count_lines', return_value=8e6)
 
-        mocker.patch.object(tophat.pysam, 'index')
+        mocker.patch.object(tophat, 'index_bam')
 
         # Call identify insertions.
         fastq, fastq2 = read_paths
@@ -151,8 +151,8 @@ class TestTophatAligner(object):
         aligner = tophat.TophatAligner.from_args(args)
 
         # Check args.
-        assert args.fastq == Path('a.fastq.gz')
-        assert args.fastq2 == Path('b.fastq.gz')
+        assert args.fastq == [Path('a.fastq.gz')]
+        assert args.fastq2 == [Path('b.fastq.gz')]
         assert args.output_dir == Path('/path/to/out')
 
         # Check aligner.
@@ -185,8 +185,8 @@ class TestTophatAligner(object):
         aligner = tophat.TophatAligner.from_args(args)
 
         # Check args.
-        assert args.fastq == Path('a.fastq.gz')
-        assert args.fastq2 == Path('b.fastq.gz')
+        assert args.fastq == [Path('a.fastq.gz')]
+        assert args.fastq2 == [Path('b.fastq.gz')]
         assert args.output_dir == Path('/path/to/out')
 
         # Check aligner.
@@ -199,3 +199,76 @@ class TestTophatAligner(object):
         assert not aligner._filter_features
         assert not aligner._filter_orientation
         assert aligner._filter_blacklist == ['En2']
+
+
+class TestReadFusionOut(object):
+    """Tests for the read_fusion_out function."""
+
+    def test_example(self, tophat_path):
+        """Tests reading of example file."""
+
+        fusions = tophat.read_fusion_out(tophat_path)
+
+        assert list(fusions.columns) == [
+            'seqname_a', 'location_a', 'strand_a', 'seqname_b', 'location_b',
+            'strand_b', 'supp_reads', 'supp_mates', 'supp_spanning_mates',
+            'contradicting_reads', 'flank_a', 'flank_b'
+        ]
+
+        assert set(fusions['strand_a']) <= {1, -1}
+        assert set(fusions['strand_b']) <= {1, -1}
+        assert not any(fusions['seqname_a'].str.contains('-'))
+
+
+class TestTransposonFusionFrame(object):
+    """Tests for the transposon_fusion_frame function."""
+
+    def test_example(self, tophat_path):
+        """Tests conversion of example fusions."""
+
+        fusion_data = tophat.read_fusion_out(tophat_path)
+        frame = tophat.transposon_fusion_frame(fusion_data, 'T2onc')
+
+        assert len(frame) == 7
+        assert list(frame.columns) == tophat.TransposonFusion._get_columns()
+        assert not any(frame['seqname'] == 'T2onc')
+
+    def test_swapped(self, tophat_path):
+        """Tests that fusion sides are handled symmetrically."""
+
+        fusion_data = tophat.read_fusion_out(tophat_path)
+
+        swapped = fusion_data.rename(columns={
+            'seqname_a': 'seqname_b', 'seqname_b': 'seqname_a',
+            'location_a': 'location_b', 'location_b': 'location_a',
+            'strand_a': 'strand_b', 'strand_b': 'strand_a',
+            'flank_a': 'flank_b', 'flank_b': 'flank_a'
+        })  # yapf: disable
+
+        frame = tophat.transposon_fusion_frame(fusion_data, 'T2onc')
+        swapped_frame = tophat.transposon_fusion_frame(swapped, 'T2onc')
+
+        assert list(frame['seqname']) == list(swapped_frame['seqname'])
+        assert list(frame['anchor_genome']) == list(
+            swapped_frame['anchor_genome'])
+        assert list(frame['strand_genome']) == list(
+            swapped_frame['strand_genome'])
+
+        # Flank signs depend on the side of the fusion.
+        assert list(frame['flank_genome']) == list(
+            -swapped_frame['flank_genome'])
+        assert list(frame['flank_transposon']) == list(
+            -swapped_frame['flank_transposon'])
+
+    def test_unpaired(self, tophat_path):
+        """Tests support for single-end data."""
+
+        fusion_data = tophat.read_fusion_out(tophat_path)
+        fusion_data['supp_mates'] = 0
+        fusion_data['supp_spanning_mates'] = 0
+
+        frame = tophat.transposon_fusion_frame(fusion_data, 'T2onc')
+
+        assert all(frame['support_spanning'] == 0)
+        assert list(frame['support_junction']) == list(
+            fusion_data.loc[frame.index, 'supp_reads'])
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""Tests for imfusion.insertions.batch module."""
+
+# pylint: disable=wildcard-import,redefined-builtin,unused-wildcard-import
+from __future__ import absolute_import, division, print_function
+from builtins import *
+# pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
+
+import logging
+import threading
+
+from future.utils import native_str
+from pathlib2 import Path
+import pandas as pd
+import pytest
+
+from imfusion.insertions import batch
+from imfusion.insertions.aligners import Aligner
+from imfusion.util import log
+
+# pylint: disable=no-self-use,redefined-outer-name
+
+
+@pytest.fixture
+def sample_sheet(tmpdir):
+    """Example sample sheet."""
+
+    sheet_path = Path(native_str(tmpdir)) / 'samples.txt'
+
+    with sheet_path.open('w') as file_:
+        file_.write('sample\tfastq\tfastq2\n')
+        file_.write('s1\ts1.R1.fastq.gz\ts1.R2.fastq.gz\n')
+        file_.write('s2\t/data/s2.R1.fastq.gz\t\n')
+        file_.write('s3\ts3.L1.R1.fastq.gz,s3.L2.R1.fastq.gz\t'
+                    's3.L1.R2.fastq.gz,s3.L2.R2.fastq.gz\n')
+
+    return sheet_path
+
+
+class TestReadSampleSheet(object):
+    """Tests for the read_sample_sheet function."""
+
+    def test_example(self, sample_sheet):
+        """Tests example sample sheet."""
+
+        samples = batch.read_sample_sheet(sample_sheet)
+
+        assert samples == [
+            batch.Sample(
+                name='s1',
+                fastq_path=[sample_sheet.parent / 's1.R1.fastq.gz'],
+                fastq2_path=[sample_sheet.parent / 's1.R2.fastq.gz']),
+            batch.Sample(
+                name='s2',
+                fastq_path=[Path('/data/s2.R1.fastq.gz')],
+                fastq2_path=None),
+            batch.Sample(
+                name='s3',
+                fastq_path=[
+                    sample_sheet.parent / 's3.L1.R1.fastq.gz',
+                    sample_sheet.parent / 's3.L2.R1.fastq.gz'
+                ],
+                fastq2_path=[
+                    sample_sheet.parent / 's3.L1.R2.fastq.gz',
+                    sample_sheet.parent / 's3.L2.R2.fastq.gz'
+                ])
+        ]
+
+    def test_missing_column(self, tmpdir):
+        """Tests sample sheet without fastq column."""
+
+        sheet_path = Path(native_str(tmpdir)) / 'samples.txt'
+
+        with sheet_path.open('w') as file_:
+            file_.write('sample\tfastq2\n')
+            file_.write('s1\ts1.R2.fastq.gz\n')
+
+        with pytest.raises(ValueError):
+            batch.read_sample_sheet(sheet_path)
+
+
+class DummyAligner(Aligner):
+    """Dummy aligner, used to test batch processing."""
+
+    def __init__(self, threads=1, shared_memory=0, fail=None):
+        super().__init__(reference=None)
+        self._threads = threads
+        self._shared_memory = shared_memory
+        self._fail = fail or set()
+        self.in_batch = False
+        self.samples = []
+
+    @property
+    def threads(self):
+        return self._threads
+
+    @property
+    def shared_memory(self):
+        return self._shared_memory
+
+    def batch(self, output_dir):
+        return _BatchContext(self)
+
+    def identify_insertions(self, fastq_path, output_dir, fastq2_path=None):
+        assert self.in_batch
+        self.samples.append(fastq_path)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        with self._stage('alignment', heavy=True):
+            if output_dir.name in self._fail:
+                raise ValueError('Alignment failed')
+
+        # Log from a separate thread, as done for assembly.
+        with self._stage('annotation'):
+            pool = log.thread_pool(1)
+
+            try:
+                pool.apply(logging.info, ('Annotating %s', output_dir.name))
+            finally:
+                pool.close()
+                pool.join()
+
+        return iter([])
+
+
+class _BatchContext(object):
+    def __init__(self, aligner):
+        self._aligner = aligner
+
+    def __enter__(self):
+        self._aligner.in_batch = True
+
+    def __exit__(self, *args):
+        self._aligner.in_batch = False
+
+
+class TestIdentifyInsertionsBatch(object):
+    """Tests for the identify_insertions_batch function."""
+
+    def test_example(self, sample_sheet, tmpdir):
+        """Tests processing of example samples."""
+
+        samples = batch.read_sample_sheet(sample_sheet)
+        output_dir = Path(native_str(tmpdir)) / 'out'
+
+        aligner = DummyAligner()
+        batch.identify_insertions_batch(
+            aligner, samples, output_dir=output_dir, max_threads=2)
+
+        assert not aligner.in_batch
+        assert sorted(aligner.samples) == sorted(s.fastq_path for s in samples)
+
+        for sample in samples:
+            insertion_path = output_dir / sample.name / 'insertions.txt'
+            assert len(pd.read_csv(str(insertion_path), sep='\t')) == 0
+
+    def test_failure(self, sample_sheet, tmpdir):
+        """Tests failing samples are logged and summarized."""
+
+        samples = batch.read_sample_sheet(sample_sheet)
+        output_dir = Path(native_str(tmpdir)) / 'out'
+
+        aligner = DummyAligner(fail={'s2'})
+        failed = batch.identify_insertions_batch(
+            aligner, samples, output_dir=output_dir, max_threads=2)
+
+        assert failed == ['s2']
+
+        # Other samples should still be processed.
+        assert (output_dir / 's1' / 'insertions.txt').exists()
+        assert not (output_dir / 's2' / 'insertions.txt').exists()
+        assert (output_dir / 's3' / 'insertions.txt').exists()
+
+        summary = pd.read_csv(
+            str(output_dir / 'summary.txt'), sep='\t').fillna('')
+        assert list(summary['sample']) == ['s1', 's2', 's3']
+        assert list(summary['status']) == ['completed', 'failed', 'completed']
+        assert list(summary['error']) == ['', 'Alignment failed', '']
+
+        # Check per-sample logs.
+        with (output_dir / 's2' / 'imfusion.log').open() as file_:
+            log_text = file_.read()
+
+        assert 'Alignment failed' in log_text
+        assert 'Processing sample s1' not in log_text
+
+    def test_sample_log(self, sample_sheet, tmpdir, caplog):
+        """Tests messages logged from sample threads reach the sample log."""
+
+        samples = batch.read_sample_sheet(sample_sheet)
+        output_dir = Path(native_str(tmpdir)) / 'out'
+
+        caplog.set_level(logging.INFO)
+
+        aligner = DummyAligner()
+        batch.identify_insertions_batch(
+            aligner, samples, output_dir=output_dir, max_threads=2)
+
+        for sample in samples:
+            with (output_dir / sample.name / 'imfusion.log').open() as file_:
+                log_text = file_.read()
+
+            assert 'Annotating {}'.format(sample.name) in log_text
+
+            others = [s.name for s in samples if s.name != sample.name]
+            for other in others:
+                assert 'Annotating {}'.format(other) not in log_text
+
+
+class TestStageScheduler(object):
+    """Tests for the StageScheduler class."""
+
+    def test_threads(self):
+        """Tests light stage waits for threads reserved by heavy stage."""
+
+        scheduler = batch.StageScheduler(
+            max_threads=4, max_memory=10, stage_threads=4, heavy_memory=8)
+
+        started = threading.Event()
+        release = threading.Event()
+        finished = threading.Event()
+
+        def _heavy():
+            with scheduler.stage('alignment', heavy=True):
+                started.set()
+                release.wait(5)
+
+        def _light():
+            with scheduler.stage('annotation'):
+                finished.set()
+
+        heavy = threading.Thread(target=_heavy)
+        heavy.start()
+        started.wait(5)
+
+        light = threading.Thread(target=_light)
+        light.start()
+
+        assert not finished.wait(0.1)
+
+        release.set()
+        assert finished.wait(5)
+
+        heavy.join()
+        light.join()
+
+    def test_memory(self):
+        """Tests heavy stages are limited by the memory budget."""
+
+        scheduler = batch.StageScheduler(
+            max_threads=4, max_memory=10, stage_threads=1, heavy_memory=6)
+
+        with scheduler.stage('alignment', heavy=True):
+            assert scheduler._fits(1, 0)
+            assert not scheduler._fits(1, 6)
+
+    def test_light_threads(self):
+        """Tests light stages reserve the threads of a stage."""
+
+        scheduler = batch.StageScheduler(max_threads=4, stage_threads=2)
+
+        with scheduler.stage('annotation'), scheduler.stage('annotation'):
+            assert scheduler._threads == 4
+            assert not scheduler._fits(2, 0)
+
+    def test_idle(self):
+        """Tests stages exceeding the budgets run if nothing else runs."""
+
+        scheduler = batch.StageScheduler(
+            max_threads=2, max_memory=4, stage_threads=8, heavy_memory=16)
+
+        with scheduler.stage('alignment', heavy=True):
+            pass
+
+
+class TestNumWorkers(object):
+    """Tests for the _num_workers function."""
+
+    def test_threads(self):
+        """Tests limiting workers by threads."""
+
+        aligner = DummyAligner(threads=4)
+
+        assert batch._num_workers(aligner, 10, 16, None, None) == 4
+        assert batch._num_workers(aligner, 2, 16, None, None) == 2
+        assert batch._num_workers(aligner, 10, 2, None, None) == 1
+
+    def test_memory(self):
+        """Tests limiting workers by memory, accounting for shared memory."""
+
+        aligner = DummyAligner(threads=1, shared_memory=25e9)
+
+        assert batch._num_workers(aligner, 10, 16, 40, 4) == 3
+        assert batch._num_workers(aligner, 10, 16, 20, 4) == 1
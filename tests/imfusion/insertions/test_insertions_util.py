@@ -6,9 +6,16 @@ from __future__ import absolute_import, division, print_function
 from builtins import *
 # pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
 
+import gzip
+import logging
+import threading
+
 import pytest
 
+from future.utils import native_str
 import numpy as np
+from pathlib2 import Path
+import pysam
 import toolz
 
 from imfusion.insertions import util
@@ -100,6 +107,97 @@ class TestExtractInsertions(object):
         assert insertions[0].metadata['gene_id'] == 'ENSMUSG00000085584'
         assert insertions[0].metadata['novel_transcript'] == 'STRG.14160.1'
 
+    def test_assembly_callable(self, rgag1_fusion, gtf_path, features_path,
+                               assembled_gtf_path):
+        """Tests example case with assembled gtf given as callable."""
+
+        insertions = util.extract_insertions(
+            [rgag1_fusion],
+            gtf_path,
+            features_path,
+            assembled_gtf_path=lambda fusions: assembled_gtf_path)
+        insertions = list(insertions)
+
+        assert len(insertions) == 1
+        assert insertions[0].metadata['novel_transcript'] == 'STRG.14160.1'
+
+
+class TestAssemblyRegions(object):
+    """Tests for the assembly_regions function."""
+
+    def test_example(self, fusion):
+        """Tests merging of padded fusion regions."""
+
+        fusions = [
+            fusion,
+            fusion._replace(anchor_genome=52141500),
+            fusion._replace(seqname='2', anchor_genome=5000),
+            fusion._replace(
+                anchor_genome=1000,
+                metadata=frozendict({'gene_id': 'ENSMUSG00000022637'}))
+        ]
+
+        regions = util.assembly_regions(fusions, padding=1000)
+
+        assert regions == [('16', 52140017, 52142500), ('2', 3922, 6000)]
+
+    def test_include_annotated(self, fusion):
+        """Tests including of annotated fusions."""
+
+        annotated = fusion._replace(
+            metadata=frozendict({'gene_id': 'ENSMUSG00000022637'}))
+
+        assert util.assembly_regions([annotated]) == []
+
+        regions = util.assembly_regions(
+            [annotated], padding=0, skip_annotated=False)
+        assert regions == [('16', 52141017, 52141095)]
+
+
+@pytest.fixture
+def region_bam_path(tmpdir):
+    """Example sorted and indexed alignment."""
+
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+              'SQ': [{'SN': '2', 'LN': 100000},
+                     {'SN': '10', 'LN': 100000}]}  # yapf: disable
+
+    bam_path = native_str(tmpdir / 'alignment.bam')
+    with pysam.AlignmentFile(bam_path, 'wb', header=header) as bam:
+        for i, (ref_id, pos, cigar) in enumerate([
+                (0, 100, '50M'), (0, 950, '50M1000N50M'),
+                (0, 5000, '50M'), (1, 200, '50M')]):  # yapf: disable
+            segment = pysam.AlignedSegment()
+            segment.query_name = 'R{}'.format(i)
+            segment.reference_id = ref_id
+            segment.reference_start = pos
+            segment.cigarstring = cigar
+            segment.query_sequence = 'A' * segment.infer_query_length()
+            bam.write(segment)
+
+    pysam.index(bam_path)
+
+    return Path(bam_path)
+
+
+class TestSubsetAlignment(object):
+    """Tests for the subset_alignment function."""
+
+    def test_example(self, region_bam_path, tmpdir):
+        """Tests subset of regions, including reads spanning regions."""
+
+        output_path = Path(native_str(tmpdir / 'subset.bam'))
+
+        regions = [('10', 0, 1000), ('2', 0, 1000), ('2', 1500, 2500),
+                   ('X', 0, 1000)]
+        util.subset_alignment(region_bam_path, regions, output_path)
+
+        with pysam.AlignmentFile(native_str(output_path)) as bam:
+            names = [read.query_name for read in bam]
+
+        assert names == ['R0', 'R1', 'R3']
+        assert Path(native_str(output_path) + '.bai').exists()
+
 
 class TestAnnotateTransposon(object):
     """Tests annotate_transposon function."""
@@ -124,6 +222,20 @@ class TestAnnotateTransposon(object):
         assert 'feature_name' not in annotated.metadata
         assert fusion == annotated
 
+    def test_frame_example(self, fusion, features_path):
+        """Tests annotation using pre-loaded features."""
+
+        features = util.TransposonFeature.read_csv(features_path, sep='\t')
+
+        fusions = [fusion, fusion._replace(anchor_transposon=100), fusion]
+        annotated = list(
+            util.annotate_fusions_for_transposon(fusions, features))
+
+        assert len(annotated) == 3
+        assert annotated[0].metadata['feature_name'] == 'En2SA'
+        assert 'feature_name' not in annotated[1].metadata
+        assert annotated[2].metadata['feature_name'] == 'En2SA'
+
 
 @pytest.fixture
 def gtf_path():
@@ -343,6 +455,22 @@ class TestAnnotateWithAssembly(object):
         assert annotated.metadata['gene_name'] == 'Rgag1'
         assert annotated.metadata['gene_strand'] == 1
         assert annotated.metadata['novel_transcript'] == 'STRG.14160.1'
+        assert isinstance(annotated.metadata, frozendict)
+
+    def test_array_reference(self, rgag1_fusion, gtf_path,
+                             assembled_gtf_path):
+        """Tests example using an array-based gene reference."""
+
+        gtf_ref = util.ArrayTranscriptReference.from_gtf(gtf_path)
+        assem_ref = util.TranscriptReference.from_gtf(assembled_gtf_path)
+
+        annotated = list(
+            util.annotate_fusions_for_assembly([rgag1_fusion], gtf_ref,
+                                               assem_ref))
+
+        assert len(annotated) == 1
+        assert annotated[0].metadata['gene_id'] == 'ENSMUSG00000085584'
+        assert annotated[0].metadata['novel_transcript'] == 'STRG.14160.1'
 
     def test_neg_example(self, rgag1_fusion, gtf_path, assembled_gtf_path):
 
@@ -358,3 +486,188 @@ class TestAnnotateWithAssembly(object):
         assert len(annotated) == 1
         assert 'novel_transcript' not in annotated[0].metadata
         assert 'gene_name' not in annotated[0].metadata
+
+
+@pytest.fixture
+def insertion_frame(insertion):
+    """Example insertion frame, containing the insertion and two variants."""
+
+    wrong_feature = insertion._replace(
+        id='INS_2',
+        metadata=toolz.merge(insertion.metadata, {'feature_type': 'LTR'}))
+
+    wrong_orientation = insertion._replace(
+        id='INS_3',
+        metadata=toolz.merge(insertion.metadata, {'feature_strand': 1,
+                                                  'gene_name': 'Fgfr2'}))
+
+    return Insertion.to_frame([insertion, wrong_feature, wrong_orientation])
+
+
+class TestFilterInsertionsFrame(object):
+    """Tests for filter_insertions_frame."""
+
+    def test_example(self, insertion_frame):
+        """Tests default filters."""
+
+        filtered = util.filter_insertions_frame(insertion_frame)
+        assert list(filtered['id']) == ['INS_1']
+
+    def test_blacklist(self, insertion_frame):
+        """Tests example filtered by blacklist."""
+
+        filtered = util.filter_insertions_frame(
+            insertion_frame,
+            features=False,
+            orientation=False,
+            blacklist={'Cblb'})
+        assert list(filtered['id']) == ['INS_3']
+
+    def test_orientation_na(self, insertion_frame):
+        """Tests if NaN orientations are kept unless drop_na is given."""
+
+        insertion_frame['gene_strand'] = np.nan
+
+        filtered = util.filter_wrong_orientation_frame(insertion_frame)
+        assert len(filtered) == 3
+
+        filtered = util.filter_wrong_orientation_frame(
+            insertion_frame, drop_na=True)
+        assert len(filtered) == 0
+
+    def test_matches_objects(self, insertion_frame):
+        """Tests if frame filters agree with the object-based filters."""
+
+        objects = Insertion.from_frame(insertion_frame)
+        expected = util.filter_insertions(objects, blacklist={'Fgfr2'})
+
+        filtered = util.filter_insertions_frame(
+            insertion_frame, blacklist={'Fgfr2'})
+
+        assert list(filtered['id']) == [ins.id for ins in expected]
+
+
+class TestTranscriptReference(object):
+    """Tests for the TranscriptReference class."""
+
+    def test_from_gtf_workers(self, fusion, gtf_path):
+        """Tests if building with multiple workers gives the same result."""
+
+        serial = util.TranscriptReference.from_gtf(gtf_path)
+        parallel = util.TranscriptReference.from_gtf(gtf_path, workers=2)
+
+        assert (parallel.overlap_genes(fusion.genome_region) ==
+                serial.overlap_genes(fusion.genome_region))
+
+        transcript = serial.overlap_transcripts(fusion.genome_region)[0]
+        assert (sorted(parallel.get_exons(transcript.id)) ==
+                sorted(serial.get_exons(transcript.id)))
+
+    def test_unknown_chromosome(self, gtf_path):
+        """Tests regions on chromosomes without transcripts."""
+
+        reference = util.TranscriptReference.from_gtf(gtf_path)
+        assert reference.overlap_genes(('MT', 100, 200)) == []
+
+    def test_from_gtf_threaded(self, fusion, gtf_path, mocker, caplog):
+        """Tests no processes are forked whilst other threads are running."""
+
+        pool_mock = mocker.patch.object(util.multiprocessing, 'Pool')
+        caplog.set_level(logging.DEBUG)
+
+        result = {}
+
+        def _build():
+            result['reference'] = util.TranscriptReference.from_gtf(
+                gtf_path, workers=2)
+
+        thread = threading.Thread(target=_build)
+        thread.start()
+        thread.join()
+
+        assert not pool_mock.called
+        assert result['reference'].overlap_genes(fusion.genome_region)
+        assert 'processing chromosomes serially' in caplog.text
+
+    def test_chromosome_exons(self, gtf_path, mocker):
+        """Tests exons are grouped per chromosome and cached."""
+
+        reference = util.TranscriptReference.from_gtf(gtf_path)
+        chromosomes = set(reference.exon_frame()['chromosome'])
+
+        frame_spy = mocker.spy(reference, 'exon_frame')
+        groups = reference.chromosome_exons()
+
+        assert set(groups) == chromosomes
+        assert all(grp['start'].is_monotonic_increasing
+                   for grp in groups.values())
+
+        assert reference.chromosome_exons() is groups
+        assert frame_spy.call_count == 1
+
+
+class TestArrayTranscriptReference(object):
+    """Tests for the ArrayTranscriptReference class."""
+
+    def test_example(self, fusion, gtf_path, tmpdir):
+        """Tests if saved/loaded reference matches the tree reference."""
+
+        tree_ref = util.TranscriptReference.from_gtf(gtf_path)
+
+        annotation_path = Path(native_str(tmpdir / 'annotation'))
+        util.ArrayTranscriptReference.from_gtf(gtf_path).save(annotation_path)
+        array_ref = util.ArrayTranscriptReference.load(annotation_path)
+
+        genes = array_ref.overlap_genes(fusion.genome_region)
+        assert genes == tree_ref.overlap_genes(fusion.genome_region)
+        assert genes[0].name == 'Cblb'
+
+        transcripts = array_ref.overlap_transcripts(fusion.genome_region)
+        assert (sorted(transcripts) ==
+                sorted(tree_ref.overlap_transcripts(fusion.genome_region)))
+
+        exons = array_ref.get_exons(transcripts[0].id)
+        assert exons == sorted(tree_ref.get_exons(transcripts[0].id))
+
+    def test_no_overlap(self, fusion, gtf_path):
+        """Tests regions without overlap or with an unknown chromosome."""
+
+        array_ref = util.ArrayTranscriptReference.from_gtf(gtf_path)
+
+        assert array_ref.overlap_genes(('16', 100, 200)) == []
+        assert array_ref.overlap_genes(('MT', 100, 200)) == []
+
+        with pytest.raises(KeyError):
+            array_ref.get_exons('ENSMUST_unknown')
+
+
+class TestCountLines(object):
+    """Tests for the count_lines function."""
+
+    def test_example(self, tmpdir):
+        """Tests counting lines in plain and gzipped files."""
+
+        plain_path = Path(native_str(tmpdir / 'reads.fastq'))
+        with plain_path.open('wb') as file_:
+            file_.write(b'@R1\nACGT\n+\nIIII\n')
+
+        gzip_path = Path(native_str(tmpdir / 'reads.fastq.gz'))
+        with gzip.open(native_str(gzip_path), 'wb') as file_:
+            file_.write(b'@R1\nACGT\n+\nIIII\n@R2\nACGT\n+\nIIII\n')
+
+        assert util.count_lines(plain_path) == 4
+        assert util.count_lines(gzip_path) == 8
+
+        # Multiple files (lanes) are counted together.
+        assert util.count_lines([plain_path, gzip_path]) == 12
+
+    def test_decompress_command(self, tmpdir):
+        """Tests counting lines using an external decompression command."""
+
+        gzip_path = Path(native_str(tmpdir / 'reads.fastq.gz'))
+        with gzip.open(native_str(gzip_path), 'wb') as file_:
+            file_.write(b'@R1\nACGT\n+\nIIII\n@R2\nACGT\n+\nIIII\n')
+
+        count = util.count_lines(
+            gzip_path, decompress_command=['gunzip', '-c'])
+        assert count == 8
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Tests for imfusion.insertions.manifest module."""
+
+# pylint: disable=wildcard-import,redefined-builtin,unused-wildcard-import
+from __future__ import absolute_import, division, print_function
+from builtins import *
+# pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
+
+from future.utils import native_str
+from pathlib2 import Path
+import pytest
+
+from imfusion.insertions.manifest import StageManifest
+
+# pylint: disable=no-self-use,redefined-outer-name
+
+
+@pytest.fixture
+def stage_files(tmpdir):
+    """Example input/output files of a stage."""
+
+    output_dir = Path(native_str(tmpdir))
+
+    input_path = output_dir / 'reads.fastq.gz'
+    output_path = output_dir / 'alignment.bam'
+
+    with input_path.open('wb') as file_:
+        file_.write(b'reads')
+
+    with output_path.open('wb') as file_:
+        file_.write(b'alignment')
+
+    return output_dir, input_path, output_path
+
+
+class TestStageManifest(object):
+    """Tests for the StageManifest class."""
+
+    def test_record(self, stage_files):
+        """Tests recording a completed stage."""
+
+        output_dir, input_path, output_path = stage_files
+        kws = dict(
+            inputs=[input_path],
+            params={'min_flank': 12,
+                    'index_path': Path('/path/to/index')},
+            outputs=[output_path])
+
+        manifest = StageManifest.for_sample(output_dir)
+        assert not manifest.is_complete('alignment', **kws)
+
+        manifest.record('alignment', **kws)
+        assert manifest.is_complete('alignment', **kws)
+
+        # Check manifest is persisted.
+        manifest2 = StageManifest.for_sample(output_dir)
+        assert manifest2.stages == ['alignment']
+        assert manifest2.is_complete('alignment', **kws)
+
+    def test_changed_params(self, stage_files):
+        """Tests stage is incomplete if parameters change."""
+
+        output_dir, input_path, output_path = stage_files
+
+        manifest = StageManifest.for_sample(output_dir)
+        manifest.record(
+            'alignment',
+            inputs=[input_path],
+            params={'min_flank': 12},
+            outputs=[output_path])
+
+        assert not manifest.is_complete(
+            'alignment',
+            inputs=[input_path],
+            params={'min_flank': 20},
+            outputs=[output_path])
+
+    def test_changed_files(self, stage_files):
+        """Tests stage is incomplete if inputs or outputs change."""
+
+        output_dir, input_path, output_path = stage_files
+        kws = dict(inputs=[input_path], outputs=[output_path])
+
+        manifest = StageManifest.for_sample(output_dir)
+        manifest.record('alignment', **kws)
+
+        # Truncated output.
+        with output_path.open('wb') as file_:
+            file_.write(b'align')
+
+        assert not manifest.is_complete('alignment', **kws)
+
+        # Missing output.
+        manifest.record('alignment', **kws)
+        output_path.unlink()
+
+        assert not manifest.is_complete('alignment', **kws)
+
+        # Changed input.
+        with output_path.open('wb') as file_:
+            file_.write(b'alignment')
+
+        manifest.record('alignment', **kws)
+
+        with input_path.open('wb') as file_:
+            file_.write(b'more reads')
+
+        assert not manifest.is_complete('alignment', **kws)
+
+    def test_invalidate(self, stage_files):
+        """Tests invalidating a stage."""
+
+        output_dir, input_path, output_path = stage_files
+        kws = dict(inputs=[input_path], outputs=[output_path])
+
+        manifest = StageManifest.for_sample(output_dir)
+        manifest.record('alignment', **kws)
+        manifest.invalidate('alignment')
+
+        assert not manifest.is_complete('alignment', **kws)
+        assert StageManifest.for_sample(output_dir).stages == []
+
+    def test_corrupt(self, stage_files):
+        """Tests reading a corrupt manifest."""
+
+        output_dir = stage_files[0]
+
+        with (output_dir / 'stages.json').open('w') as file_:
+            file_.write('{"alignment": ')
+
+        assert StageManifest.for_sample(output_dir).stages == []
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Tests for imfusion.insertions.prefilter module."""
+
+# pylint: disable=wildcard-import,redefined-builtin,unused-wildcard-import
+from __future__ import absolute_import, division, print_function
+from builtins import *
+# pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
+
+import gzip
+import threading
+
+from future.utils import native_str
+from pathlib2 import Path
+import pytest
+
+from imfusion.insertions import prefilter
+
+# pylint: disable=no-self-use,redefined-outer-name
+
+
+@pytest.fixture
+def fasta_path(tmpdir):
+    """Example transposon sequence."""
+
+    file_path = Path(native_str(tmpdir)) / 'transposon.fa'
+
+    with file_path.open('w') as file_:
+        file_.write('>T2onc\nACGTTGCAAGGN\n')
+
+    return file_path
+
+
+def _write_fastq(file_path, seqs):
+    with gzip.open(native_str(file_path), 'wb') as file_:
+        for i, seq in enumerate(seqs):
+            record = '@R{}\n{}\n+\n{}\n'.format(i, seq, 'I' * len(seq))
+            file_.write(record.encode('ascii'))
+
+
+def _read_names(file_path):
+    with gzip.open(native_str(file_path), 'rb') as file_:
+        lines = file_.read().decode('ascii').splitlines()
+    return lines[::4]
+
+
+class TestBuildKmerSet(object):
+    """Tests for the build_kmer_set function."""
+
+    def test_example(self, fasta_path):
+        """Tests example with ambiguous base and reverse strand."""
+
+        kmers = prefilter.build_kmer_set(fasta_path, k=10)
+
+        assert kmers == {b'ACGTTGCAAG', b'CGTTGCAAGG',
+                         b'CTTGCAACGT', b'CCTTGCAACG'}  # yapf: disable
+
+
+class TestPrefilterFastq(object):
+    """Tests for the prefilter_fastq function."""
+
+    def test_single_end(self, fasta_path, tmpdir):
+        """Tests single-end example."""
+
+        fastq_path = Path(native_str(tmpdir)) / 'in.fastq.gz'
+        _write_fastq(fastq_path, ['AAAAACGTTGCAAGAAAA',
+                                  'AAAAAAAAAAAAAAAAAA',
+                                  'TTCTTGCAACGTTTTTTT'])  # yapf: disable
+
+        output_path = Path(native_str(tmpdir)) / 'out.fastq.gz'
+
+        kmers = prefilter.build_kmer_set(fasta_path, k=10)
+        num_selected = prefilter.prefilter_fastq(
+            fastq_path, output_path, kmers=kmers, k=10, chunk_size=2)
+
+        assert num_selected == 2
+        assert _read_names(output_path) == ['@R0', '@R2']
+
+    def test_paired_end(self, fasta_path, tmpdir):
+        """Tests paired-end example, in which either mate may match."""
+
+        tmp_dir = Path(native_str(tmpdir))
+
+        _write_fastq(tmp_dir / 'in.R1.fastq.gz',
+                     ['AAAAAAAAAAAAAAAAAA', 'AAAAAAAAAAAAAAAAAA'])
+        _write_fastq(tmp_dir / 'in.R2.fastq.gz',
+                     ['AAAAAAAAAAAAAAAAAA', 'AAAAACGTTGCAAGAAAA'])
+
+        kmers = prefilter.build_kmer_set(fasta_path, k=10)
+        num_selected = prefilter.prefilter_fastq(
+            tmp_dir / 'in.R1.fastq.gz',
+            tmp_dir / 'out.R1.fastq.gz',
+            kmers=kmers,
+            k=10,
+            fastq2_path=tmp_dir / 'in.R2.fastq.gz',
+            output2_path=tmp_dir / 'out.R2.fastq.gz',
+            workers=2)
+
+        assert num_selected == 1
+        assert _read_names(tmp_dir / 'out.R1.fastq.gz') == ['@R1']
+        assert _read_names(tmp_dir / 'out.R2.fastq.gz') == ['@R1']
+
+    def test_multiple_lanes(self, fasta_path, tmpdir):
+        """Tests single-end example with multiple lanes."""
+
+        tmp_dir = Path(native_str(tmpdir))
+
+        _write_fastq(tmp_dir / 'in.L1.fastq.gz',
+                     ['AAAAACGTTGCAAGAAAA', 'AAAAAAAAAAAAAAAAAA'])
+        _write_fastq(tmp_dir / 'in.L2.fastq.gz',
+                     ['AAAAAAAAAAAAAAAAAA', 'TTCTTGCAACGTTTTTTT'])
+
+        kmers = prefilter.build_kmer_set(fasta_path, k=10)
+        num_selected = prefilter.prefilter_fastq(
+            [tmp_dir / 'in.L1.fastq.gz', tmp_dir / 'in.L2.fastq.gz'],
+            tmp_dir / 'out.fastq.gz',
+            kmers=kmers,
+            k=10)
+
+        assert num_selected == 2
+        assert _read_names(tmp_dir / 'out.fastq.gz') == ['@R0', '@R1']
+
+    def test_decompress_command(self, fasta_path, tmpdir):
+        """Tests decompression using an external command."""
+
+        tmp_dir = Path(native_str(tmpdir))
+
+        _write_fastq(tmp_dir / 'in.fastq.gz',
+                     ['AAAAACGTTGCAAGAAAA', 'AAAAAAAAAAAAAAAAAA'])
+
+        kmers = prefilter.build_kmer_set(fasta_path, k=10)
+        num_selected = prefilter.prefilter_fastq(
+            tmp_dir / 'in.fastq.gz',
+            tmp_dir / 'out.fastq.gz',
+            kmers=kmers,
+            k=10,
+            decompress_command=['gunzip', '-c'])
+
+        assert num_selected == 1
+        assert _read_names(tmp_dir / 'out.fastq.gz') == ['@R0']
+
+    def test_truncated(self, fasta_path, tmpdir):
+        """Tests input with a truncated last record."""
+
+        tmp_dir = Path(native_str(tmpdir))
+
+        with gzip.open(native_str(tmp_dir / 'in.fastq.gz'), 'wb') as file_:
+            file_.write(b'@R0\nAAAAACGTTGCAAGAAAA\n+\n')
+
+        kmers = prefilter.build_kmer_set(fasta_path, k=10)
+
+        with pytest.raises(ValueError) as excinfo:
+            prefilter.prefilter_fastq(
+                tmp_dir / 'in.fastq.gz',
+                tmp_dir / 'out.fastq.gz',
+                kmers=kmers,
+                k=10)
+
+        assert 'in.fastq.gz' in str(excinfo.value)
+
+    def test_mismatched_mates(self, fasta_path, tmpdir):
+        """Tests paired-end input with different numbers of reads."""
+
+        tmp_dir = Path(native_str(tmpdir))
+
+        _write_fastq(tmp_dir / 'in.R1.fastq.gz',
+                     ['AAAAAAAAAAAAAAAAAA', 'AAAAAAAAAAAAAAAAAA'])
+        _write_fastq(tmp_dir / 'in.R2.fastq.gz', ['AAAAAAAAAAAAAAAAAA'])
+
+        kmers = prefilter.build_kmer_set(fasta_path, k=10)
+
+        with pytest.raises(ValueError):
+            prefilter.prefilter_fastq(
+                tmp_dir / 'in.R1.fastq.gz',
+                tmp_dir / 'out.R1.fastq.gz',
+                kmers=kmers,
+                k=10,
+                fastq2_path=tmp_dir / 'in.R2.fastq.gz',
+                output2_path=tmp_dir / 'out.R2.fastq.gz')
+
+    def test_threaded(self, fasta_path, tmpdir, mocker):
+        """Tests no processes are forked whilst other threads are running."""
+
+        pool_mock = mocker.patch.object(prefilter.multiprocessing, 'Pool')
+
+        fastq_path = Path(native_str(tmpdir)) / 'in.fastq'
+        with fastq_path.open('wb') as file_:
+            file_.write(b'@R0\nAAAAACGTTGCAAGAAAA\n+\nIIIIIIIIIIIIIIIIII\n'
+                        b'@R1\nAAAAAAAAAAAAAAAAAA\n+\nIIIIIIIIIIIIIIIIII\n')
+
+        output_path = Path(native_str(tmpdir)) / 'out.fastq.gz'
+        kmers = prefilter.build_kmer_set(fasta_path, k=10)
+
+        result = {}
+
+        def _prefilter():
+            result['selected'] = prefilter.prefilter_fastq(
+                fastq_path, output_path, kmers=kmers, k=10, workers=2)
+
+        thread = threading.Thread(target=_prefilter)
+        thread.start()
+        thread.join()
+
+        assert not pool_mock.called
+        assert result['selected'] == 1
+        assert _read_names(output_path) == ['@R0']
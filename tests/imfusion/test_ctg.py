@@ -184,6 +184,21 @@ class TestApplyWindow(object):
             ctg._apply_gene_window(Gene('1', 100, 120, None), window=(80, 50))
 
 
+class TestBuildGeneWindows(object):
+    """Tests for the build_gene_windows function."""
+
+    def test_no_shared_chromosomes(self, mocker):
+        """Tests error if reference sequence and gtf share no chromosomes."""
+
+        reference = mocker.Mock(fasta={'1': None})
+
+        gtf_mock = mocker.patch.object(ctg, 'GtfIterator')
+        gtf_mock.return_value.contigs = ['2']
+
+        with pytest.raises(ValueError, match='No chromosomes are shared'):
+            ctg.build_gene_windows(reference)
+
+
 class TestSubsetToWindows(object):
     """Tests subset_to_windows function."""
 
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Tests for imfusion.pipeline module."""
+
+# pylint: disable=wildcard-import,redefined-builtin,unused-wildcard-import
+from __future__ import absolute_import, division, print_function
+from builtins import *
+# pylint: enable=wildcard-import,redefined-builtin,unused-wildcard-import
+
+from future.utils import native_str
+from pathlib2 import Path
+import pandas as pd
+import pytest
+
+from imfusion import pipeline
+from imfusion.build import Reference
+from imfusion.build.indexers import base as indexer_base
+from imfusion.insertions.batch import Sample
+
+# pylint: disable=no-self-use,redefined-outer-name
+
+
+@pytest.fixture
+def aligner(mocker):
+    """Mock aligner."""
+
+    aligner = mocker.Mock()
+    aligner.identify_insertions.return_value = iter(['INS_1', 'INS_2'])
+    aligner.reference.exon_gtf_path = Path('/path/to/exons.gtf')
+
+    return aligner
+
+
+@pytest.fixture
+def sample():
+    """Example sample."""
+    return Sample(
+        name='S1',
+        fastq_path=[Path('S1.R1.fastq.gz')],
+        fastq2_path=[Path('S1.R2.fastq.gz')])
+
+
+class TestPipeline(object):
+    """Tests for the Pipeline class."""
+
+    def test_identify_insertions(self, aligner, sample, mocker, tmpdir):
+        """Tests identifying insertions for a sample."""
+
+        write_mock = mocker.patch.object(pipeline, 'write_insertions')
+
+        output_dir = Path(native_str(tmpdir))
+        pipe = pipeline.Pipeline(aligner, output_dir=output_dir)
+
+        insertions = pipe.identify_insertions(sample)
+        assert insertions == ['INS_1', 'INS_2']
+
+        aligner.identify_insertions.assert_called_once_with(
+            fastq_path=sample.fastq_path,
+            output_dir=output_dir / 'S1',
+            fastq2_path=sample.fastq2_path)
+
+        write_mock.assert_called_once_with(
+            insertions, output_dir / 'S1' / 'insertions.txt')
+
+    def test_count_expression(self, aligner, sample, mocker, tmpdir):
+        """Tests generating expression counts for a sample."""
+
+        counts = pd.DataFrame({'S1': [1, 2]})
+        counts_mock = mocker.patch.object(
+            pipeline, 'generate_exon_counts', return_value=counts)
+
+        output_dir = Path(native_str(tmpdir))
+        (output_dir / 'S1').mkdir()
+
+        pipe = pipeline.Pipeline(aligner, output_dir=output_dir)
+        result = pipe.count_expression(sample, paired=True, stranded='reverse')
+
+        bam_path = output_dir / 'S1' / 'alignment.bam'
+        counts_mock.assert_called_once_with(
+            [bam_path],
+            gtf_path=Path('/path/to/exons.gtf'),
+            names={str(bam_path): 'S1'},
+            extra_kws={'-s': 2,
+                       '-p': True})
+
+        assert result is counts
+        assert (output_dir / 'S1' / 'expression.txt').exists()
+
+    def test_test_ctgs(self, aligner, mocker, tmpdir):
+        """Tests gene windows are re-used between CTG tests."""
+
+        windows_mock = mocker.patch.object(
+            pipeline.ctg,
+            'build_gene_windows',
+            return_value={'a': ('1', 0, 10)})
+        test_mock = mocker.patch.object(pipeline.ctg, 'test_ctgs')
+
+        pipe = pipeline.Pipeline(aligner, output_dir=Path(native_str(tmpdir)))
+
+        pipe.test_ctgs([], pattern='TA', window=(2000, 2000))
+        pipe.test_ctgs([], pattern='TA', window=[2000, 2000])
+
+        windows_mock.assert_called_once_with(
+            aligner.reference, window=(2000, 2000), chromosomes=None)
+
+        assert test_mock.call_count == 2
+        assert test_mock.call_args[1]['gene_windows'] == {'a': ('1', 0, 10)}
+
+        # Windows are rebuilt for other chromosomes.
+        pipe.test_ctgs([], chromosomes=['1'], window=(2000, 2000))
+        assert windows_mock.call_count == 2
+
+
+class TestReferenceState(object):
+    """Tests for re-use of loaded reference data."""
+
+    def test_loaded_once(self, mocker):
+        """Tests reference data is only loaded once."""
+
+        from_gtf_mock = mocker.patch.object(indexer_base.TranscriptReference,
+                                            'from_gtf')
+
+        reference = Reference(
+            pytest.helpers.data_path('ctg_reference', relative_to=__file__))
+
+        assert reference.fasta is reference.fasta
+        assert set(reference.fasta.keys()) == {'1', '2'}
+
+        gene_ref = reference.transcript_reference(workers=2)
+        assert reference.transcript_reference() is gene_ref
+
+        from_gtf_mock.assert_called_once_with(
+            reference.indexed_gtf_path, workers=2)